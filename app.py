@@ -1,17 +1,38 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, url_for, stream_with_context
 import sys
 import os
+import json
 import re
+import time
 from search_engine import search_query
-from index_builder import build_index
+from index_builder import DEFAULT_LIMITMB
+from build_jobs import BuildJobManager
+from shards import SHARD_STRATEGIES, is_sharded, load_shard_config
+from metrics import stage, observe_stage, REQUEST_SECONDS, register_gauges, render_metrics
 import traceback
 
 # 初始化Flask应用
 app = Flask(__name__)
 
+# 后台索引构建任务
+build_jobs = BuildJobManager()
+
 # 导入现有功能模块
-from main import execute_query, format_results, parse_search_args
+from main import (execute_query, execute_queries, fetch_snippets, iter_snippets, format_results, parse_search_args,
+                  suggest_query, result_cache, Config, QueryBudget, setup_logging)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    """按端点记录请求耗时 (流式响应只计到响应头发出为止)"""
+    start = g.get('request_start')
+    if start is not None and request.endpoint != 'static':
+        REQUEST_SECONDS.observe(request.endpoint or 'not_found', time.perf_counter() - start)
+    return response
 
 @app.route('/')
 def index():
@@ -25,86 +46,263 @@ def search():
         # 获取查询参数
         query_str = request.form.get('query', '')
         top_n = int(request.form.get('top_n', 10))
+        # 快速模式只返回 rank/score/docno，摘要由页面通过 /snippets 按需获取
+        fast = request.form.get('fast', '').lower() in ('1', 'true', 'on')
+        # 流式模式以 NDJSON 逐行输出，每个结果的摘要生成后立即发送
+        stream = request.form.get('stream', '').lower() in ('1', 'true', 'on')
+        timeout = request_timeout(request.form.get('timeout'))
+        # explain=1 在响应中附带执行过程 (解析后的查询、各子句的词项统计、各阶段耗时)，
+        # profile=1 另外附带 cProfile 统计；两者都不经过结果缓存，也不使用流式输出
+        profile = request.form.get('profile', '').lower() in ('1', 'true', 'on')
+        explain = profile or request.form.get('explain', '').lower() in ('1', 'true', 'on')
         
         if not query_str:
             return jsonify({'error': '查询不能为空'}), 400
-            
-        # 执行查询
-        results = execute_query(query_str, top_n)
         
-        # 格式化结果为JSON友好格式
-        formatted_results = []
-        for res in results:
-            # 将ANSI颜色代码转换为HTML标签
-            snippet_html = highlight_result_filter(res['snippet'])
+        if stream and not explain:
+            return ndjson_response(stream_search(query_str, top_n, timeout), '搜索出错')
             
-            formatted_results.append({
-                'rank': res['rank'],
-                'score': res['score'],
-                'docno': res['docno'],
-                'snippet': snippet_html  # 使用转换后的HTML
-            })
+        # 执行查询，摘要直接以 HTML <span> 高亮；超出时间预算时 partial 为 true
+        results = execute_query(query_str, top_n, markup=None if fast else "html", timeout=timeout,
+                                explain=explain, profile=profile)
             
-        return jsonify({
-            'query': query_str,
-            'total': len(results),
-            'results': formatted_results
-        })
+        with stage("json"):
+            response = {
+                'query': query_str,
+                'total': len(results),
+                'results': results,
+                'partial': results.partial,
+                'elapsed': round(results.elapsed, 4)
+            }
+            if results.explain is not None:
+                response['explain'] = results.explain
+            return jsonify(response)
     
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': f'搜索出错: {str(e)}'}), 500
 
+def request_timeout(value):
+    """请求指定的时间预算 (秒)；未指定时使用 Config.QUERY_TIMEOUT，Config.QUERY_TIMEOUT 不为 0 时作为上限"""
+    if value in (None, ''):
+        return Config.QUERY_TIMEOUT
+    timeout = max(0.0, float(value))
+    if Config.QUERY_TIMEOUT:
+        return min(timeout, Config.QUERY_TIMEOUT) if timeout else Config.QUERY_TIMEOUT
+    return timeout
+
+def stream_search(query_str, top_n, timeout=None):
+    """
+    流式搜索的输出行：先是查询和命中数 {"query", "total"}，
+    然后每个结果一行 {"rank", "score", "docno", "snippet"}，最后是 {"done", "elapsed", "partial"}。
+    排名和摘要共用一个时间预算，预算用完后其余结果的 snippet 为 null
+    """
+    timeout = Config.QUERY_TIMEOUT if timeout is None else timeout
+    budget = QueryBudget(timeout)
+    ranking = execute_query(query_str, top_n, markup=None, timeout=timeout)
+    budget.exhausted = ranking.partial
+    yield {'query': query_str, 'total': len(ranking)}
+    snippets = iter_snippets(query_str, [res['docno'] for res in ranking])
+    for res in ranking:
+        if budget.expired():
+            yield dict(res, snippet=None)
+            continue
+        _, snippet = next(snippets)
+        yield dict(res, snippet=snippet or '')
+    snippets.close()
+    yield {'done': True, 'elapsed': round(budget.elapsed, 4), 'partial': budget.exhausted}
+
+def ndjson_response(lines, error_prefix):
+    """
+    把字典序列逐行编码为 NDJSON 流式响应，服务端只保留当前正在输出的一行。
+    响应头发出后不能再改状态码，中途出错时输出一行 {"error": ...} 结束
+    """
+    def generate():
+        encode_time = 0.0
+        try:
+            for line in lines:
+                start = time.perf_counter()
+                encoded = json.dumps(line, ensure_ascii=False) + '\n'
+                encode_time += time.perf_counter() - start
+                yield encoded
+        except Exception as e:
+            traceback.print_exc()
+            yield json.dumps({'error': f'{error_prefix}: {str(e)}'}, ensure_ascii=False) + '\n'
+        finally:
+            observe_stage("json", encode_time)
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/snippets', methods=['POST'])
+def snippets():
+    """
+    为一组文档生成高亮摘要，请求体为 JSON: {"query": ..., "docnos": [...]}
+    返回 {"snippets": {docno: html}}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        query_str = data.get('query', '')
+        docnos = data.get('docnos')
+        if not query_str:
+            return jsonify({'error': '查询不能为空'}), 400
+        if not isinstance(docnos, list) or len(docnos) > Config.MAX_HITS:
+            return jsonify({'error': f'docnos 必须是不超过 {Config.MAX_HITS} 个文档编号的列表'}), 400
+        
+        return jsonify({'snippets': fetch_snippets(query_str, [str(d) for d in docnos])})
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'摘要生成出错: {str(e)}'}), 500
+
+@app.route('/suggest', methods=['GET'])
+def suggest():
+    """
+    查询词自动补全：/suggest?q=hurricane+mi&limit=8 按文档频率返回以最后一个词为前缀的词，
+    {"query": ..., "suggestions": [{"term", "df", "query"}]}，query 为补全后的完整查询
+    """
+    try:
+        query_str = request.args.get('q', '')
+        limit = int(request.args.get('limit', Config.SUGGEST_LIMIT))
+        if not 0 < limit <= Config.MAX_SUGGESTIONS:
+            return jsonify({'error': f'limit 必须在 1 到 {Config.MAX_SUGGESTIONS} 之间'}), 400
+        return jsonify({'query': query_str, 'suggestions': suggest_query(query_str, limit)})
+    
+    except ValueError:
+        return jsonify({'error': 'limit 必须是整数'}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'补全出错: {str(e)}'}), 500
+
+@app.route('/search_batch', methods=['POST'])
+def search_batch():
+    """
+    批量查询，请求体为 JSON: {"queries": [...], "top_n": 10, "stream": false}
+    queries 的元素可以是查询字符串，也可以是 {"id": ..., "query": ...}；
+    stream 为 true 时以 NDJSON 逐个输出每个查询的结果，最后一行为汇总
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get('queries')
+        top_n = min(max(1, int(data.get('top_n', 10))), Config.MAX_HITS)
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'error': 'queries 必须是非空列表'}), 400
+        
+        ids = []
+        query_strs = []
+        for i, item in enumerate(queries):
+            if isinstance(item, dict):
+                ids.append(item.get('id', i))
+                item = item.get('query', '')
+            else:
+                ids.append(i)
+            if not isinstance(item, str) or not item.strip():
+                return jsonify({'error': f'第 {i} 个查询为空'}), 400
+            query_strs.append(item)
+        
+        def generate():
+            start = time.time()
+            count = 0
+            for (query_str, results), query_id in zip(execute_queries(query_strs, top_n, markup="html"), ids):
+                count += 1
+                yield {
+                    'id': query_id,
+                    'query': query_str,
+                    'total': len(results),
+                    'results': results
+                }
+            elapsed = max(time.time() - start, 1e-9)
+            yield {'count': count, 'elapsed': round(elapsed, 4), 'qps': round(count / elapsed, 2)}
+        
+        if data.get('stream'):
+            return ndjson_response(generate(), '批量搜索出错')
+        
+        *batch_results, summary = generate()
+        with stage("json"):
+            return jsonify(dict(summary, results=batch_results))
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'批量搜索出错: {str(e)}'}), 500
+
+def result_cache_gauges():
+    stats = result_cache.stats()
+    return [
+        ('tdt3_result_cache_hits_total', 'counter', 'Result cache hits.', stats['hits']),
+        ('tdt3_result_cache_misses_total', 'counter', 'Result cache misses.', stats['misses']),
+        ('tdt3_result_cache_evictions_total', 'counter', 'Result cache LRU evictions.', stats['evictions']),
+        ('tdt3_result_cache_entries', 'gauge', 'Entries currently in the result cache.', stats['size']),
+    ]
+
+register_gauges(result_cache_gauges)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文本格式的指标：查询各阶段和各端点的耗时直方图、查询结果计数和结果缓存计数"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """查询结果缓存的命中/未命中/淘汰计数，用于评估缓存容量"""
+    return jsonify(result_cache.stats())
+
 @app.route('/build_index', methods=['POST'])
 def build_index_route():
-    """处理索引构建请求"""
+    """提交后台索引构建任务，立即返回任务 ID"""
     try:
         data_dir = request.form.get('data_dir', './tdt3')
         index_dir = request.form.get('index_dir', 'indexdir')
+        procs = max(1, int(request.form.get('procs', 1)))
+        limitmb = max(1, int(request.form.get('limitmb', DEFAULT_LIMITMB)))
+        incremental = request.form.get('incremental', '').lower() in ('1', 'true', 'on')
+        docstore = request.form.get('docstore', '').lower() in ('1', 'true', 'on')
+        shingles = request.form.get('shingles', '').lower() in ('1', 'true', 'on')
+        shards = max(1, int(request.form.get('shards', 1)))
+        shard_by = request.form.get('shard_by', 'hash')
+        if shard_by not in SHARD_STRATEGIES:
+            return jsonify({'error': f'未知的分片方式: {shard_by}'}), 400
         
         if not os.path.exists(data_dir):
             return jsonify({'error': f'数据目录不存在: {data_dir}'}), 400
             
-        # 异步构建索引会更好，但这里简化处理
-        build_index(data_dir, index_dir)
-        
-        return jsonify({'success': True, 'message': f'索引构建完成，共索引了{count_docs(index_dir)}个文档'})
+        # 在后台线程中构建，新索引构建完成后原子替换，期间查询继续使用旧索引
+        job, created = build_jobs.submit(data_dir, index_dir, procs=procs,
+                                         limitmb=limitmb, incremental=incremental, docstore=docstore,
+                                         shingles=shingles, shards=shards, shard_by=shard_by)
+        status = job.to_dict()
+        status['status_url'] = url_for('build_index_status', job_id=job.id)
+        if not created:
+            status['message'] = '该索引目录已有正在运行的构建任务'
+            return jsonify(status), 409
+        return jsonify(status), 202
     
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': f'索引构建失败: {str(e)}'}), 500
 
+@app.route('/build_index/<job_id>', methods=['GET'])
+def build_index_status(job_id):
+    """查询后台构建任务的进度"""
+    job = build_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'任务不存在: {job_id}'}), 404
+        
+    status = job.to_dict()
+    if job.status == 'done':
+        status['message'] = f'索引构建完成，共索引了{count_docs(job.index_dir)}个文档'
+    return jsonify(status)
+
 def count_docs(index_dir):
-    """计算索引中的文档数量"""
+    """计算索引中的文档数量 (分片索引为各分片之和)"""
     try:
         from whoosh.index import open_dir
+        config = load_shard_config(index_dir) if is_sharded(index_dir) else None
+        if config:
+            return sum(open_dir(os.path.join(index_dir, name)).doc_count() for name in config["shards"])
         ix = open_dir(index_dir)
         return ix.doc_count()
     except:
         return "未知"
 
-@app.template_filter('highlight_result')
-def highlight_result_filter(text):
-    """处理高亮结果，确保颜色代码在HTML中正确显示"""
-    if not isinstance(text, str):
-        return text
-        
-    # 转换ANSI颜色代码为HTML格式
-    color_map = {
-        '\033[31m': '<span class="highlight-phrase">',  # 红色 - 短语
-        '\033[32m': '<span class="highlight-term">',    # 绿色 - 词语
-        '\033[34m': '<span class="highlight-hyphen">',  # 蓝色 - 连字符
-        '\033[33m': '<span class="highlight-free">',    # 黄色 - 自由词
-        '\033[1m': '',                                 # 加粗忽略
-        '\033[0m': '</span>'                           # 重置
-    }
-    
-    # 处理所有颜色代码
-    for ansi, html in color_map.items():
-        text = text.replace(ansi, html)
-    
-    return text
-
 if __name__ == '__main__':
+    setup_logging()
     app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # 禁用静态文件缓存
     app.run(debug=True, port=5000)
@@ -0,0 +1,1086 @@
+"""
+性能基准工具
+
+用法示例:
+    python benchmark.py parse                      # 在自动生成的合成语料上测试 SGML 解析速度
+    python benchmark.py parse --data-dir ./tdt3    # 在真实数据集上测试
+    python benchmark.py pruning --index-dir indexdir   # 对比 top-k 剪枝与逐个评分的结果和耗时
+    python benchmark.py vector --index-dir indexdir    # 对比 Whoosh 与 NumPy 向量化评分的吞吐量
+    python benchmark.py scorer --index-dir indexdir    # CustomScorer 每秒评分的倒排项数 (逐个解码长度 vs 长度归一化数组)
+    python benchmark.py relevance --out run.json       # 合成主题集上各查询路径的 MAP/nDCG@10 与延迟
+    python benchmark.py relevance --index-dir indexdir --topics topics.txt --qrels qrels.txt \\
+        --out new.json --compare old.json              # 真实主题集，与上一次的结果对比
+    python benchmark.py serve --index-dir indexdir --workers 1,2,4   # serve.py 吞吐量随工作进程数的变化
+    python benchmark.py cli --index-dir indexdir   # main.py search 冷启动与转发给常驻服务的延迟
+    python benchmark.py docstore --data-dir ./tdt3 # 正文存入存储字段与外部正文存储的索引大小和摘要延迟
+    python benchmark.py shingles --data-dir ./tdt3 # 有无二元词组字段时短语、连字符和混合查询的延迟
+    python benchmark.py suggest --index-dir indexdir   # 查询词补全的延迟 (补全词表 vs 遍历 Whoosh 词典)
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import logging
+import math
+import mmap
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from preprocessor import iter_tdt3_files, iter_sgml_docs, parse_tdt3_file, parse_tdt3_sgml
+from whoosh.collectors import TopCollector
+from whoosh.index import open_dir
+from whoosh.qparser import QueryParser
+from whoosh.query import And, Or, Term
+from custom_scorer import CustomScorer, ReaderCache
+from whoosh.scoring import WeightLengthScorer
+import custom_scorer
+from vector_engine import get_vector_index, vector_search
+from index_builder import peak_memory_mb
+from shards import is_sharded, load_shard_config
+from suggest import MIN_DOC_FREQUENCY, SUGGEST_FILE, Suggester, build_suggestions, suggest
+from main import Config, logger, free_query, phrase_query, hyphen_query, mixed_query, route_query, read_query_file
+import main as engine
+from metrics import trace_stages
+
+SOURCES = ["APW", "NYT", "CNN", "ABC", "VOA"]
+
+# 合成语料中按一定概率插入的新闻词汇，便于构造查询
+NEWS_TERMS = [
+    "hurricane", "mitch", "closed-door", "new york city", "air-defense",
+    "president", "talks", "election", "earthquake", "stock market",
+]
+
+def make_vocabulary(size, rng):
+    """生成由音节拼接的伪英文词表"""
+    syllables = ["ka", "lo", "mi", "ter", "an", "re", "sto", "vel", "dor", "pen",
+                 "ri", "cu", "ma", "ton", "ble", "shi", "gra", "no", "ex", "tal"]
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def synthetic_docno(count, docs_per_file=4):
+    """合成语料中第 count 个文档的 docno"""
+    source = SOURCES[(count // docs_per_file) % len(SOURCES)]
+    return f"{source}19981001.{count:06d}"
+
+def generate_corpus(root_dir, num_files=200, docs_per_file=4, words_per_doc=(150, 600), seed=42,
+                    plants=None):
+    """
+    生成 TDT3 SGML 格式的合成语料：root_dir/<SOURCE>/<SOURCE><NNNNN>.txt，
+    每个文件包含 docs_per_file 个 <DOC>，词频服从 Zipf 分布。
+    plants 为 {文档序号: [文本, ...]}，这些文本 (单词或短语) 会被插入对应文档的随机位置。
+
+    Returns:
+        int: 生成的文档数
+    """
+    rng = random.Random(seed)
+    vocab = make_vocabulary(5000, rng)
+    weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+    plants = plants or {}
+
+    count = 0
+    for file_no in range(num_files):
+        source = SOURCES[file_no % len(SOURCES)]
+        os.makedirs(os.path.join(root_dir, source), exist_ok=True)
+        path = os.path.join(root_dir, source, f"{source}{file_no:05d}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            for _ in range(docs_per_file):
+                length = rng.randint(*words_per_doc)
+                words = rng.choices(vocab, weights, k=length)
+                for _ in range(length // 50):
+                    words[rng.randrange(length)] = rng.choice(NEWS_TERMS)
+                for text in plants.get(count, ()):
+                    tokens = text.split()
+                    pos = rng.randrange(length - len(tokens) + 1)
+                    words[pos:pos + len(tokens)] = tokens
+                docno = synthetic_docno(count, docs_per_file)
+                headline = ' '.join(rng.choices(vocab, weights, k=5)).capitalize()
+                f.write(
+                    "<DOC>\n"
+                    f"<DOCNO> {docno} </DOCNO>\n"
+                    "<DOCTYPE> NEWS STORY </DOCTYPE>\n"
+                    f"<DATE_TIME> 10/01/1998 {count % 24:02d}:00 </DATE_TIME>\n"
+                    f"<HEADLINE> {headline} </HEADLINE>\n"
+                    "<TEXT>\n"
+                    f"{' '.join(words)}\n"
+                    "</TEXT>\n"
+                    "</DOC>\n"
+                )
+                count += 1
+    return count
+
+def _best_of(repeat, func):
+    """运行 repeat 次，返回 (最短耗时, 最后一次的返回值)"""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_parse(data_dir, repeat=3):
+    """对比原有的整文件正则解析与 mmap 多文档解析的吞吐量 (MB/s)"""
+    files = list(iter_tdt3_files(data_dir))
+    total_mb = sum(os.path.getsize(p) for p in files) / (1024 * 1024)
+    docno_re = re.compile(r'<DOCNO>\s*(.*?)\s*</DOCNO>', re.DOTALL)
+    text_re = re.compile(r'<TEXT>(.*?)</TEXT>', re.DOTALL)
+
+    def legacy_extract():
+        n = 0
+        for path in files:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            if docno_re.search(content) and text_re.search(content):
+                n += 1
+        return n
+
+    def mmap_extract():
+        n = 0
+        for path in files:
+            with open(path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    n += sum(1 for _ in iter_sgml_docs(buf))
+        return n
+
+    def legacy_full():
+        n = 0
+        for path in files:
+            with open(path, 'r', encoding='utf-8') as f:
+                if parse_tdt3_sgml(f.read()):
+                    n += 1
+        return n
+
+    def mmap_full():
+        return sum(len(parse_tdt3_file(path)[1]) for path in files)
+
+    print(f"{len(files)} files, {total_mb:.1f} MB, best of {repeat}")
+    print(f"{'path':<38}{'docs':>8}{'seconds':>10}{'MB/s':>10}{'docs/s':>10}")
+    cases = [
+        ("regex, first <DOC> only (extract)", legacy_extract),
+        ("mmap, all <DOC> (extract)", mmap_extract),
+        ("regex + preprocess (parse_tdt3_sgml)", legacy_full),
+        ("mmap + preprocess (parse_tdt3_file)", mmap_full),
+    ]
+    for name, func in cases:
+        elapsed, docs = _best_of(repeat, func)
+        print(f"{name:<38}{docs:>8}{elapsed:>10.3f}{total_mb / elapsed:>10.1f}{docs / elapsed:>10.0f}")
+
+def build_synthetic_index(work_dir, num_files):
+    """在 work_dir 下生成合成语料并构建索引，返回索引目录"""
+    data_dir = os.path.join(work_dir, 'tdt3')
+    index_dir = os.path.join(work_dir, 'indexdir')
+    generate_corpus(data_dir, num_files=num_files)
+    from index_builder import build_index
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_index(data_dir, index_dir)
+    return index_dir
+
+# 合成主题的四种形式，依次对应自由查询、短语查询、连字符查询和混合查询
+TOPIC_KINDS = ("free", "phrase", "hyphen", "mixed")
+
+def make_topics(num_topics, num_docs, docs_per_file=4, seed=42):
+    """
+    为合成语料构造主题和相关性判断
+
+    每个主题取词表尾部的 3 个低频词，按 TOPIC_KINDS 轮流生成不同形式的查询。
+    高度相关 (2) 的文档植入完整的查询内容，部分相关 (1) 的文档只植入一部分，
+    干扰文档 (0) 植入零散的查询词但不构成短语，因此各查询路径的排序质量有明显差别。
+
+    Returns:
+        tuple: (主题列表 [(qid, 查询)], qrels {qid: {docno: 相关度}}, plants {文档序号: [文本]})
+    """
+    rng = random.Random(seed + 1)
+    vocab = make_vocabulary(5000, random.Random(seed))
+    words = rng.sample(vocab[len(vocab) // 2:], 3 * num_topics)
+    topics = []
+    qrels = {}
+    plants = {}
+    for t in range(num_topics):
+        a, b, c = words[3 * t:3 * t + 3]
+        kind = TOPIC_KINDS[t % len(TOPIC_KINDS)]
+        if kind == "free":
+            title = f"{a} {b} {c}"
+            plans = ([a, a, b, b, c, c], [a, c], [a, a, a])
+        elif kind == "phrase":
+            title = f'"{a} {b}"'
+            plans = ([f"{a} {b}"] * 3, [f"{a} {b}"], [a, b, a, b])
+        elif kind == "hyphen":
+            title = f"{a}-{b}"
+            plans = ([f"{a} {b}"] * 3, [f"{a} {b}"], [a, b, a, b])
+        else:
+            title = f'"{a} {b}" {c}'
+            plans = ([f"{a} {b}", f"{a} {b}", c, c], [f"{a} {b}"], [c, c, c, a])
+        qid = str(1001 + t)
+        topics.append((qid, title))
+
+        num_relevant = rng.randint(6, 20)
+        docs = rng.sample(range(num_docs), num_relevant + rng.randint(5, 15))
+        judgments = qrels[qid] = {}
+        for i, docnum in enumerate(docs):
+            if i < num_relevant // 2:
+                rel = 2
+            elif i < num_relevant:
+                rel = 1
+            else:
+                rel = 0
+            plants.setdefault(docnum, []).extend(plans[2 - rel])
+            judgments[synthetic_docno(docnum, docs_per_file)] = rel
+    return topics, qrels, plants
+
+def build_synthetic_collection(work_dir, num_files, num_topics=40):
+    """
+    在 work_dir 下生成带主题和相关性判断的合成测试集并构建索引
+
+    Returns:
+        tuple: (索引目录, 主题文件, qrels 文件)
+    """
+    data_dir = os.path.join(work_dir, 'tdt3')
+    index_dir = os.path.join(work_dir, 'indexdir')
+    topics, qrels, plants = make_topics(num_topics, num_files * 4)
+    generate_corpus(data_dir, num_files=num_files, plants=plants)
+    topics_path = os.path.join(work_dir, 'topics.txt')
+    with open(topics_path, 'w', encoding='utf-8') as f:
+        for qid, title in topics:
+            f.write(f"{qid}\t{title}\n")
+    qrels_path = os.path.join(work_dir, 'qrels.txt')
+    with open(qrels_path, 'w', encoding='utf-8') as f:
+        for qid, judgments in qrels.items():
+            for docno, rel in judgments.items():
+                f.write(f"{qid} 0 {docno} {rel}\n")
+    from index_builder import build_index
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_index(data_dir, index_dir)
+    return index_dir, topics_path, qrels_path
+
+def read_topics(path):
+    """
+    读取主题文件，返回 [(qid, 查询)]
+
+    支持 TREC 格式 (<top> 中的 <num> 和 <title>)，
+    以及与 main.py search --batch 相同的每行一个查询的格式
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    if '<top>' not in content:
+        return read_query_file(path)
+    topics = []
+    for block in re.findall(r'<top>(.*?)</top>', content, re.DOTALL):
+        num = re.search(r'<num>\s*(?:Number:)?\s*(\S+)', block)
+        title = re.search(r'<title>\s*(?:Topic:)?\s*(.*?)\s*(?=<|$)', block, re.DOTALL)
+        if num and title and title.group(1).strip():
+            topics.append((num.group(1), ' '.join(title.group(1).split())))
+    return topics
+
+def read_qrels(path):
+    """读取 TREC qrels (qid iter docno rel)，返回 {qid: {docno: 相关度}}"""
+    qrels = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 4:
+                qrels.setdefault(parts[0], {})[parts[2]] = int(parts[3])
+    return qrels
+
+def average_precision(ranking, judgments):
+    relevant = sum(1 for rel in judgments.values() if rel > 0)
+    if not relevant:
+        return 0.0
+    hits = 0
+    total = 0.0
+    for rank, docno in enumerate(ranking, 1):
+        if judgments.get(docno, 0) > 0:
+            hits += 1
+            total += hits / rank
+    return total / relevant
+
+def ndcg(ranking, judgments, k=10):
+    """线性增益的 nDCG@k"""
+    dcg = sum(judgments.get(docno, 0) / math.log2(rank + 1)
+              for rank, docno in enumerate(ranking[:k], 1))
+    ideal = sorted((rel for rel in judgments.values() if rel > 0), reverse=True)[:k]
+    idcg = sum(rel / math.log2(rank + 1) for rank, rel in enumerate(ideal, 1))
+    return dcg / idcg if idcg else 0.0
+
+def percentile(sorted_values, p):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+# relevance 基准测量的查询路径；auto 为 execute_query 使用的自动分派 (不经过结果缓存)
+QUERY_PATHS = {
+    "free": free_query,
+    "phrase": phrase_query,
+    "hyphen": hyphen_query,
+    "mixed": mixed_query,
+    "auto": route_query,
+}
+
+def bench_relevance(index_dir, topics, qrels, paths=tuple(QUERY_PATHS), top_n=100, repeat=3):
+    """
+    把每个主题依次交给各查询路径执行，计算 MAP / nDCG@10 和延迟分布
+
+    每个路径先在 tracemalloc 下执行一遍 (同时作为预热)，得到 Python 分配的峰值内存；
+    之后计时执行 repeat 遍，延迟取全部执行的分布，排序质量取最后一遍的结果。
+
+    Returns:
+        dict: 可直接保存为 JSON 的结果，包含各路径的指标、逐查询指标和排序
+    """
+    Config.INDEX_DIR = index_dir
+    # 计时期间关闭查询过程的调试日志
+    log_level = logger.level
+    logger.setLevel(logging.WARNING)
+    judged = [(qid, query) for qid, query in topics if qid in qrels]
+    report = {
+        "meta": {
+            "index_dir": os.path.abspath(index_dir),
+            "topics": len(topics),
+            "judged_topics": len(judged),
+            "top_n": top_n,
+            "repeat": repeat,
+            "config": {"PRUNING": Config.PRUNING, "VECTOR_ENGINE": Config.VECTOR_ENGINE,
+                       "MIXED_SINGLE_PASS": Config.MIXED_SINGLE_PASS},
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "paths": {},
+    }
+    try:
+        if topics:
+            route_query(topics[0][1], top_n)    # 打开索引，避免计入第一个路径的内存和延迟
+        for name in paths:
+            func = QUERY_PATHS[name]
+            tracemalloc.start()
+            for _, query in topics:
+                func(query, top_n)
+            _, peak_alloc = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            latencies = []
+            runs = {}
+            for _ in range(repeat):
+                for qid, query in topics:
+                    start = time.perf_counter()
+                    results = func(query, top_n)
+                    latencies.append(time.perf_counter() - start)
+                    runs[qid] = [res["docno"] for res in results]
+
+            per_query = {qid: {"ap": average_precision(runs[qid], qrels[qid]),
+                               "ndcg@10": ndcg(runs[qid], qrels[qid])}
+                         for qid, _ in judged}
+            latencies.sort()
+            report["paths"][name] = {
+                "map": sum(q["ap"] for q in per_query.values()) / max(len(per_query), 1),
+                "ndcg@10": sum(q["ndcg@10"] for q in per_query.values()) / max(len(per_query), 1),
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "qps": len(latencies) / max(sum(latencies), 1e-9),
+                "peak_alloc_mb": peak_alloc / (1024 * 1024),
+                "per_query": per_query,
+                "run": runs,
+            }
+    finally:
+        logger.setLevel(log_level)
+    report["meta"]["peak_rss_mb"] = peak_memory_mb()[0]
+    return report
+
+def print_relevance(report):
+    meta = report["meta"]
+    print(f"{meta['judged_topics']}/{meta['topics']} judged topics, top_n={meta['top_n']}, "
+          f"repeat={meta['repeat']}, peak RSS {meta['peak_rss_mb'] or 0:.1f} MB")
+    print(f"{'path':<8}{'MAP':>8}{'nDCG@10':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'QPS':>9}{'alloc MB':>10}")
+    for name, m in report["paths"].items():
+        print(f"{name:<8}{m['map']:>8.4f}{m['ndcg@10']:>9.4f}{m['p50_ms']:>9.2f}{m['p95_ms']:>9.2f}"
+              f"{m['p99_ms']:>9.2f}{m['qps']:>9.1f}{m['peak_alloc_mb']:>10.1f}")
+
+def compare_relevance(old, new):
+    """逐路径打印两次结果的指标差异，以及排序发生变化的主题数"""
+    print(f"compared with run from {old['meta'].get('time', '?')}")
+    print(f"{'path':<8}{'ΔMAP':>9}{'ΔnDCG@10':>10}{'p50 ms':>16}{'p95 ms':>16}{'QPS':>16}{'changed':>9}")
+    for name, m in new["paths"].items():
+        o = old["paths"].get(name)
+        if o is None:
+            print(f"{name:<8} (not in baseline)")
+            continue
+        changed = sum(1 for qid, ranking in m["run"].items() if o["run"].get(qid) != ranking)
+        print(f"{name:<8}{m['map'] - o['map']:>+9.4f}{m['ndcg@10'] - o['ndcg@10']:>+10.4f}"
+              f"{o['p50_ms']:>7.2f} → {m['p50_ms']:<6.2f}{o['p95_ms']:>7.2f} → {m['p95_ms']:<6.2f}"
+              f"{o['qps']:>7.1f} → {m['qps']:<6.1f}{changed:>9}")
+
+def bench_pruning(index_dir, top_n=10, repeat=3):
+    """
+    用高文档频率的词构造 OR / AND 查询，分别在开启和关闭剪枝
+    (searcher.search 的 optimize 参数) 时执行，检查 top-k 是否一致并比较耗时。
+    主要选 df 低于 N/3 的词，另加几个含最常见词 (IDF 最低) 的查询。
+    """
+    ix = open_dir(index_dir)
+    with ix.searcher(weighting=CustomScorer()) as searcher:
+        reader = searcher.reader()
+        limit = reader.doc_count_all() // 3
+        candidates = [(info.doc_frequency(), text) for text, info in reader.iter_field("content")
+                      if info.doc_frequency() < limit]
+        candidates.sort(reverse=True)
+        terms = [text.decode('utf-8') if isinstance(text, bytes) else text
+                 for _, text in candidates[:40]]
+        common = [text.decode('utf-8') if isinstance(text, bytes) else text
+                  for _, text in reader.most_frequent_terms("content", 4)]
+        queries = []
+        for i in range(0, 24, 3):
+            words = terms[i:i + 3] + terms[-(i // 3) - 1:][:1]
+            queries.append(Or([Term("content", w) for w in words]))
+            queries.append(And([Term("content", w) for w in words[:2]]))
+        # 含最常见词的查询：这些词的得分上界最低，剪枝后仍要与逐个评分一致
+        queries.append(Or([Term("content", w) for w in common[:2] + terms[:1]]))
+        queries.append(And([Term("content", w) for w in common[:2]]))
+
+        mismatches = 0
+        skipped = 0
+        total = {True: 0.0, False: 0.0}
+        for query in queries:
+            tops = {}
+            for optimize in (True, False):
+                def run():
+                    # 关闭剪枝时同时关闭 MaxScore 匹配器替换 (replace=0)，得到真正逐个评分的基准
+                    collector = TopCollector(limit=top_n, usequality=optimize,
+                                             replace=10 if optimize else 0)
+                    searcher.search_with_collector(query, collector)
+                    results = collector.results()
+                    return collector.skipped_times, [(hit.docnum, round(hit.score, 6)) for hit in results]
+                elapsed, (skips, tops[optimize]) = _best_of(repeat, run)
+                total[optimize] += elapsed
+                if optimize:
+                    skipped += skips
+            if tops[True] != tops[False]:
+                mismatches += 1
+                print(f"MISMATCH {query}")
+
+    print(f"{len(queries)} queries over high-df terms, top_n={top_n}, best of {repeat}")
+    print(f"  pruned:     {total[True] * 1000:.1f} ms total")
+    print(f"  exhaustive: {total[False] * 1000:.1f} ms total")
+    print(f"  speedup {total[False] / total[True]:.2f}x, {skipped} blocks skipped, "
+          f"{mismatches} mismatched top-k lists")
+
+def bench_scorer(index_dir, num_terms=200, repeat=5):
+    """
+    CustomScorer 的微基准 (每个段分别计算)：
+    - 每秒评分的倒排项数：逐个文档解码长度 (WeightLengthScorer.score，改动前的做法)
+      与读取预先算好的长度归一化数组 (CustomBM25Scorer.score)，两者都包含遍历倒排表的开销，
+      并检查得分是否逐位一致
+    - 构造评分器 (每个查询词一次) 的耗时：读取器缓存为空与命中时
+    """
+    model = CustomScorer()
+    ix = open_dir(index_dir)
+    with ix.searcher(weighting=model) as searcher:
+        terms = [text for _, text in searcher.reader().most_frequent_terms("content", num_terms)]
+        leaves = [leaf for leaf, _ in searcher.leaf_searchers()]
+
+        def term_postings():
+            # 每个段上每个词一个 (评分器, 倒排表匹配器)
+            for leaf in leaves:
+                for text in terms:
+                    if leaf.reader().doc_frequency("content", text):
+                        yield model.scorer(leaf, "content", text), leaf.reader().postings("content", text)
+
+        def score_postings(per_doc_length):
+            postings = 0
+            for scorer, matcher in term_postings():
+                score = (lambda m: WeightLengthScorer.score(scorer, m)) if per_doc_length else scorer.score
+                while matcher.is_active():
+                    score(matcher)
+                    postings += 1
+                    matcher.next()
+            return postings
+
+        mismatches = 0
+        for scorer, matcher in term_postings():
+            while matcher.is_active():
+                mismatches += scorer.score(matcher) != WeightLengthScorer.score(scorer, matcher)
+                matcher.next()
+        before, postings = _best_of(repeat, lambda: score_postings(True))
+        after, _ = _best_of(repeat, lambda: score_postings(False))
+
+        present = [(leaf, text) for leaf in leaves for text in terms
+                   if leaf.reader().doc_frequency("content", text)]
+
+        def construct_all():
+            for leaf, text in present:
+                model.scorer(leaf, "content", text)
+
+        def lookup_stats():
+            # 改动前每个评分器构造时的查询：文档数、df、平均长度、倒排表上界
+            for leaf, text in present:
+                parent = leaf.get_parent()
+                parent.doc_count_all()
+                parent.doc_frequency("content", text)
+                parent.avg_field_length("content")
+                leaf.term_info("content", text)
+
+        saved = custom_scorer.scoring_cache
+        try:
+            custom_scorer.scoring_cache = ReaderCache()
+            start = time.perf_counter()
+            construct_all()     # 首次：查询词统计量和长度归一化数组
+            cold = time.perf_counter() - start
+            warm, _ = _best_of(repeat, construct_all)
+        finally:
+            custom_scorer.scoring_cache = saved
+        uncached, _ = _best_of(repeat, lookup_stats)
+
+    per_term = len(present)
+    print(f"{len(terms)} most frequent terms, {len(leaves)} segment(s), {postings} postings per pass, best of {repeat}")
+    print(f"  per-doc length decode: {postings / before:>12,.0f} postings/s")
+    print(f"  length-norm array:     {postings / after:>12,.0f} postings/s ({before / after:.2f}x), "
+          f"{mismatches} score mismatches")
+    print(f"  term stats lookup: uncached {uncached / per_term * 1e6:.1f} us/term, "
+          f"scorer setup with cache {warm / per_term * 1e6:.1f} us/term "
+          f"(first use {cold * 1000:.1f} ms incl. norm arrays)")
+
+def make_free_queries(reader, count, seed=42):
+    """从词表中按文档频率分层抽词，生成 count 个 1-4 词的自由查询 (AND 与 OR 各半)"""
+    rng = random.Random(seed)
+    terms = sorted(((info.doc_frequency(), text) for text, info in reader.iter_field("content")),
+                   reverse=True)
+    terms = [text.decode('utf-8') if isinstance(text, bytes) else text for _, text in terms]
+    head, body = terms[:50], terms[50:2000] or terms
+    queries = []
+    for i in range(count):
+        words = [rng.choice(head)] + rng.sample(body, min(len(body), rng.randint(0, 3)))
+        queries.append((' OR ' if i % 2 else ' ').join(words))
+    return queries
+
+def bench_vector(index_dir, num_queries=200, top_n=10):
+    """
+    在同一批自由查询上比较 Whoosh (CustomScorer, 剪枝开启) 与 vector_engine 的吞吐量，
+    并检查两者返回的 top-k 文档和得分是否一致
+    """
+    ix = open_dir(index_dir)
+    with ix.searcher(weighting=CustomScorer()) as searcher:
+        start = time.perf_counter()
+        vectors = get_vector_index(index_dir, searcher)
+        export = time.perf_counter() - start
+        print(f"export: {export:.2f} s, {len(vectors.vocab)} terms, {len(vectors.docids)} postings, "
+              f"{vectors.nbytes / (1024 * 1024):.1f} MB")
+
+        parser = QueryParser("content", schema=searcher.schema)
+        queries = [parser.parse(q) for q in make_free_queries(searcher.reader(), num_queries)]
+
+        start = time.perf_counter()
+        whoosh_tops = [[(hit.docnum, hit.score) for hit in searcher.search(q, limit=top_n)]
+                       for q in queries]
+        whoosh_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vector_tops = [vector_search(index_dir, searcher, q, limit=top_n) for q in queries]
+        vector_time = time.perf_counter() - start
+
+    mismatches = 0
+    for a, b in zip(whoosh_tops, vector_tops):
+        if [d for d, _ in a] != [d for d, _ in b] or any(abs(x - y) > 1e-9 for (_, x), (_, y) in zip(a, b)):
+            mismatches += 1
+    print(f"{len(queries)} free queries, top_n={top_n}")
+    print(f"  whoosh: {whoosh_time:.3f} s, {len(queries) / whoosh_time:.0f} QPS")
+    print(f"  vector: {vector_time:.3f} s, {len(queries) / vector_time:.0f} QPS")
+    print(f"  speedup {whoosh_time / vector_time:.1f}x, {mismatches} mismatched rankings")
+
+def start_server(index_dir, workers, timeout=120):
+    """以子进程启动 serve.py (端口由系统分配)，返回 (进程, 端口)"""
+    serve_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py')
+    proc = subprocess.Popen([sys.executable, serve_py, '--index-dir', index_dir, '--port', '0',
+                             '--workers', str(workers)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    deadline = time.time() + timeout
+    for line in proc.stdout:
+        match = re.search(r'监听 http://[^:]+:(\d+)', line)
+        if match:
+            # 之后的输出继续读走，避免管道写满阻塞服务进程
+            threading.Thread(target=proc.stdout.read, daemon=True).start()
+            return proc, int(match.group(1))
+        if time.time() > deadline:
+            break
+    proc.kill()
+    raise RuntimeError(f"serve.py failed to start (workers={workers})")
+
+def drive_load(port, queries, concurrency=8, top_n=10):
+    """用 concurrency 个线程 (各自一个持久连接) 依次发出 queries 中的 /search 请求，返回 (总耗时, 各请求延迟)"""
+    pending = iter(queries)
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while True:
+            with lock:
+                query = next(pending, None)
+            if query is None:
+                break
+            body = urllib.parse.urlencode({'query': query, 'top_n': top_n})
+            start = time.perf_counter()
+            try:
+                conn.request('POST', '/search', body,
+                             {'Content-Type': 'application/x-www-form-urlencoded'})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(type(e).__name__)
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        print(f"  {len(errors)} failed requests: {errors[:5]}")
+    return elapsed, latencies
+
+def distinct_free_queries(index_dir, count):
+    """从索引词表抽取互不相同的自由查询 (分片索引从第一个分片抽词)"""
+    if is_sharded(index_dir):
+        index_dir = os.path.join(index_dir, load_shard_config(index_dir)["shards"][0])
+    with open_dir(index_dir).reader() as reader:
+        return list(dict.fromkeys(make_free_queries(reader, count)))
+
+def bench_serve(index_dir, worker_counts=(1, 2, 4), num_queries=400, concurrency=8, top_n=10):
+    """
+    对每个工作进程数启动一次 serve.py，用同一批互不相同的自由查询 (避开结果缓存)
+    压测 /search，输出 QPS 和延迟分位数
+    """
+    queries = distinct_free_queries(index_dir, num_queries)
+    print(f"{len(queries)} distinct free queries, concurrency={concurrency}, top_n={top_n}, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'QPS':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for workers in worker_counts:
+        proc, port = start_server(index_dir, workers)
+        try:
+            drive_load(port, queries[:concurrency * 2], concurrency, top_n)     # 预热
+            elapsed, latencies = drive_load(port, queries, concurrency, top_n)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=60)
+        latencies.sort()
+        print(f"{workers:>8} {len(latencies) / elapsed:>8.1f} "
+              + ' '.join(f"{percentile(latencies, p) * 1000:>8.1f}" for p in (50, 95, 99)))
+
+def run_cli(work_dir, env, query, top_n, *extra):
+    """在 work_dir 中启动一次 python main.py search，返回从启动到进程退出的耗时"""
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    start = time.perf_counter()
+    subprocess.run([sys.executable, main_py, 'search', query, f'--hits={top_n}', *extra],
+                   cwd=work_dir, env=env, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+def bench_cli(index_dir, num_queries=20, top_n=10, timeout=120):
+    """
+    逐次启动 python main.py search 的延迟：不使用常驻服务 (冷启动：导入、打开索引、查询)
+    与转发给 search_daemon.py (热)。两者在同一个临时目录中运行，其中的 indexdir 链接到被测索引
+    """
+    queries = distinct_free_queries(index_dir, num_queries)
+    env = {k: v for k, v in os.environ.items() if k != 'TDT3_SEARCH_SOCKET'}
+    daemon_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search_daemon.py')
+    print(f"{len(queries)} distinct free queries, top_n={top_n}, one process per query")
+    with tempfile.TemporaryDirectory(prefix='tdt3-cli-') as work_dir:
+        os.symlink(os.path.abspath(index_dir), os.path.join(work_dir, 'indexdir'))
+        cold = [run_cli(work_dir, env, query, top_n, '--no-daemon') for query in queries]
+
+        daemon = subprocess.Popen([sys.executable, daemon_py, 'start'], cwd=work_dir, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        try:
+            deadline = time.time() + timeout
+            for line in daemon.stdout:
+                if '监听' in line or time.time() > deadline:
+                    break
+            else:
+                raise RuntimeError("search_daemon.py failed to start")
+            threading.Thread(target=daemon.stdout.read, daemon=True).start()
+            warm = [run_cli(work_dir, env, query, top_n) for query in queries]
+        finally:
+            daemon.terminate()
+            daemon.wait(timeout=60)
+
+    print(f"{'mode':>8} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, latencies in (('cold', cold), ('daemon', warm)):
+        latencies.sort()
+        print(f"{mode:>8} {sum(latencies) / len(latencies) * 1000:>8.1f} "
+              + ' '.join(f"{percentile(latencies, p) * 1000:>8.1f}" for p in (50, 95)))
+
+def bench_docstore(data_dir, num_queries=100, top_n=10, sample=2000):
+    """
+    在同一数据集上分别构建两种布局的索引：正文作为存储字段写入 Whoosh 索引 (stored)，
+    以及正文写入外部正文存储 (docstore，即 main.py index --docstore)。
+    比较索引大小、按 docno 读取单篇正文的延迟，以及为一批查询的前 top_n 个结果
+    按需生成摘要 (fetch_snippets) 的延迟
+    """
+    from index_builder import build_index
+    from docstore import docstore_files, get_docstore
+    with tempfile.TemporaryDirectory(prefix='tdt3-docstore-') as tmp_dir:
+        index_dirs = {}
+        print(f"{'layout':>9} {'build s':>8} {'whoosh MB':>10} {'store MB':>9} {'total MB':>9}")
+        for layout in ('stored', 'docstore'):
+            index_dir = index_dirs[layout] = os.path.join(tmp_dir, layout)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                build_index(data_dir, index_dir, docstore=layout == 'docstore')
+            elapsed = time.perf_counter() - start
+            store_files = set(docstore_files(index_dir))
+            sizes = [os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir)
+                     if name not in store_files]
+            store_size = sum(os.path.getsize(os.path.join(index_dir, name)) for name in store_files)
+            mb = 1024 * 1024
+            print(f"{layout:>9} {elapsed:>8.1f} {sum(sizes) / mb:>10.2f} {store_size / mb:>9.2f} "
+                  f"{(sum(sizes) + store_size) / mb:>9.2f}")
+
+        # 单篇正文：存储字段按文档号读取 (与命中的 hit["content"] 相同)，正文存储按 docno 读取
+        with open_dir(index_dirs['stored']).searcher() as searcher:
+            docnos = sorted(searcher.lexicon("docno"))
+            docnos = [d.decode('utf-8') if isinstance(d, bytes) else d for d in docnos]
+            docnos = random.Random(42).sample(docnos, min(sample, len(docnos)))
+            docnums = [searcher.document_number(docno=docno) for docno in docnos]
+            stored_texts, stored_times = [], []
+            for docnum in docnums:
+                start = time.perf_counter()
+                stored_texts.append(searcher.stored_fields(docnum)["content"])
+                stored_times.append(time.perf_counter() - start)
+        store = get_docstore(index_dirs['docstore'])
+        store_texts, store_times = [], []
+        for docno in docnos:
+            start = time.perf_counter()
+            store_texts.append(store.get(docno))
+            store_times.append(time.perf_counter() - start)
+        mismatches = sum(a != b for a, b in zip(stored_texts, store_texts))
+        print(f"\ncontent fetch, {len(docnos)} random docs ({mismatches} mismatched texts)")
+        print(f"{'layout':>9} {'mean us':>8} {'p50 us':>8} {'p95 us':>8}")
+        for layout, times in (('stored', stored_times), ('docstore', store_times)):
+            times.sort()
+            print(f"{layout:>9} {sum(times) / len(times) * 1e6:>8.1f} "
+                  + ' '.join(f"{percentile(times, p) * 1e6:>8.1f}" for p in (50, 95)))
+
+        # 摘要：先取得各查询的排名，再计时 fetch_snippets (读取正文 + 截取摘要 + 高亮)
+        queries = distinct_free_queries(index_dirs['stored'], num_queries)
+        previous = Config.INDEX_DIR
+        print(f"\nfetch_snippets, {len(queries)} free queries, top_n={top_n}")
+        print(f"{'layout':>9} {'ms/query':>9} {'read ms':>8}")
+        try:
+            for layout in ('stored', 'docstore'):
+                Config.INDEX_DIR = index_dirs[layout]
+                ranked = [(q, [r["docno"] for r in engine.execute_query(q, top_n, use_cache=False, markup=None)])
+                          for q in queries]
+                engine.fetch_snippets(*ranked[0])       # 预热
+                with trace_stages() as stages:
+                    start = time.perf_counter()
+                    for query, docnos in ranked:
+                        engine.fetch_snippets(query, docnos)
+                    elapsed = time.perf_counter() - start
+                print(f"{layout:>9} {elapsed / len(ranked) * 1000:>9.2f} "
+                      f"{stages.get('stored_fields', 0.0) / len(ranked) * 1000:>8.2f}")
+        finally:
+            Config.INDEX_DIR = previous
+
+def make_phrase_queries(searcher, count, seed=42):
+    """
+    按类别生成短语相关的查询：从随机文档中截取相邻的 2 个词和 3-4 个词作为短语 (一定出现)，
+    相邻两词改写为连字符词，另外把高频词两两组成短语 (各词常见、相邻出现少，需要比较位置的文档最多)。
+    混合查询由短语、连字符词和一个高频词组成
+
+    Returns:
+        dict: {类别: [查询, ...]}
+    """
+    from whoosh.analysis import StandardAnalyzer
+    rng = random.Random(seed)
+    analyzer = StandardAnalyzer()
+    num_docs = searcher.doc_count_all()
+    windows = {2: [], 3: []}
+    while min(len(found) for found in windows.values()) < count:
+        content = searcher.stored_fields(rng.randrange(num_docs)).get("content") or ""
+        tokens = [token.text for token in analyzer(content)]
+        size = rng.choice((2, 3, 4))
+        if len(tokens) > size:
+            start = rng.randrange(len(tokens) - size)
+            windows[min(size, 3)].append(tokens[start:start + size])
+    reader = searcher.reader()
+    frequent = sorted(((info.doc_frequency(), text) for text, info in reader.iter_field("content")),
+                      reverse=True)[:50]
+    frequent = [text.decode('utf-8') if isinstance(text, bytes) else text for _, text in frequent]
+    pairs = [rng.sample(frequent, 2) for _ in range(count)]
+    return {
+        "phrase-2": ['"%s"' % ' '.join(words) for words in windows[2][:count]],
+        "phrase-3+": ['"%s"' % ' '.join(words) for words in windows[3][:count]],
+        "phrase-freq": ['"%s %s"' % tuple(pair) for pair in pairs],
+        "hyphen": ['%s-%s' % tuple(words) for words in windows[2][:count]],
+        "mixed": ['"%s" %s-%s %s' % (' '.join(a), b[0], b[1], rng.choice(frequent))
+                  for a, b in zip(windows[3][:count], pairs)],
+    }
+
+def bench_shingles(data_dir, num_queries=50, top_n=10, repeat=3):
+    """
+    在同一数据集上分别构建不带和带二元词组字段 (main.py index --shingles) 的索引，
+    比较索引大小，以及各类短语查询经 execute_query 执行的延迟 (每个查询取 repeat 次中最短的一次)
+    和其中检索阶段的耗时；两种索引上的结果应完全相同
+    """
+    from index_builder import build_index
+    with tempfile.TemporaryDirectory(prefix='tdt3-shingles-') as tmp_dir:
+        index_dirs = {}
+        print(f"{'layout':>9} {'build s':>8} {'index MB':>9}")
+        for layout in ('plain', 'shingles'):
+            index_dir = index_dirs[layout] = os.path.join(tmp_dir, layout)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                build_index(data_dir, index_dir, shingles=layout == 'shingles')
+            elapsed = time.perf_counter() - start
+            size = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir))
+            print(f"{layout:>9} {elapsed:>8.1f} {size / (1024 * 1024):>9.2f}")
+
+        with open_dir(index_dirs['plain']).searcher() as searcher:
+            categories = make_phrase_queries(searcher, num_queries)
+        previous = Config.INDEX_DIR
+        print(f"\nexecute_query, {num_queries} queries per category, top_n={top_n}, best of {repeat}")
+        print(f"{'category':>11} {'layout':>9} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'search ms':>10} {'hits':>6} {'diff':>5}")
+        try:
+            for category, queries in categories.items():
+                baseline = None
+                for layout in ('plain', 'shingles'):
+                    Config.INDEX_DIR = index_dirs[layout]
+                    engine.execute_query(queries[0], top_n, use_cache=False, markup=None)    # 预热
+                    times, results = [], []
+                    with trace_stages() as stages:
+                        for query in queries:
+                            elapsed, result = _best_of(repeat, lambda: engine.execute_query(
+                                query, top_n, use_cache=False, markup=None))
+                            times.append(elapsed)
+                            results.append(list(result))
+                    times.sort()
+                    hits = sum(len(result) for result in results)
+                    diff = 0 if baseline is None else sum(a != b for a, b in zip(baseline, results))
+                    baseline = baseline or results
+                    search = stages.get('search', 0.0) / repeat / len(queries)
+                    print(f"{category:>11} {layout:>9} {sum(times) / len(times) * 1000:>8.2f} "
+                          + ' '.join(f"{percentile(times, p) * 1000:>8.2f}" for p in (50, 95))
+                          + f" {search * 1000:>10.2f} {hits:>6} {diff:>5}")
+        finally:
+            Config.INDEX_DIR = previous
+
+def bench_suggest(index_dir, num_prefixes=500, limit=8):
+    """
+    查询词补全的单次延迟：补全词表 (suggest.py) 与直接遍历 Whoosh 词典中以该前缀开头的词
+    再按文档频率排序，前缀从词表中随机抽取 (长度 1~4)，并检查两者结果一致。
+    补全文件在临时目录中重新生成，不改动索引目录
+    """
+    if is_sharded(index_dir):
+        dirs = [os.path.join(index_dir, name) for name in load_shard_config(index_dir)["shards"]]
+    else:
+        dirs = [index_dir]
+    with tempfile.TemporaryDirectory(prefix='tdt3-suggest-') as tmp_dir:
+        path = os.path.join(tmp_dir, SUGGEST_FILE)
+        build_seconds, num_terms = _best_of(1, lambda: build_suggestions(dirs, path))
+        suggester = Suggester(path)
+        size = os.path.getsize(path)
+
+    rng = random.Random(42)
+    prefixes = [term[:rng.randint(1, 4)] for term in rng.choices(suggester.terms, k=num_prefixes)]
+    readers = [open_dir(d).reader() for d in dirs]
+    try:
+        def scan(prefix):
+            frequencies = {}
+            for reader in readers:
+                for text in reader.expand_prefix("content", prefix):
+                    text = text.decode("utf-8") if isinstance(text, bytes) else text
+                    frequencies[text] = frequencies.get(text, 0) + reader.doc_frequency("content", text)
+            ranked = sorted(((t, df) for t, df in frequencies.items() if df >= MIN_DOC_FREQUENCY),
+                            key=lambda item: (-item[1], item[0]))
+            return ranked[:limit]
+
+        mismatches = 0
+        scan_times, suggest_times = [], []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            expected = scan(prefix)
+            scan_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            results = suggest(suggester, prefix, limit)
+            suggest_times.append(time.perf_counter() - start)
+            mismatches += [(r["term"], r["df"]) for r in results] != expected
+    finally:
+        for reader in readers:
+            reader.close()
+
+    scan_times.sort()
+    suggest_times.sort()
+    print(f"{num_terms} terms, {size / 1024:.0f} KB, built in {build_seconds * 1000:.0f} ms; "
+          f"{num_prefixes} prefixes, limit {limit}, {mismatches} mismatches")
+    for label, times in (("term dictionary scan", scan_times), ("suggest.idx", suggest_times)):
+        print(f"  {label:<22} p50 {percentile(times, 50) * 1e6:>9.1f} us  "
+              f"p99 {percentile(times, 99) * 1e6:>9.1f} us  max {times[-1] * 1e6:>9.1f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description='信息检索系统性能基准')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_parser = subparsers.add_parser('parse', help='SGML 解析吞吐量')
+    parse_parser.add_argument('--data-dir', help='数据集路径 (默认: 生成合成语料)')
+    parse_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    parse_parser.add_argument('--repeat', type=int, default=3, help='重复次数 (默认: 3)')
+
+    pruning_parser = subparsers.add_parser('pruning', help='top-k 剪枝与逐个评分对比')
+    pruning_parser.add_argument('--index-dir', help='索引路径 (默认: 生成合成语料并建索引)')
+    pruning_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    pruning_parser.add_argument('--hits', type=int, default=10, help='top_n (默认: 10)')
+
+    vector_parser = subparsers.add_parser('vector', help='Whoosh 与 NumPy 向量化评分吞吐量对比')
+    vector_parser.add_argument('--index-dir', help='索引路径 (默认: 生成合成语料并建索引)')
+    vector_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    vector_parser.add_argument('--queries', type=int, default=200, help='查询数 (默认: 200)')
+    vector_parser.add_argument('--hits', type=int, default=10, help='top_n (默认: 10)')
+
+    scorer_parser = subparsers.add_parser('scorer', help='CustomScorer 每秒评分的倒排项数 (改动前后对比)')
+    scorer_parser.add_argument('--index-dir', help='索引路径 (默认: 生成合成语料并建索引)')
+    scorer_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    scorer_parser.add_argument('--terms', type=int, default=200, help='高频词数 (默认: 200)')
+    scorer_parser.add_argument('--repeat', type=int, default=5, help='重复次数 (默认: 5)')
+
+    relevance_parser = subparsers.add_parser('relevance', help='各查询路径的排序质量与延迟回归测试')
+    relevance_parser.add_argument('--index-dir', help='索引路径 (默认: 生成带主题的合成测试集)')
+    relevance_parser.add_argument('--topics', help='主题文件 (TREC <top> 格式或每行 "qid<TAB>查询")')
+    relevance_parser.add_argument('--qrels', help='TREC qrels 文件')
+    relevance_parser.add_argument('--files', type=int, default=300, help='合成语料文件数 (默认: 300)')
+    relevance_parser.add_argument('--num-topics', type=int, default=40, help='合成主题数 (默认: 40)')
+    relevance_parser.add_argument('--paths', default=','.join(QUERY_PATHS),
+                                  help=f'查询路径，逗号分隔 (默认: {",".join(QUERY_PATHS)})')
+    relevance_parser.add_argument('--hits', type=int, default=100, help='top_n (默认: 100)')
+    relevance_parser.add_argument('--repeat', type=int, default=3, help='计时重复次数 (默认: 3)')
+    relevance_parser.add_argument('--out', help='把结果保存为 JSON')
+    relevance_parser.add_argument('--compare', help='与之前保存的 JSON 结果对比')
+
+    serve_parser = subparsers.add_parser('serve', help='serve.py 吞吐量随工作进程数的变化')
+    serve_parser.add_argument('--index-dir', help='索引路径 (默认: 生成合成语料并建索引)')
+    serve_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    serve_parser.add_argument('--workers', default='1,2,4', help='工作进程数，逗号分隔 (默认: 1,2,4)')
+    serve_parser.add_argument('--queries', type=int, default=400, help='请求数 (默认: 400)')
+    serve_parser.add_argument('--concurrency', type=int, default=8, help='并发客户端数 (默认: 8)')
+    serve_parser.add_argument('--hits', type=int, default=10, help='top_n (默认: 10)')
+
+    cli_parser = subparsers.add_parser('cli', help='main.py search 冷启动与常驻服务的单次调用延迟')
+    cli_parser.add_argument('--index-dir', help='索引路径 (默认: 生成合成语料并建索引)')
+    cli_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    cli_parser.add_argument('--queries', type=int, default=20, help='调用次数 (默认: 20)')
+    cli_parser.add_argument('--hits', type=int, default=10, help='top_n (默认: 10)')
+
+    docstore_parser = subparsers.add_parser('docstore', help='存储字段与外部正文存储的索引大小和摘要延迟')
+    docstore_parser.add_argument('--data-dir', help='数据集路径 (默认: 生成合成语料)')
+    docstore_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    docstore_parser.add_argument('--queries', type=int, default=100, help='查询数 (默认: 100)')
+    docstore_parser.add_argument('--hits', type=int, default=10, help='top_n (默认: 10)')
+
+    shingles_parser = subparsers.add_parser('shingles', help='有无二元词组字段时短语类查询的延迟')
+    shingles_parser.add_argument('--data-dir', help='数据集路径 (默认: 生成合成语料)')
+    shingles_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    shingles_parser.add_argument('--queries', type=int, default=50, help='每类查询数 (默认: 50)')
+    shingles_parser.add_argument('--hits', type=int, default=10, help='top_n (默认: 10)')
+    shingles_parser.add_argument('--repeat', type=int, default=3, help='重复次数 (默认: 3)')
+
+    suggest_parser = subparsers.add_parser('suggest', help='查询词补全的延迟')
+    suggest_parser.add_argument('--index-dir', help='索引路径 (默认: 生成合成索引)')
+    suggest_parser.add_argument('--files', type=int, default=500, help='合成语料文件数 (默认: 500)')
+    suggest_parser.add_argument('--prefixes', type=int, default=500, help='前缀数 (默认: 500)')
+    suggest_parser.add_argument('--limit', type=int, default=8, help='每个前缀的补全数 (默认: 8)')
+
+    args = parser.parse_args()
+    if args.command == 'parse':
+        tmp_dir = None
+        data_dir = args.data_dir
+        if not data_dir:
+            tmp_dir = tempfile.mkdtemp(prefix='tdt3-synthetic-')
+            data_dir = tmp_dir
+            generate_corpus(data_dir, num_files=args.files)
+        try:
+            bench_parse(data_dir, repeat=args.repeat)
+        finally:
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    elif args.command == 'pruning':
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            index_dir = args.index_dir or build_synthetic_index(tmp_dir, args.files)
+            bench_pruning(index_dir, top_n=args.hits)
+    elif args.command == 'vector':
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            index_dir = args.index_dir or build_synthetic_index(tmp_dir, args.files)
+            bench_vector(index_dir, num_queries=args.queries, top_n=args.hits)
+    elif args.command == 'scorer':
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            index_dir = args.index_dir or build_synthetic_index(tmp_dir, args.files)
+            bench_scorer(index_dir, num_terms=args.terms, repeat=args.repeat)
+    elif args.command == 'relevance':
+        paths = [p for p in args.paths.split(',') if p]
+        unknown = [p for p in paths if p not in QUERY_PATHS]
+        if unknown:
+            parser.error(f"unknown query paths: {', '.join(unknown)}")
+        if args.index_dir and not (args.topics and args.qrels):
+            parser.error("--index-dir requires --topics and --qrels")
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            if args.index_dir:
+                index_dir, topics_path, qrels_path = args.index_dir, args.topics, args.qrels
+            else:
+                index_dir, topics_path, qrels_path = build_synthetic_collection(tmp_dir, args.files,
+                                                                                args.num_topics)
+            report = bench_relevance(index_dir, read_topics(topics_path), read_qrels(qrels_path),
+                                     paths=paths, top_n=args.hits, repeat=args.repeat)
+        print_relevance(report)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=1)
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                compare_relevance(json.load(f), report)
+    elif args.command == 'serve':
+        worker_counts = [int(w) for w in args.workers.split(',') if w]
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            index_dir = args.index_dir or build_synthetic_index(tmp_dir, args.files)
+            bench_serve(index_dir, worker_counts, num_queries=args.queries,
+                        concurrency=args.concurrency, top_n=args.hits)
+    elif args.command == 'cli':
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            index_dir = args.index_dir or build_synthetic_index(tmp_dir, args.files)
+            bench_cli(index_dir, num_queries=args.queries, top_n=args.hits)
+    elif args.command == 'docstore':
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            data_dir = args.data_dir
+            if not data_dir:
+                data_dir = os.path.join(tmp_dir, 'tdt3')
+                generate_corpus(data_dir, num_files=args.files)
+            bench_docstore(data_dir, num_queries=args.queries, top_n=args.hits)
+    elif args.command == 'shingles':
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            data_dir = args.data_dir
+            if not data_dir:
+                data_dir = os.path.join(tmp_dir, 'tdt3')
+                generate_corpus(data_dir, num_files=args.files)
+            bench_shingles(data_dir, num_queries=args.queries, top_n=args.hits, repeat=args.repeat)
+    elif args.command == 'suggest':
+        with tempfile.TemporaryDirectory(prefix='tdt3-synthetic-') as tmp_dir:
+            index_dir = args.index_dir or build_synthetic_index(tmp_dir, args.files)
+            bench_suggest(index_dir, num_prefixes=args.prefixes, limit=args.limit)
+
+if __name__ == "__main__":
+    main()
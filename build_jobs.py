@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from index_builder import build_index, staging_dir_for
+from index_manager import invalidate_index
+from shards import build_shards
+
+class BuildJob:
+    """一次后台索引构建任务的状态"""
+
+    def __init__(self, data_dir, index_dir, options):
+        self.id = uuid.uuid4().hex[:12]
+        self.data_dir = data_dir
+        self.index_dir = index_dir
+        self.options = options
+        self.status = "pending"     # pending → running → done / failed
+        self.progress = {}
+        self.docs_written = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def update(self, state):
+        # 由构建线程调用；整体替换字典，读取方无需加锁
+        self.progress = dict(state)
+
+    def to_dict(self):
+        now = self.finished or time.time()
+        elapsed = now - self.started if self.started else 0.0
+        progress = self.progress
+        files_total = progress.get("files_total", 0)
+        files_done = progress.get("files_done", 0)
+        docs_indexed = progress.get("docs_indexed", 0)
+
+        throughput = docs_indexed / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.status == "running" and files_done and files_total:
+            # 按文件进度线性外推，提交和发布阶段的耗时不计入
+            eta = elapsed * (files_total - files_done) / files_done
+
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "phase": progress.get("phase"),
+            "data_dir": self.data_dir,
+            "index_dir": self.index_dir,
+            "options": self.options,
+            "files_total": files_total,
+            "files_done": files_done,
+            "docs_parsed": progress.get("docs_parsed", 0),
+            "docs_indexed": docs_indexed,
+            "docs_written": self.docs_written,
+            "elapsed": round(elapsed, 2),
+            "throughput": round(throughput, 1),
+            "eta": round(eta, 1) if eta is not None else None,
+            "error": self.error,
+        }
+
+class BuildJobManager:
+    """
+    在后台线程中运行索引构建
+
+    同一个索引目录同时只允许一个任务。全量构建写入独立的临时目录，
+    完成后由 index_builder.publish_index 原子发布，构建期间查询照常读取旧索引。
+    """
+
+    def __init__(self, max_jobs=20):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, data_dir, index_dir, **options):
+        """
+        提交构建任务
+
+        Returns:
+            tuple: (任务, 是否为新建任务)；目录已有运行中的任务时返回该任务
+        """
+        key = os.path.abspath(index_dir)
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status in ("pending", "running") and os.path.abspath(job.index_dir) == key:
+                    return job, False
+
+            job = BuildJob(data_dir, index_dir, options)
+            self._jobs[job.id] = job
+            # 只保留最近的若干个任务记录
+            while len(self._jobs) > self.max_jobs:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest.status in ("pending", "running"):
+                    break
+                del self._jobs[oldest_id]
+
+        thread = threading.Thread(target=self._run, args=(job,), daemon=True,
+                                  name=f"build-index-{job.id}")
+        thread.start()
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _run(self, job):
+        job.status = "running"
+        job.started = time.time()
+        options = dict(job.options)
+        shards = options.pop("shards", 1)
+        shard_by = options.pop("shard_by", "hash")
+        try:
+            if shards > 1:
+                # 各分片在构建进程池中并行构建，没有逐文件的进度回报
+                job.update({"phase": "indexing shards"})
+                job.docs_written = build_shards(
+                    job.data_dir, job.index_dir,
+                    num_shards=shards, shard_by=shard_by, **options
+                )
+            else:
+                job.docs_written = build_index(
+                    job.data_dir, job.index_dir,
+                    progress=job.update,
+                    staging_dir=staging_dir_for(job.index_dir, job.id),
+                    **options
+                )
+            job.status = "done"
+            invalidate_index(job.index_dir)
+        except Exception as e:
+            traceback.print_exc()
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
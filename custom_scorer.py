@@ -1,17 +1,198 @@
-from whoosh.scoring import BM25F
+from whoosh.scoring import BM25F, WeightLengthScorer, WeightScorer
+from array import array
 import math
+import threading
+import weakref
+
+# 每个读取器缓存的词项数上限，超出后清空重来 (查询词的种类通常远少于此)
+TERM_CACHE_SIZE = 100000
+NORM_CACHE_SIZE = 4     # 每个段保留的长度归一化数组个数 (不同平均长度)，refresh 前后两代索引各用各的
+
+class ReaderCache:
+    """
+    评分用的缓存，挂在 Whoosh 读取器对象上 (弱引用)：
+
+    - 整个索引的读取器：每个 (字段, 词) 的 (文档数, df, 平均长度)，每一代索引有各自的读取器，
+      新一代提交后旧读取器被丢弃，缓存随之释放，不会用到过期的统计量
+    - 单个段的读取器：每个 (字段, 词) 的 (最大词频, 最短长度)，按文档号排列的字段长度，
+      以及由长度算出的归一化数组 K1 * (1 - B + B * 长度 / 平均长度)。段不可变，refresh() 后
+      仍被复用：长度只解码一次；归一化数组依赖平均长度 (整个集合的统计量)，按 (字段, 平均长度,
+      B, K1) 保留最近 NORM_CACHE_SIZE 个，切换期间新旧两代索引的查询不会互相挤掉对方的数组
+    """
+
+    def __init__(self):
+        self._caches = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _cache(self, reader):
+        with self._lock:
+            cache = self._caches.get(reader)
+            if cache is None:
+                cache = self._caches[reader] = {"terms": {}, "bounds": {}, "lengths": {}, "norms": {}}
+            return cache
+
+    def term_stats(self, searcher, fieldname, text):
+        """(文档数, df, 平均长度)，取自整个索引 (分段搜索时为父搜索器)"""
+        terms = self._cache(searcher.reader())["terms"]
+        key = (fieldname, text)
+        stats = terms.get(key)
+        if stats is None:
+            if len(terms) >= TERM_CACHE_SIZE:
+                terms.clear()
+            stats = terms[key] = (searcher.doc_count_all(), searcher.doc_frequency(fieldname, text),
+                                  searcher.avg_field_length(fieldname) or 1)
+        return stats
+
+    def term_bounds(self, searcher, fieldname, text):
+        """(最大词频, 最短长度)，用于计算倒排表的得分上界"""
+        bounds = self._cache(searcher.reader())["bounds"]
+        key = (fieldname, text)
+        bound = bounds.get(key)
+        if bound is None:
+            if len(bounds) >= TERM_CACHE_SIZE:
+                bounds.clear()
+            ti = searcher.term_info(fieldname, text)
+            bound = bounds[key] = (ti.max_weight(), ti.min_length())
+        return bound
+
+    def field_lengths(self, searcher, fieldname):
+        """按 searcher 的文档号排列的字段长度 (array('d'))，与平均长度无关，每个段只解码一次"""
+        lengths = self._cache(searcher.reader())["lengths"]
+        values = lengths.get(fieldname)
+        if values is None:
+            reader = searcher.reader()
+            # 长度取自 doc_field_length (有损编码后的长度)，与逐个文档读取时完全相同；
+            # 没有该字段的文档返回 None，它们不会出现在这个字段的倒排表中
+            values = lengths[fieldname] = array('d', (
+                reader.doc_field_length(docnum, fieldname, 1) or 1
+                for docnum in range(reader.doc_count_all())))
+        return values
+
+    def length_norms(self, searcher, fieldname, avgdl, B, K1):
+        """按 searcher 的文档号排列的长度归一化数组 (array('d'))"""
+        norms = self._cache(searcher.reader())["norms"]
+        key = (fieldname, avgdl, B, K1)
+        values = norms.get(key)
+        if values is None:
+            lengths = self.field_lengths(searcher, fieldname)
+            # 表达式与 CustomBM25Scorer._score 相同，得分逐位一致
+            values = array('d', [K1 * (1 - B + B * length / avgdl) for length in lengths])
+            with self._lock:
+                while len(norms) >= NORM_CACHE_SIZE:
+                    norms.pop(next(iter(norms)))
+                norms[key] = values
+        return values
+
+scoring_cache = ReaderCache()
+
+class CollectionStats:
+    """
+    跨分片汇总的集合统计量 (文档数、字段总长度、查询词的文档频率)
+
+    分片查询时随请求传给各分片的 CustomScorer，使每个分片按整个集合的
+    统计量计算 IDF 和平均长度，各分片的得分可以直接比较。
+    """
+
+    def __init__(self, doc_count, field_lengths, doc_frequencies):
+        self.doc_count = doc_count
+        self.field_lengths = field_lengths
+        self.doc_frequencies = doc_frequencies
+
+    def doc_count_all(self):
+        return self.doc_count
+
+    def avg_field_length(self, fieldname):
+        if not self.doc_count:
+            return 0
+        return self.field_lengths.get(fieldname, 0) / self.doc_count
+
+    def doc_frequency(self, fieldname, text):
+        """未收集的词返回 None，由评分器退回本地统计量"""
+        if isinstance(text, str):
+            text = text.encode('utf-8')
+        return self.doc_frequencies.get((fieldname, text))
 
 class CustomScorer(BM25F):
-    def __init__(self, B=0.75, K1=1.2):
+    def __init__(self, B=0.75, K1=1.2, stats=None):
         super().__init__(B=B, K1=K1)
+        self.stats = stats
+
+    def scorer(self, searcher, fieldname, text, qf=1):
+        # Whoosh 通过 scorer() 取得每个查询词的评分对象，而不是调用模型的 score()
+        if not searcher.schema[fieldname].scorable:
+            return WeightScorer.for_(searcher, fieldname, text)
+        return CustomBM25Scorer(self, searcher, fieldname, text)
+
+    def idf(self, M, df):
+        # 与 Whoosh 默认的 IDF (WeightingModel.idf) 相同：原来的 score() 从未被 Whoosh 调用，
+        # 查询一直按 BM25F 的这个公式排序，评分对象沿用它，排序保持不变
+        return math.log(M / (df + 1)) + 1
 
-    def score(self, searcher, fieldname, text, matcher):
-        stats = self._get_basic_stats(searcher, fieldname, text)
-        tf = matcher.weight
-        return self.bm25(stats.avgdl, stats.M, stats.df, stats.field_length, tf)
-    
     def bm25(self, avgdl, M, df, field_length, tf):
-        idf = math.log((M - df + 0.5) / (df + 0.5 + 1))  # 修正IDF公式
+        idf = self.idf(M, df)
         numer = tf * (self.K1 + 1)
         denom = tf + self.K1 * (1 - self.B + self.B * field_length / avgdl)
-        return idf * numer / denom
\ No newline at end of file
+        return idf * (numer / denom)
+
+class CustomBM25Scorer(WeightLengthScorer):
+    """
+    CustomScorer 对单个查询词的评分对象
+
+    词项统计 (df、文档数、平均长度) 和 IDF 在构造时计算一次，统计量、倒排表的上界和
+    文档长度归一化数组缓存在读取器上 (见 ReaderCache)，同一代索引上的后续查询直接复用；
+    score() 每个文档只做一次数组访问和几次浮点运算，不再逐个文档解码长度。
+    max_quality / block_quality 给出整个倒排表和当前块的得分上界，
+    使 Whoosh 的 top-k 收集器可以跳过不可能进入结果的块 (block-max)，
+    并在 OR 查询中把上界不足的子句降级为可选匹配 (MaxScore)。
+    """
+
+    def __init__(self, model, searcher, fieldname, text):
+        stats = model.stats
+        df = stats.doc_frequency(fieldname, text) if stats is not None else None
+        if df is None:
+            # 分段搜索时使用整个索引 (父搜索器) 的统计量
+            self.M, self.df, self.avgdl = scoring_cache.term_stats(searcher.get_parent(), fieldname, text)
+        else:
+            self.M = stats.doc_count_all()
+            self.df = df
+            self.avgdl = stats.avg_field_length(fieldname) or 1
+        self.idf = model.idf(self.M, self.df)
+        self.B = model.B
+        self.K1 = model.K1
+        self.setup(searcher, fieldname, text)
+
+    def score(self, matcher):
+        # 与 _score(weight, length) 的运算顺序相同，得分逐位一致
+        weight = matcher.weight()
+        return self.idf * ((weight * (self.K1 + 1)) / (weight + self._norms[matcher.id()]))
+
+    def _score(self, weight, length):
+        # 运算顺序与 whoosh.scoring.bm25 相同，得分与 BM25FScorer 逐位一致
+        numer = weight * (self.K1 + 1)
+        denom = weight + self.K1 * (1 - self.B + self.B * length / self.avgdl)
+        return self.idf * (numer / denom)
+
+    def _bound(self, max_weight, min_length):
+        # 得分随词频递增、随文档长度递减，因此 (最大词频, 最短长度) 给出上界；
+        # IDF 不为正时 (子类换用其他 IDF 公式，例如经典 BM25 对高频词) 所有得分都不超过 0。
+        # 收集器无论是否开启剪枝都会用 max_quality 做 MaxScore 替换，这里必须是真正的上界
+        if self.idf <= 0:
+            return 0.0
+        return self._score(max_weight, min_length)
+
+    def supports_block_quality(self):
+        # Whoosh 的收集器假定得分非负 (初始阈值为 0，质量不高于阈值的块被跳过)，
+        # IDF 不为正的词不做块跳过
+        return self.idf > 0
+
+    def max_quality(self):
+        return self._maxquality
+
+    def block_quality(self, matcher):
+        return self._bound(matcher.block_max_weight(), matcher.block_min_length())
+
+    def setup(self, searcher, fieldname, text):
+        # dfl 为 WeightLengthScorer 逐个文档读取长度的接口，score() 改用预先算好的数组
+        self.dfl = lambda docid: searcher.doc_field_length(docid, fieldname, 1)
+        self._norms = scoring_cache.length_norms(searcher, fieldname, self.avgdl, self.B, self.K1)
+        self._maxquality = self._bound(*scoring_cache.term_bounds(searcher, fieldname, text))
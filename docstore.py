@@ -0,0 +1,282 @@
+"""
+外部正文存储：文档正文压缩后存放在索引目录中，不写入 Whoosh 的存储字段
+
+    docstore.idx          偏移表：数据文件名、预置字典，以及每个 docno 的正文在数据文件中的偏移和长度
+    docstore-<随机>.dat   各篇正文依次拼接，每篇单独以 raw deflate 压缩
+
+每篇单独压缩，读取一篇正文只需解压它自己的字节范围；跨文档的重复 (常用词、固定格式)
+由全部正文共用的预置字典 (zlib 的 zdict) 提供，该字典从构建时最先写入的若干篇正文中
+抽样得到。与把若干篇正文拼成一块整体压缩相比，压缩后的大小相当，读取时不必解压
+同一块中排在前面的正文 (见 python benchmark.py docstore)。
+数据文件通过 mmap 映射，读取时不必像存储字段那样反序列化整篇文档。
+
+使用 python main.py index --docstore 构建的索引带有正文存储 (见 index_builder.build_index)，
+此时 Whoosh 索引中的 content 字段只建倒排、不存储原文。
+
+偏移表按 docno 而不是文档号索引：文档号在段合并和删除后会变化，docno 不会。
+增量更新把新的正文追加到数据文件末尾，再原子地替换偏移表；被替换或删除的正文
+留在数据文件中，直到下一次全量构建
+"""
+import mmap
+import os
+import struct
+import sys
+import threading
+import uuid
+import zlib
+from array import array
+
+# 偏移表的文件名；数据文件名记录在偏移表中，全量构建时每次使用新的文件名
+DOCSTORE_TABLE = "docstore.idx"
+DOCSTORE_PREFIX = "docstore-"
+
+# 预置字典的大小上限 (deflate 的窗口大小)，以及抽取字典前缓存的正文字节数和抽样篇数
+ZDICT_SIZE = 32 * 1024
+ZDICT_SAMPLE_BYTES = 256 * 1024
+ZDICT_SAMPLE_DOCS = 64
+
+_MAGIC = b"TDT3DOCS"
+_VERSION = 1
+# 标识, 版本, 文档数, 数据文件有效长度, 数据文件名长度, 预置字典长度
+_HEADER = struct.Struct("<8sIIQII")
+
+def has_docstore(index_dir):
+    return os.path.exists(os.path.join(index_dir, DOCSTORE_TABLE))
+
+def docstore_files(index_dir):
+    """index_dir 中属于正文存储的文件名 (偏移表和全部数据文件，包括尚未清理的旧数据文件)"""
+    try:
+        names = os.listdir(index_dir)
+    except FileNotFoundError:
+        return []
+    return [name for name in names if name == DOCSTORE_TABLE
+            or (name.startswith(DOCSTORE_PREFIX) and name.endswith(".dat"))]
+
+def _to_disk(values):
+    # 偏移表统一使用小端字节序
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_disk(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def _compressor(zdict):
+    if zdict:
+        return zlib.compressobj(6, zlib.DEFLATED, -15, zdict=zdict)
+    return zlib.compressobj(6, zlib.DEFLATED, -15)
+
+def _decompressor(zdict):
+    if zdict:
+        return zlib.decompressobj(-15, zdict=zdict)
+    return zlib.decompressobj(-15)
+
+def sample_zdict(texts):
+    """从已编码的正文中均匀抽取至多 ZDICT_SAMPLE_DOCS 篇拼接，取末尾 ZDICT_SIZE 字节作为预置字典"""
+    step = max(1, len(texts) // ZDICT_SAMPLE_DOCS)
+    return b"".join(texts[::step])[-ZDICT_SIZE:]
+
+def read_table(path):
+    """读取偏移表，返回 (数据文件名, 数据文件有效长度, 预置字典, docno 列表, 偏移, 长度)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, num_docs, data_size, name_length, zdict_length = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f"{path} is not a docstore table of version {_VERSION}")
+    pos = _HEADER.size
+    data_name = data[pos:pos + name_length].decode("utf-8")
+    pos += name_length
+    zdict = data[pos:pos + zdict_length]
+    pos += zdict_length
+    offsets = _from_disk("Q", data[pos:pos + 8 * num_docs])
+    pos += 8 * num_docs
+    lengths = _from_disk("I", data[pos:pos + 4 * num_docs])
+    pos += 4 * num_docs
+    docnos = data[pos:].decode("utf-8").split("\n") if num_docs else []
+    return data_name, data_size, zdict, docnos, offsets, lengths
+
+def write_table(path, data_name, data_size, zdict, entries):
+    """entries 为 {docno: (偏移, 长度)}；先写临时文件再替换，读取方不会看到半截的偏移表"""
+    docnos = list(entries)
+    offsets, lengths = array("Q"), array("I")
+    for docno in docnos:
+        offset, length = entries[docno]
+        offsets.append(offset)
+        lengths.append(length)
+    name = data_name.encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(docnos), data_size, len(name), len(zdict)))
+        f.write(name)
+        f.write(zdict)
+        f.write(_to_disk(offsets))
+        f.write(_to_disk(lengths))
+        f.write("\n".join(docnos).encode("utf-8"))
+    os.replace(tmp_path, path)
+
+class DocStoreWriter:
+    """
+    写入正文存储：add() 压缩一篇正文并追加到数据文件，commit() 写出偏移表
+
+    新建的存储先缓存最初约 ZDICT_SAMPLE_BYTES 字节的正文，从中抽取预置字典后再开始写入。
+    append=True 时在 directory 已有的存储上追加 (增量更新)，沿用原有的预置字典。
+    commit() 之前读取方看到的一直是旧的偏移表；cancel() 放弃本次写入
+    """
+
+    def __init__(self, directory, append=False):
+        self.directory = directory
+        self.entries = {}       # docno → (偏移, 长度)
+        self._pending = []      # 抽取预置字典之前缓存的 (docno, 编码后的正文)
+        self._pending_size = 0
+        table_path = os.path.join(directory, DOCSTORE_TABLE)
+        if append and os.path.exists(table_path):
+            self.data_name, self.data_size, self.zdict, docnos, offsets, lengths = read_table(table_path)
+            self.entries = dict(zip(docnos, zip(offsets, lengths)))
+            self._file = open(os.path.join(directory, self.data_name), "r+b")
+            # 之前被取消的写入可能在末尾留下未被引用的数据
+            self._file.seek(self.data_size)
+            self._file.truncate()
+        else:
+            self.data_name = f"{DOCSTORE_PREFIX}{uuid.uuid4().hex[:12]}.dat"
+            self.data_size = 0
+            self.zdict = None
+            self._file = open(os.path.join(directory, self.data_name), "wb")
+
+    def add(self, docno, text):
+        """写入 (或替换) docno 的正文"""
+        data = text.encode("utf-8")
+        if self.zdict is not None:
+            self._write(docno, data)
+            return
+        self._pending.append((docno, data))
+        self._pending_size += len(data)
+        if self._pending_size >= ZDICT_SAMPLE_BYTES:
+            self._flush_pending()
+
+    def delete(self, docno):
+        self.entries.pop(docno, None)
+        self._pending = [(pending, data) for pending, data in self._pending if pending != docno]
+
+    def _write(self, docno, data):
+        compressor = _compressor(self.zdict)
+        compressed = compressor.compress(data) + compressor.flush()
+        self._file.write(compressed)
+        self.entries[docno] = (self.data_size, len(compressed))
+        self.data_size += len(compressed)
+
+    def _flush_pending(self):
+        self.zdict = sample_zdict([data for _, data in self._pending])
+        pending, self._pending = self._pending, []
+        for docno, data in pending:
+            self._write(docno, data)
+
+    def commit(self):
+        if self.zdict is None:
+            self._flush_pending()
+        self._file.close()
+        write_table(os.path.join(self.directory, DOCSTORE_TABLE), self.data_name, self.data_size,
+                    self.zdict, self.entries)
+
+    def cancel(self):
+        self._file.close()
+
+class DocStore:
+    """
+    只读的正文存储，get(docno) 返回正文；可以在多个线程间共享
+
+    打开时读入偏移表并映射数据文件。数据文件只会被追加或整体换成新文件，
+    已打开的实例始终读取它打开时的那一份内容
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        table_path = os.path.join(directory, DOCSTORE_TABLE)
+        stat = os.stat(table_path)
+        # 偏移表被替换 (重建或增量更新) 后 version 随之变化，见 get_docstore
+        self.version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        data_name, self.data_size, self.zdict, docnos, self.offsets, self.lengths = read_table(table_path)
+        self._positions = {docno: i for i, docno in enumerate(docnos)}
+        with open(os.path.join(directory, data_name), "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.data_size else b""
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, docno):
+        return docno in self._positions
+
+    def get(self, docno, default=None):
+        position = self._positions.get(docno)
+        if position is None:
+            return default
+        offset = self.offsets[position]
+        compressed = self._data[offset:offset + self.lengths[position]]
+        return _decompressor(self.zdict).decompress(compressed).decode("utf-8")
+
+    def size(self):
+        """数据文件的有效长度与偏移表的字节数之和"""
+        return self.data_size + os.path.getsize(os.path.join(self.directory, DOCSTORE_TABLE))
+
+class DocStoreSet:
+    """分片索引的正文存储：按 docno 依次在各分片的存储中查找"""
+
+    def __init__(self, stores):
+        self.stores = stores
+
+    def __len__(self):
+        return sum(len(store) for store in self.stores)
+
+    def __contains__(self, docno):
+        return any(docno in store for store in self.stores)
+
+    def get(self, docno, default=None):
+        for store in self.stores:
+            text = store.get(docno)
+            if text is not None:
+                return text
+        return default
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_docstore(index_dir):
+    """
+    index_dir 的正文存储 (进程内共享)，索引没有正文存储时返回 None。
+    每次调用检查偏移表，被替换后重新打开；旧实例由仍在使用它的查询继续读取
+    """
+    key = os.path.abspath(index_dir)
+    table_path = os.path.join(index_dir, DOCSTORE_TABLE)
+    for attempt in range(2):
+        try:
+            stat = os.stat(table_path)
+        except FileNotFoundError:
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with _stores_lock:
+            store = _stores.get(key)
+        if store is not None and store.version == version:
+            return store
+        try:
+            store = DocStore(index_dir)
+        except FileNotFoundError:
+            # 读取偏移表和映射数据文件之间恰好发布了新的存储，旧数据文件已被删除
+            if attempt:
+                raise
+            continue
+        with _stores_lock:
+            _stores[key] = store
+        return store
+
+def remove_docstore(index_dir, keep=()):
+    """删除 index_dir 中除 keep 以外的正文存储文件；已映射旧数据文件的进程不受影响"""
+    for name in docstore_files(index_dir):
+        if name not in keep:
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,147 @@
+import html
+import re
+
+# 高亮类别按优先级从高到低排列：短语 > 连字符词 > 短语中单词 > 自由词
+PHRASE, HYPHEN, PHRASE_TERM, FREE = range(4)
+
+ANSI_STYLES = {
+    PHRASE: '\033[31m',         # 红色
+    HYPHEN: '\033[34m',         # 蓝色
+    PHRASE_TERM: '\033[32m',    # 绿色
+    FREE: '\033[33m',           # 黄色
+}
+ANSI_BOLD = '\033[1m'
+ANSI_RESET = '\033[0m'
+
+HTML_CLASSES = {
+    PHRASE: 'highlight-phrase',
+    HYPHEN: 'highlight-hyphen',
+    PHRASE_TERM: 'highlight-term',
+    FREE: 'highlight-free',
+}
+
+WORD_PATTERN = re.compile(r'\w+')
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+class QueryHighlighter:
+    """
+    按查询字符串构造一次，之后对每个命中的文本提取摘要并高亮
+
+    查询中的短语、连字符词、短语中的单词和自由词被编译为一棵以词为单位的前缀树，
+    各模式的首词再合成一个正则。高亮时对文本只扫描一遍找出全部首词，从每个首词
+    出发沿前缀树匹配后续的词，得到全部候选区间 (等价于只在词边界上起止的
+    Aho-Corasick 匹配)；随后按优先级和起始位置依次接受与已接受区间不重叠的候选，
+    最后把区间渲染为 ANSI 或 HTML。
+    """
+
+    def __init__(self, query_str, query_type="free"):
+        query_str = query_str or ""
+        phrases = PHRASE_PATTERN.findall(query_str)
+        free_text = PHRASE_PATTERN.sub('', query_str).strip()
+        hyphen_words = [word.replace('-', ' ') for word in free_text.split() if '-' in word]
+        free_words = [word for word in free_text.split() if '-' not in word and len(word) > 2]
+
+        # 摘要以各查询组件首次出现位置的平均值为中心
+        self.anchors = [p.lower() for p in phrases] + [w.lower() for w in hyphen_words + free_words]
+
+        patterns = [(PHRASE, phrase) for phrase in phrases]
+        patterns += [(HYPHEN, word) for word in hyphen_words if len(word) > 2]
+        if query_type in ("mixed", "phrase"):
+            patterns += [(PHRASE_TERM, word) for phrase in phrases
+                         for word in phrase.split() if len(word) > 2]
+        patterns += [(FREE, word) for word in free_words]
+
+        # 前缀树的节点为 {词: (子节点, 类别)}；同一模式出现在多个类别中时只保留优先级最高的
+        self.trie = {}
+        for kind, pattern in patterns:
+            tokens = WORD_PATTERN.findall(pattern.lower())
+            if len(pattern) <= 2 or not tokens:
+                continue
+            node = self.trie
+            for i, token in enumerate(tokens):
+                child, current = node.get(token, (None, None))
+                if child is None:
+                    child = {}
+                if i == len(tokens) - 1 and (current is None or kind < current):
+                    current = kind
+                node[token] = (child, current)
+                node = child
+        # 模式的首词编译为一个正则 (长词在前)，由 re 在 C 层一次扫描出全部候选起点。
+        # 正则中不写 \b：逐个位置检查词边界会使扫描慢数倍，改为只对命中的候选检查
+        self.first_words = None
+        if self.trie:
+            words = sorted(self.trie, key=len, reverse=True)
+            self.first_words = re.compile('|'.join(map(re.escape, words)))
+
+    def snippet(self, content, length=700):
+        """截取以查询组件首次出现位置的平均值为中心、长度为 length 的摘要"""
+        lowered = content.lower()
+        positions = [pos for pos in (lowered.find(anchor) for anchor in self.anchors) if pos != -1]
+        if not positions:
+            return content[:length]
+        start = max(0, sum(positions) // len(positions) - length // 2)
+        return content[start:start + length]
+
+    def spans(self, text):
+        """返回按起始位置排序、互不重叠的高亮区间 [(起始, 结束, 类别)]"""
+        if self.first_words is None:
+            return []
+        lowered = _lower(text)
+        candidates = []
+        for match in self.first_words.finditer(lowered):
+            start, end = match.span()
+            if (start and _is_word_char(lowered[start - 1])) or \
+                    (end < len(lowered) and _is_word_char(lowered[end])):
+                continue
+            entry = self.trie.get(match.group())
+            while entry is not None:
+                node, kind = entry
+                if kind is not None:
+                    candidates.append((kind, start, end))
+                # 多词模式要求词之间只隔一个空格
+                if not node or lowered[end:end + 1] != ' ':
+                    break
+                word = WORD_PATTERN.match(lowered, end + 1)
+                if word is None:
+                    break
+                end = word.end()
+                entry = node.get(word.group())
+
+        candidates.sort()
+        taken = bytearray(len(text))
+        spans = []
+        for kind, start, end in candidates:
+            if taken.find(1, start, end) == -1:
+                taken[start:end] = b'\x01' * (end - start)
+                spans.append((start, end, kind))
+        spans.sort()
+        return spans
+
+    def render(self, text, markup="ansi"):
+        """把高亮区间渲染为 ANSI 转义序列 (markup="ansi") 或 HTML <span> (markup="html")"""
+        parts = []
+        last = 0
+        escape = html.escape if markup == "html" else str
+        for start, end, kind in self.spans(text):
+            parts.append(escape(text[last:start]))
+            if markup == "html":
+                parts.append(f'<span class="{HTML_CLASSES[kind]}">{escape(text[start:end])}</span>')
+            else:
+                parts.append(f"{ANSI_BOLD}{ANSI_STYLES[kind]}{text[start:end]}{ANSI_RESET}")
+            last = end
+        parts.append(escape(text[last:]))
+        return ''.join(parts)
+
+    def highlight(self, content, markup="ansi", length=700):
+        """提取摘要并高亮"""
+        return self.render(self.snippet(content, length), markup)
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+def _lower(text):
+    """转小写并保持每个字符的位置不变 (少数字符转小写后会变成多个字符，这些字符保持原样)"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
@@ -1,27 +1,372 @@
 from whoosh.fields import Schema, ID, TEXT
-from whoosh.index import create_in
+from whoosh.index import create_in, open_dir, exists_in
 from whoosh.analysis import StandardAnalyzer
-from preprocessor import parse_tdt3_dataset
+from preprocessor import iter_tdt3_dataset, iter_tdt3_files
+from docstore import DOCSTORE_TABLE, DocStoreWriter, docstore_files, has_docstore, remove_docstore
+from shingles import SHINGLE_FIELD, shingle_field
+from suggest import SUGGEST_FILE, build_suggestions
+import json
 import os
+import shutil
+import sys
+import threading
+import time
+import weakref
 
-def build_index(root_dir, index_dir):
-    os.makedirs(index_dir, exist_ok=True)
-    
-    # 使用标准分析器，它会自动处理分词
+# 每个写入进程的内存缓冲上限 (MB)，超过后写出一个临时段
+DEFAULT_LIMITMB = 128
+
+MANIFEST_VERSION = 1
+
+# 分片索引目录中的分片布局文件 (见 shards.py)；存在时查询按分片扇出
+SHARDS_FILE = "shards.json"
+
+def peak_memory_mb():
+    """
+    返回 (当前进程峰值 RSS, 子进程中最大的峰值 RSS)，单位 MB
+
+    依赖 resource 模块，在不支持的平台 (如 Windows) 上返回 (None, None)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    child_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return self_peak, child_peak
+
+def create_schema(docstore=False, shingles=False):
+    # 使用标准分析器，它会自动处理分词；docno 作为唯一键，支持增量更新，
+    # 同时写入列 (sortable)，排序和去重时按文档号读取 docno 不必加载整个存储字段 (见 docno_lookup)
+    # docstore=True 时正文写入外部正文存储 (docstore.py)，content 只建倒排、不存储
+    # shingles=True 时正文另外按相邻词对写入二元词组字段，用于加速短语查询 (见 shingles.py)
+    # source/date/headline 为 SGML 中的结构字段，缺失时不写入
     schema = Schema(
-        docno=ID(stored=True),
-        content=TEXT(stored=True)
+        docno=ID(stored=True, unique=True, sortable=True),
+        content=TEXT(stored=not docstore),
+        source=ID(stored=True),
+        date=ID(stored=True),
+        headline=TEXT(stored=True)
     )
-    
-    ix = create_in(index_dir, schema)
-    writer = ix.writer()
-
-    docs = parse_tdt3_dataset(root_dir)
-    for doc in docs:
-        writer.add_document(
-            docno=doc["docno"],
-            content=doc["text"]
-        )
-
-    writer.commit()
-    print(f"Index built successfully (Total docs: {len(docs)})")
\ No newline at end of file
+    if shingles:
+        schema.add(SHINGLE_FIELD, shingle_field())
+    return schema
+
+_docno_columns = weakref.WeakKeyDictionary()
+_docno_columns_lock = threading.Lock()
+
+def docno_lookup(reader):
+    """
+    返回 文档号 → docno 的函数。
+
+    Whoosh 把一篇文档的存储字段整体序列化，读取 hit["docno"] 会连同正文一起反序列化；
+    docno 列只存编号本身。列读取器按读取器缓存 (弱引用，随读取器释放)；
+    之前构建、没有 docno 列的索引退回读取存储字段
+    """
+    with _docno_columns_lock:
+        lookup = _docno_columns.get(reader)
+    if lookup is None:
+        if reader.has_column("docno"):
+            lookup = reader.column_reader("docno").__getitem__
+        else:
+            lookup = lambda docnum: reader.stored_fields(docnum)["docno"]
+        with _docno_columns_lock:
+            _docno_columns[reader] = lookup
+    return lookup
+
+def _document_fields(doc, shingles=False):
+    fields = {"docno": doc["docno"], "content": doc["text"]}
+    if shingles:
+        fields[SHINGLE_FIELD] = doc["text"]
+    for name in ("source", "date", "headline"):
+        if doc.get(name):
+            fields[name] = doc[name]
+    return fields
+
+def manifest_path(index_dir):
+    """文件指纹清单的位置：与索引目录同级的 <index_dir>.manifest.json"""
+    return os.path.normpath(index_dir) + ".manifest.json"
+
+def load_manifest(index_dir):
+    try:
+        with open(manifest_path(index_dir), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(index_dir, root_dir, files):
+    """先写临时文件再替换，避免中断时留下半截清单"""
+    path = manifest_path(index_dir)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "root_dir": os.path.abspath(root_dir),
+        "files": files,
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def _relpath(file_path, root_dir):
+    return os.path.relpath(file_path, root_dir).replace(os.sep, '/')
+
+def _manifest_entry(fingerprint, docs):
+    entry = dict(fingerprint)
+    entry["docnos"] = [doc["docno"] for doc in docs]
+    return entry
+
+def staging_dir_for(index_dir, token=None):
+    """全量构建使用的临时目录，与索引目录同级以保证发布时可以原子重命名"""
+    token = token or f"{os.getpid()}-{int(time.time() * 1000)}"
+    return f"{os.path.normpath(index_dir)}.staging-{token}"
+
+def publish_index(staging_dir, index_dir):
+    """
+    将 staging_dir 中构建好的索引发布为 index_dir 的新一代
+
+    沿用 Whoosh 自身的提交方式：段文件名带随机 ID，先移入 index_dir；
+    随后写入编号更大的 TOC 文件 (临时文件 + 重命名)，这一步才让新索引可见。
+    已打开的搜索器继续读取上一代的文件，之后打开的搜索器读取新一代。
+    只使用 Whoosh 的公开接口 (TOC.read/write、Segment.list_files、latest_generation、clean_files)。
+    """
+    from whoosh.filedb.filestore import FileStorage
+    from whoosh.index import TOC, clean_files
+
+    os.makedirs(index_dir, exist_ok=True)
+    staging = FileStorage(staging_dir)
+    target = FileStorage(index_dir)
+    indexname = open_dir(staging_dir).indexname
+    toc = TOC.read(staging, indexname)
+
+    # 与 Whoosh 写入器使用同一把锁，避免和增量更新的提交交错
+    writelock = target.lock(indexname + "_WRITELOCK")
+    writelock.acquire(blocking=True)
+    try:
+        # 正文存储先于 TOC 就位，新一代可见时它的正文已经可以读取；
+        # 数据文件名每次不同，偏移表最后替换，读取方总是看到一致的一对文件
+        new_docstore = sorted(docstore_files(staging_dir), key=lambda name: name == DOCSTORE_TABLE)
+        for name in new_docstore:
+            os.replace(os.path.join(staging_dir, name), os.path.join(index_dir, name))
+        # 补全词表同样在新一代可见之前替换
+        if os.path.exists(os.path.join(staging_dir, SUGGEST_FILE)):
+            os.replace(os.path.join(staging_dir, SUGGEST_FILE), os.path.join(index_dir, SUGGEST_FILE))
+        for segment in toc.segments:
+            for name in segment.list_files(staging):
+                os.replace(os.path.join(staging_dir, name), os.path.join(index_dir, name))
+        latest = open_dir(index_dir, indexname).latest_generation() if exists_in(index_dir, indexname) else -1
+        toc.generation = latest + 1
+        toc.write(target, indexname)
+        clean_files(target, indexname, toc.generation, toc.segments)
+        # 上一代的数据文件 (新索引不使用正文存储时为整个正文存储)
+        remove_docstore(index_dir, keep=new_docstore)
+    finally:
+        writelock.release()
+
+    if os.path.exists(manifest_path(staging_dir)):
+        os.replace(manifest_path(staging_dir), manifest_path(index_dir))
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    # 目录之前是分片索引时，去掉布局文件使查询改用刚发布的单一索引
+    if os.path.exists(os.path.join(index_dir, SHARDS_FILE)):
+        os.remove(os.path.join(index_dir, SHARDS_FILE))
+    return toc.generation
+
+def build_index(root_dir, index_dir, procs=1, limitmb=DEFAULT_LIMITMB, incremental=False,
+                progress=None, staging_dir=None, files=None, docstore=False,
+                shingles=False):
+    """
+    流式构建索引：文件解析与预处理分发到 procs 个进程，
+    procs > 1 时同时使用 Whoosh 的多进程写入器，每个进程各自写出一个段。
+    incremental=True 时只处理相对上次构建新增、修改或删除的文件。
+
+    全量构建先写入临时目录，完成后通过 publish_index 原子地替换
+    index_dir 中的当前索引，构建期间的查询不受影响。
+    progress 为可选回调，接收包含 phase/files_total/files_done/
+    docs_parsed/docs_indexed 的字典。
+    files 限定参与构建的文件 (分片构建时使用)，默认为 root_dir 下全部文件。
+    docstore=True 时正文写入索引目录中的外部正文存储 (见 docstore.py)，不作为存储字段写入索引。
+    shingles=True 时另外建立二元词组字段，两个词的短语和连字符词只需查找一个词项 (见 shingles.py)。
+    返回本次写入 (新增或更新) 的文档数。
+    """
+    if incremental:
+        manifest = load_manifest(index_dir)
+        if manifest is None or manifest["root_dir"] != os.path.abspath(root_dir):
+            print("No usable manifest for this index, falling back to a full build")
+        elif not exists_in(index_dir):
+            print("Index not found, falling back to a full build")
+        else:
+            ix = open_dir(index_dir)
+            # 正文的存放方式 (存储字段或外部正文存储) 与本次构建不同时同样退回全量构建；
+            # 是否带有二元词组字段体现在字段名中
+            same_layout = ix.schema["content"].stored != docstore and has_docstore(index_dir) == docstore
+            if set(ix.schema.names()) == set(create_schema(shingles=shingles).names()) \
+                    and ix.schema["docno"].unique and same_layout:
+                return _update_index(ix, root_dir, index_dir, manifest, procs, limitmb, progress,
+                                     files=files, docstore=docstore, shingles=shingles)
+            print("Index schema is out of date, falling back to a full build")
+
+    start = time.time()
+    # 先列出文件再创建暂存目录：数据目录不存在时直接报错，不留下空的暂存目录
+    file_paths = list(iter_tdt3_files(root_dir) if files is None else files)
+    staging_dir = staging_dir or staging_dir_for(index_dir)
+    os.makedirs(staging_dir, exist_ok=True)
+    ix = create_in(staging_dir, create_schema(docstore, shingles))
+    writer = ix.writer(procs=procs, limitmb=limitmb, multisegment=procs > 1)
+    store = DocStoreWriter(staging_dir) if docstore else None
+
+    state = _progress_state(len(file_paths))
+    total = 0
+    files = {}
+    try:
+        for file_path, docs, fingerprint in iter_tdt3_dataset(root_dir, procs=procs, files=file_paths):
+            state["files_done"] += 1
+            state["docs_parsed"] += len(docs)
+            for doc in docs:
+                writer.add_document(**_document_fields(doc, shingles))
+                if store is not None:
+                    store.add(doc["docno"], doc["text"])
+                total += 1
+            state["docs_indexed"] = total
+            if fingerprint is not None:
+                files[_relpath(file_path, root_dir)] = _manifest_entry(fingerprint, docs)
+            if progress:
+                progress(state)
+
+        _set_phase(state, "committing", progress)
+        if store is not None:
+            store.commit()
+        writer.commit()
+    except BaseException:
+        writer.cancel()
+        if store is not None:
+            store.cancel()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    # 查询词补全的词表从刚写好的 content 词典生成，随索引一起发布 (见 suggest.py)
+    build_suggestions([staging_dir], os.path.join(staging_dir, SUGGEST_FILE))
+    save_manifest(staging_dir, root_dir, files)
+    _set_phase(state, "publishing", progress)
+    publish_index(staging_dir, index_dir)
+    elapsed = max(time.time() - start, 1e-9)
+
+    self_peak, child_peak = peak_memory_mb()
+    print(f"Index built successfully (Total docs: {total})")
+    print(f"  {elapsed:.2f}s, {total / elapsed:.1f} docs/sec (procs={procs}, limitmb={limitmb})")
+    if self_peak is not None:
+        print(f"  Peak memory: main {self_peak:.1f} MB, largest worker {child_peak:.1f} MB")
+    return total
+
+def _progress_state(files_total):
+    return {
+        "phase": "indexing",
+        "files_total": files_total,
+        "files_done": 0,
+        "docs_parsed": 0,
+        "docs_indexed": 0,
+    }
+
+def _set_phase(state, phase, progress):
+    state["phase"] = phase
+    if progress:
+        progress(state)
+
+def _update_index(ix, root_dir, index_dir, manifest, procs, limitmb, progress=None,
+                  files=None, docstore=False, shingles=False):
+    """
+    按文件指纹增量更新索引
+
+    mtime/size 未变的文件直接跳过；变化的文件重新解析，若 sha1 也未变
+    只刷新清单中的指纹。文档按唯一的 docno 更新，旧文件中已不存在的
+    docno 以及被删除文件的全部 docno 从索引中删除。
+    docstore=True 时正文存储同步追加和删除，shingles=True 时同时写入二元词组字段。
+    """
+    start = time.time()
+    old_files = manifest["files"]
+    file_paths = iter_tdt3_files(root_dir) if files is None else files
+    files = {}
+    changed = []
+    seen = set()
+    for file_path in file_paths:
+        rel = _relpath(file_path, root_dir)
+        seen.add(rel)
+        entry = old_files.get(rel)
+        stat = os.stat(file_path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            files[rel] = entry
+        else:
+            changed.append(file_path)
+    removed = [rel for rel in old_files if rel not in seen]
+
+    stale_docnos = set()
+    for rel in removed:
+        stale_docnos.update(old_files[rel]["docnos"])
+
+    if not changed and not removed:
+        print(f"Index is up to date ({len(files)} files unchanged)")
+        return 0
+
+    state = _progress_state(len(changed))
+    writer = ix.writer(limitmb=limitmb)
+    # 在持有写锁之后打开，不会与其他写入者同时追加数据文件
+    store = DocStoreWriter(index_dir, append=True) if docstore else None
+    updated = 0
+    try:
+        for file_path, docs, fingerprint in iter_tdt3_dataset(root_dir, procs=procs, files=changed):
+            state["files_done"] += 1
+            state["docs_parsed"] += len(docs)
+            if progress:
+                progress(state)
+            rel = _relpath(file_path, root_dir)
+            entry = old_files.get(rel)
+            if fingerprint is None:
+                # 读取失败，保留旧的索引内容，下次再试
+                if entry:
+                    files[rel] = entry
+                continue
+            if entry and entry["sha1"] == fingerprint["sha1"]:
+                files[rel] = dict(entry, mtime_ns=fingerprint["mtime_ns"], size=fingerprint["size"])
+                continue
+            if entry:
+                stale_docnos.update(entry["docnos"])
+            for doc in docs:
+                writer.update_document(**_document_fields(doc, shingles))
+                if store is not None:
+                    store.add(doc["docno"], doc["text"])
+                updated += 1
+            state["docs_indexed"] = updated
+            files[rel] = _manifest_entry(fingerprint, docs)
+
+        # 仍存在于其他文件中的 docno 已由 update_document 替换，不能删除
+        live_docnos = set()
+        for entry in files.values():
+            live_docnos.update(entry["docnos"])
+        deleted = 0
+        for docno in stale_docnos - live_docnos:
+            deleted += writer.delete_by_term("docno", docno)
+            if store is not None:
+                store.delete(docno)
+
+        # Whoosh 的提交本身就是原子的代际切换，无需经过临时目录；
+        # 正文存储的偏移表先替换，新一代可见时新增和更新的正文已经就绪
+        _set_phase(state, "committing", progress)
+        if store is not None:
+            store.commit()
+        writer.commit()
+    except BaseException:
+        writer.cancel()
+        if store is not None:
+            store.cancel()
+        raise
+
+    build_suggestions([index_dir], os.path.join(index_dir, SUGGEST_FILE))
+    save_manifest(index_dir, root_dir, files)
+    elapsed = time.time() - start
+    print(f"Index updated incrementally in {elapsed:.2f}s "
+          f"({len(changed)} changed files, {len(removed)} removed files, "
+          f"{updated} docs added/updated, {deleted} docs deleted)")
+    return updated
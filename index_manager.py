@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from whoosh.index import open_dir
+from custom_scorer import CustomScorer
+
+class IndexManager:
+    """
+    进程内共享的索引/搜索器管理器
+
+    索引只打开一次；搜索器放在空闲池中复用，每次借出给一个线程独占
+    (Whoosh 的搜索器不是线程安全的)。最多每 check_interval 秒检查一次
+    索引目录是否出现了新的一代，有新一代时借出的搜索器通过 refresh()
+    更新，未变化的段读取器会被复用。
+    """
+
+    def __init__(self, index_dir, weighting=CustomScorer, check_interval=1.0, max_idle=8):
+        self.index_dir = index_dir
+        self.weighting = weighting
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+        self._ix = None
+        self._generation = -1
+        self._last_check = 0.0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def index(self):
+        """返回已打开的索引对象，首次调用时打开"""
+        with self._lock:
+            if self._ix is None:
+                self._ix = open_dir(self.index_dir)
+                self._generation = self._ix.latest_generation()
+                self._last_check = time.monotonic()
+            return self._ix
+
+    @property
+    def generation(self):
+        """当前可见的索引代号，检查频率受 check_interval 限制"""
+        self._check_generation()
+        return self._generation
+
+    def invalidate(self):
+        """通知管理器索引已更新，下次借出搜索器时立即检查新一代"""
+        self._last_check = 0.0
+
+    def _check_generation(self):
+        ix = self.index()
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        self._generation = ix.latest_generation()
+
+    @contextmanager
+    def searcher(self, weighting=None):
+        """
+        借出一个与当前代一致的搜索器，用完后归还空闲池
+
+        weighting 只对本次借出生效 (例如带全局统计量的分片评分器)，归还时恢复默认
+        """
+        searcher = self._acquire()
+        default = searcher.weighting
+        if weighting is not None:
+            searcher.weighting = weighting
+        try:
+            yield searcher
+        finally:
+            searcher.weighting = default
+            self._release(searcher)
+
+    def _acquire(self):
+        self._check_generation()
+        with self._lock:
+            searcher = self._idle.pop() if self._idle else None
+        if searcher is None:
+            return self.index().searcher(weighting=self.weighting())
+        if searcher.reader().generation() != self._generation:
+            # refresh() 复用未变化的段读取器，只打开新一代新增的段
+            searcher = searcher.refresh()
+        return searcher
+
+    def _release(self, searcher):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(searcher)
+                return
+        searcher.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._ix = None
+        for searcher in idle:
+            searcher.close()
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_index_manager(index_dir="indexdir"):
+    """返回 index_dir 对应的进程级单例管理器"""
+    key = os.path.abspath(index_dir)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = IndexManager(index_dir)
+        return manager
+
+def forget_managers():
+    """
+    在 fork 出的子进程中调用：丢弃从父进程继承的管理器，之后按需重新打开索引。
+    继承的文件描述符与父进程共享读写位置，不能在子进程中继续使用；
+    锁也可能在 fork 时正被其他线程持有，因此一并换新
+    """
+    global _managers, _managers_lock
+    _managers = {}
+    _managers_lock = threading.Lock()
+
+def invalidate_index(index_dir):
+    """索引目录被重建或更新后调用，让已有的管理器尽快切换到新一代"""
+    with _managers_lock:
+        manager = _managers.get(os.path.abspath(index_dir))
+    if manager is not None:
+        manager.invalidate()
@@ -1,20 +1,58 @@
+import os
 import sys
+
+if __name__ == "__main__" and sys.argv[1:2] == ["search"]:
+    # 常驻查询服务 (search_daemon.py) 在运行时把查询交给它执行；
+    # 放在其余导入之前，转发查询的客户端只需要标准库
+    from search_daemon import forward_search
+    exit_code = forward_search(sys.argv[2:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
 import re
-from search_engine import search_query
-from index_builder import build_index
-from whoosh.index import open_dir
+import time
+import functools
+import io
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+from index_builder import build_index, docno_lookup, DEFAULT_LIMITMB
+from index_manager import get_index_manager, forget_managers
+from docstore import get_docstore
+from shingles import ShinglePhrase
+from suggest import get_suggester, suggest
+from shards import (ShardedSearcher, build_shards, get_shard_set, is_sharded, forget_shard_sets,
+                    SHARD_STRATEGIES)
+from result_cache import ResultCache, normalize_query
+from whoosh.collectors import TimeLimitCollector, TimeLimit, WrappingCollector
+from whoosh.index import EmptyIndexError
 from whoosh.qparser import QueryParser, PhrasePlugin
-from whoosh.highlight import HtmlFormatter, ContextFragmenter, Highlighter
-from custom_scorer import CustomScorer
+from whoosh.query import Or, NullQuery, CompoundQuery
+from highlighter import QueryHighlighter
+from metrics import stage, observe_stage, trace_stages, QUERY_SECONDS, QUERIES
 from typing import Tuple, List, Dict
-from tqdm import tqdm  # 需要安装 tqdm
-from preprocessor import parse_tdt3_dataset
+import heapq
 import traceback
 
 
 class Config:
     DEFAULT_HITS = 10
     MAX_HITS = 100
+    INDEX_DIR = "indexdir"
+    DEFAULT_PROCS = 1
+    DEFAULT_LIMITMB = DEFAULT_LIMITMB
+    CACHE_SIZE = 1024        # 结果缓存条目上限，0 表示关闭缓存
+    CACHE_TTL = 300          # 结果缓存有效期 (秒)
+    MIXED_SINGLE_PASS = True # 混合查询单遍执行；False 时使用 AND + OR 两次查询再合并
+    PRUNING = False          # top-k 剪枝 (block-max / MaxScore)；在测试语料上没有加速，且结果数量变为估计值，默认关闭
+    VECTOR_ENGINE = False    # 自由查询使用 NumPy 向量化评分 (vector_engine.py)，首次查询时导出倒排表
+    SHARD_WORKERS = 0        # 分片索引的查询进程数，0 表示取 CPU 核数；1 表示在本进程中依次查询各分片
+    LOG_LEVEL = "WARNING"    # 日志级别；DEBUG 时输出查询模式、结果数量等提示信息
+    QUERY_TIMEOUT = 0        # 每个查询的时间预算 (秒)，超出后返回已就绪的结果并标记为不完整；0 表示不限时
+    SUGGEST_LIMIT = 8        # 查询词补全默认返回的候选数
+    MAX_SUGGESTIONS = 50     # 查询词补全的候选数上限
     COLOR = {
         'reset': '\033[0m',
         'bold': '\033[1m',
@@ -24,56 +62,297 @@ class Config:
         'warning': '\033[93m'    # 黄色
     }
 
+logger = logging.getLogger("tdt3")
+
+# 进程内共享的查询结果缓存
+result_cache = ResultCache(max_size=Config.CACHE_SIZE, ttl=Config.CACHE_TTL)
+
+# 批量查询期间本线程共享的搜索器和查询解析器 (见 execute_queries)
+_batch = threading.local()
+
+# 本线程正在执行的查询的时间预算 (见 execute_query)
+_budget = threading.local()
+
+class QueryBudget:
+    """
+    一次查询的时间预算，从创建时开始计时；seconds 为 0 或 None 时不限时。
+    查询的各阶段 (收集命中、生成摘要) 在预算用完后停止，exhausted 记录是否因此截断过结果
+    """
+
+    def __init__(self, seconds=None):
+        self.start = time.monotonic()
+        self.deadline = self.start + seconds if seconds else None
+        self.exhausted = False
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        """剩余秒数，不限时时返回 None"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self):
+        """预算是否已用完；用完时记为已截断"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.exhausted = True
+        return self.exhausted
+
+class QueryResults(list):
+    """
+    execute_query 的返回值：格式化后的结果列表，另带 partial (是否因超出时间预算而不完整)、
+    elapsed (查询耗时，秒) 和 explain (EXPLAIN 模式下的执行记录，否则为 None)
+    """
+
+    def __init__(self, results=(), partial=False, elapsed=0.0, explain=None):
+        super().__init__(results)
+        self.partial = partial
+        self.elapsed = elapsed
+        self.explain = explain
+
+def current_budget():
+    """本线程正在执行的查询的时间预算，不在 execute_query 中时返回 None"""
+    return getattr(_budget, "current", None)
+
+class QueryExplain:
+    """
+    EXPLAIN 模式下一次查询的执行记录
+
+    查询函数每执行一次 Whoosh (或向量化) 查询就调用一次 add_search，记录解析后的查询、
+    各子句涉及的词项的文档频率 (倒排表长度) 和总词频、评分的文档数以及匹配/评分耗时；
+    各阶段 (解析、收集、读取存储字段、摘要、高亮) 的耗时由 metrics.trace_stages 累计
+    """
+
+    def __init__(self, query_str, query_type):
+        self.query_str = query_str
+        self.query_type = query_type
+        self.searches = []
+        self.stages = {}
+        self.profile = None
+
+    def add_search(self, searcher, query, engine, docs_scored=None, matching=None, scoring=None,
+                   hits=None, total=None):
+        clauses = list(query.subqueries) if isinstance(query, CompoundQuery) else [query]
+        self.searches.append({
+            "engine": engine,
+            "query": str(query),
+            "clauses": [{"clause": str(clause),
+                         "terms": [term_stats(searcher, fieldname, text)
+                                   for fieldname, text in clause.iter_all_terms()]}
+                        for clause in clauses],
+            "docs_scored": docs_scored,
+            "matching_ms": _ms(matching),
+            "scoring_ms": _ms(scoring),
+            "search_ms": _ms(total),
+            "hits": hits,
+        })
+
+    def to_dict(self, elapsed):
+        explain = {
+            "query": self.query_str,
+            "type": self.query_type,
+            "searches": self.searches,
+            "stages_ms": {name: _ms(seconds) for name, seconds in self.stages.items()},
+            "elapsed_ms": _ms(elapsed),
+        }
+        if self.profile is not None:
+            explain["profile"] = self.profile
+        return explain
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+def term_stats(searcher, fieldname, text):
+    """词项的文档频率 (倒排表长度) 和总词频；分片索引为各分片之和"""
+    searchers = searcher.searchers if isinstance(searcher, ShardedSearcher) else [searcher]
+    return {
+        "field": fieldname,
+        "text": text.decode("utf-8") if isinstance(text, bytes) else text,
+        "df": sum(s.doc_frequency(fieldname, text) for s in searchers),
+        "freq": int(sum(s.frequency(fieldname, text) for s in searchers)),
+    }
+
+def current_explain():
+    """本线程正在执行的查询的 EXPLAIN 记录，不在 EXPLAIN 模式下时返回 None"""
+    return getattr(_budget, "explain", None)
+
+def format_explain(explain):
+    """把 EXPLAIN 记录格式化为命令行输出的文本"""
+    def ms(value):
+        return "-" if value is None else f"{value:.2f} ms"
+
+    lines = [f"[EXPLAIN] 查询: {explain['query']} | 类型: {explain['type']} | 总耗时: {ms(explain['elapsed_ms'])}"]
+    for i, search in enumerate(explain["searches"], 1):
+        lines.append(f"  查询 {i} ({search['engine']}): {search['query']}")
+        for clause in search["clauses"]:
+            terms = ", ".join(f"{t['text']} df={t['df']} freq={t['freq']}" for t in clause["terms"])
+            lines.append(f"    子句 {clause['clause']}: {terms or '(无词项)'}")
+        docs = "-" if search["docs_scored"] is None else search["docs_scored"]
+        lines.append(f"    评分文档数 {docs} | 匹配 {ms(search['matching_ms'])} | "
+                     f"评分 {ms(search['scoring_ms'])} | 收集合计 {ms(search['search_ms'])} | 命中 {search['hits']}")
+    stages = ", ".join(f"{name} {ms(value)}" for name, value in explain["stages_ms"].items())
+    lines.append(f"  阶段耗时: {stages}")
+    if explain.get("profile"):
+        lines.append("  cProfile (按累计耗时排序):")
+        lines.extend("    " + line for line in explain["profile"].rstrip().splitlines())
+    return "\n".join(lines)
+
 def main():
     """
     程序主入口点，处理命令行参数并调度索引构建或搜索功能。
     """
-    if len(sys.argv) < 2:
-        print("用法示例: python main.py [index|search] ...")
+    # --verbose 输出查询模式、结果数量等调试信息，默认只输出 INFO 及以上 (如批量查询的吞吐量)；
+    # --no-daemon 不把查询转发给常驻查询服务 (见文件开头)
+    verbose = "--verbose" in sys.argv[1:]
+    argv = [arg for arg in sys.argv[1:] if arg not in ("--verbose", "--no-daemon")]
+    setup_logging("DEBUG" if verbose else "INFO")
+    if not argv:
+        print("用法示例: python main.py [index|search] ... [--verbose]")
         return
 
-    command = sys.argv[1]
+    command = argv[0]
     if command == "index":
         # 构建索引，指定 TDT3 数据集根目录和索引存储目录
         # 这里的路径是相对路径，确保 TDT3 数据集位于程序同级目录下的 tdt3 文件夹
+        # 可通过 --procs=N / --limitmb=M 调整并行解析/写入进程数和每进程内存缓冲，
+        # --incremental 只更新变化的文件，--shards=N --shard-by=hash|source 构建分片索引，
+        # --docstore 把正文存放在外部压缩存储中 (见 docstore.py)，--shingles 建立二元词组字段 (见 shingles.py)
+        index_args = parse_index_args(argv[1:])
         print("开始构建索引...")
-        build_index("./tdt3", "indexdir")
+        run_index_build(**index_args)
         print("索引构建完成。") # 添加完成提示
+    elif command == "search" and any(arg == "--batch" or arg.startswith("--batch=") for arg in argv[1:]):
+        # 批量查询: python main.py search --batch queries.txt --out run.trec [--hits=N] [--workers=N]
+        batch_args = parse_batch_args(argv[1:])
+        if not batch_args["batch"]:
+            print("用法示例: python main.py search --batch queries.txt --out run.trec [--hits=N] [--workers=N]")
+            return
+        run_batch_search(**batch_args)
     elif command == "search":
         # 执行搜索命令
-        try:
-            # 解析查询字符串和结果数量参数
-            query_str, top_n = parse_search_args(sys.argv[2:])
-
-            if not query_str:
-                # 如果解析后查询字符串为空，打印使用方法并返回
-                print("用法示例: python main.py search <查询字符串> [--hits=N]")
-                return # 确保无查询字符串时程序退出
-
-            # 执行实际搜索，调用 search_engine 模块的功能
-            # execute_query 函数内部已包含了查询模式选择和 Whoosh 交互
-            print(f"\n正在搜索: '{query_str}' (期望结果数: {top_n})") # 提示用户正在搜索
-            results = execute_query(query_str, top_n)
-
-            # 输出搜索结果
-            print(f"\n查询: '{query_str}' (共找到 {len(results)} 个结果, 展示前 {top_n} 个)") # 修正提示信息
-            if not results: # 添加判断，如果 results 为空则提示
-                print("未找到匹配的文档。")
+        run_search_command(argv[1:])
+
+def run_search_command(args: List[str], out=None):
+    """
+    执行单个查询的 search 命令并把结果输出到 out (常驻查询服务用它为客户端生成同样的输出)
+
+    参数:
+        args (list): search 之后的命令行参数
+        out: 输出的文件对象，默认为标准输出
+    """
+    out = sys.stdout if out is None else out
+    try:
+        # 解析查询字符串和结果数量参数，--timeout=S 为本次查询的时间预算，
+        # --explain 输出执行过程，--profile[=文件] 另外用 cProfile 剖析 (可保存原始数据)
+        timeout, explain, profile, search_args = None, False, None, []
+        for arg in args:
+            timeout_match = re.match(r'--timeout=(\d+(?:\.\d*)?)$', arg)
+            if timeout_match:
+                timeout = float(timeout_match.group(1))
+            elif arg == "--explain":
+                explain = True
+            elif arg == "--profile" or arg.startswith("--profile="):
+                profile = arg.partition("=")[2] or True
             else:
-                # 循环遍历并打印每个搜索结果的详细信息
-                for res in results:
-                    # 使用中文标签提高可读性
-                    print(f"序号: {res['rank']:02d} | 相似度得分: {res['score']:.4f} | 文档编号: {res['docno']}")
-                    print(f"摘要: {res['snippet']}\n---") # 每条结果之间用 --- 分隔，更清晰
-        except FileNotFoundError as e:
-            print(f"错误: 索引目录不存在 → {str(e)}")
-        except PermissionError as e:
-            print(f"错误: 文件访问权限不足 → {str(e)}")
-        except KeyboardInterrupt:
-            print("\n操作已取消")
-        except Exception as e:
-            print(f"未预期的错误: {type(e).__name__} → {str(e)}")
-            traceback.print_exc()
+                search_args.append(arg)
+        query_str, top_n = parse_search_args(search_args)
+
+        if not query_str:
+            # 如果解析后查询字符串为空，打印使用方法并返回
+            print("用法示例: python main.py search <查询字符串> [--hits=N] [--timeout=秒] [--explain] [--profile[=文件]]", file=out)
+            return # 确保无查询字符串时程序退出
+
+        # 执行实际搜索，调用 search_engine 模块的功能
+        # execute_query 函数内部已包含了查询模式选择和 Whoosh 交互
+        print(f"\n正在搜索: '{query_str}' (期望结果数: {top_n})", file=out) # 提示用户正在搜索
+        results = execute_query(query_str, top_n, timeout=timeout, explain=explain, profile=profile)
+
+        # 输出搜索结果
+        print(f"\n查询: '{query_str}' (共找到 {len(results)} 个结果, 展示前 {top_n} 个, 耗时 {results.elapsed:.3f}s)", file=out)
+        if results.partial:
+            print(f"{Config.COLOR['warning']}[提示] 查询超出时间预算，结果不完整{Config.COLOR['reset']}", file=out)
+        if not results: # 添加判断，如果 results 为空则提示
+            print("未找到匹配的文档。", file=out)
+        else:
+            # 循环遍历并打印每个搜索结果的详细信息
+            for res in results:
+                # 使用中文标签提高可读性
+                print(f"序号: {res['rank']:02d} | 相似度得分: {res['score']:.4f} | 文档编号: {res['docno']}", file=out)
+                snippet = res['snippet'] if res['snippet'] is not None else "(超出时间预算，未生成摘要)"
+                print(f"摘要: {snippet}\n---", file=out) # 每条结果之间用 --- 分隔，更清晰
+        if results.explain is not None:
+            print(format_explain(results.explain), file=out)
+            if isinstance(profile, str):
+                print(f"cProfile 原始数据已保存到 {profile} (可用 python -m pstats 查看)", file=out)
+    except FileNotFoundError as e:
+        print(f"错误: 索引目录不存在 → {str(e)}", file=out)
+    except PermissionError as e:
+        print(f"错误: 文件访问权限不足 → {str(e)}", file=out)
+    except KeyboardInterrupt:
+        print("\n操作已取消", file=out)
+    except Exception as e:
+        print(f"未预期的错误: {type(e).__name__} → {str(e)}", file=out)
+        traceback.print_exc(file=out)
+
+def parse_index_args(args: List[str]) -> Dict:
+    """
+    解析索引构建参数
+
+    参数:
+        args (list): 命令行参数列表
+
+    返回:
+        dict: data_dir, index_dir, procs, limitmb, incremental, shards, shard_by, docstore, shingles
+
+    支持语法:
+        --data-dir=./tdt3 --index-dir=indexdir --procs=4 --limitmb=256
+        --incremental 只处理新增、修改或删除的文件
+        --docstore 正文写入外部压缩存储，不作为存储字段写入索引
+        --shingles 建立二元词组字段，加速短语查询和连字符查询
+        --shards=4 --shard-by=hash|source 构建分片索引，procs 为并行构建的分片数
+    """
+    options = {
+        "data_dir": "./tdt3",
+        "index_dir": "indexdir",
+        "procs": Config.DEFAULT_PROCS,
+        "limitmb": Config.DEFAULT_LIMITMB,
+        "incremental": False,
+        "docstore": False,
+        "shingles": False,
+        "shards": 1,
+        "shard_by": "hash",
+    }
+    for arg in args:
+        if arg in ("--incremental", "--docstore", "--shingles"):
+            options[arg[2:]] = True
+            continue
+        match = re.match(r'--(data-dir|index-dir|procs|limitmb|shards|shard-by)=(.+)', arg)
+        if not match:
+            continue
+        key = match.group(1).replace('-', '_')
+        value = match.group(2)
+        if key in ("procs", "limitmb", "shards"):
+            try:
+                options[key] = max(1, int(value))
+            except ValueError:
+                print(f"[警告] --{match.group(1)} 需要整数，忽略 {value}，使用 {options[key]}")
+        elif key == "shard_by" and value not in SHARD_STRATEGIES:
+            print(f"[警告] 未知的分片方式 {value}，使用 hash")
+        else:
+            options[key] = value
+    return options
+
+def run_index_build(data_dir, index_dir, procs=1, limitmb=DEFAULT_LIMITMB, incremental=False,
+                    shards=1, shard_by="hash", docstore=False, shingles=False):
+    """shards > 1 时构建分片索引，否则构建单一索引"""
+    if shards > 1:
+        return build_shards(data_dir, index_dir, num_shards=shards, shard_by=shard_by,
+                            procs=procs, limitmb=limitmb, incremental=incremental, docstore=docstore,
+                            shingles=shingles)
+    return build_index(data_dir, index_dir, procs=procs, limitmb=limitmb, incremental=incremental,
+                       docstore=docstore, shingles=shingles)
 
 def parse_search_args(args: List[str]) -> Tuple[str, int]:
     """
@@ -138,150 +417,492 @@ def parse_search_args(args: List[str]) -> Tuple[str, int]:
     
     return processed_query.strip(), top_n
 
-def execute_query(query_str: str, top_n: int = 10) -> list:
+def parse_batch_args(args: List[str]) -> Dict:
+    """
+    解析批量查询参数
+
+    参数:
+        args (list): 命令行参数列表
+
+    返回:
+        dict: batch, out, top_n, workers, tag
+
+    支持语法:
+        --batch queries.txt 或 --batch=queries.txt  查询文件
+        --out run.trec 或 --out=run.trec  TREC 格式的结果文件，缺省时输出到标准输出
+        --hits=N  每个查询的结果数; --workers=N  查询进程数; --tag=NAME  结果文件中的运行标记
     """
-    根据查询字符串特点选择合适的查询策略
+    options = {"batch": None, "out": None, "top_n": Config.DEFAULT_HITS, "workers": 1, "tag": "tdt3"}
+    names = {"batch": "batch", "out": "out", "hits": "top_n", "workers": "workers", "tag": "tag"}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        match = re.match(r'--(batch|out|hits|workers|tag)(?:=(.+))?$', arg)
+        if not match:
+            continue
+        value = match.group(2)
+        if value is None:
+            if not args:
+                continue
+            value = args.pop(0)
+        key = names[match.group(1)]
+        options[key] = max(1, int(value)) if key in ("top_n", "workers") else value
+    return options
+
+def read_query_file(path):
+    """
+    读取批量查询文件，返回 [(查询编号, 查询字符串)]
+
+    每行一个查询，"编号<TAB>查询" 或 "数字编号 查询"；没有编号的行以行号作为编号，
+    空行和 # 开头的行被忽略
+    """
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if '\t' in line:
+                qid, query_str = line.split('\t', 1)
+            else:
+                parts = line.split(None, 1)
+                if len(parts) == 2 and parts[0].isdigit():
+                    qid, query_str = parts
+                else:
+                    qid, query_str = str(lineno), line
+            queries.append((qid.strip(), query_str.strip()))
+    return queries
+
+def run_batch_search(batch, out=None, top_n=10, workers=1, tag="tdt3"):
+    """执行查询文件中的全部查询，结果按 TREC 运行文件格式 (qid Q0 docno rank score tag) 写出"""
+    queries = read_query_file(batch)
+    qids = [qid for qid, _ in queries]
+    stream = open(out, 'w', encoding='utf-8') if out else sys.stdout
+    try:
+        batch_results = execute_queries([query_str for _, query_str in queries], top_n, workers=workers)
+        for (_, results), qid in zip(batch_results, qids):
+            for res in results:
+                stream.write(f"{qid} Q0 {res['docno']} {res['rank']} {res['score']:.4f} {tag}\n")
+    finally:
+        if out:
+            stream.close()
+    if out:
+        print(f"已写出 {len(queries)} 个查询的结果 → {out}")
+
+def execute_query(query_str: str, top_n: int = 10, use_cache: bool = True, markup: str = "ansi",
+                  timeout: float = None, explain: bool = False, profile=None) -> QueryResults:
+    """
+    根据查询字符串特点选择合适的查询策略，结果按 (规范化查询, top_n, 高亮形式, 索引代号) 缓存
     
     Args:
         query_str: 用户输入的查询字符串
         top_n: 需要返回的结果数量
+        use_cache: 是否使用结果缓存
+        markup: 摘要高亮形式，"ansi" (终端) 或 "html" (Web)；None 时不生成摘要，只返回 rank/score/docno
+        timeout: 时间预算 (秒)，None 时使用 Config.QUERY_TIMEOUT，0 表示不限时。
+                 超出预算时命中收集和摘要生成提前停止，返回已就绪的结果，未生成的摘要为 None
+        explain: 是否记录执行过程 (结果的 explain 属性)；EXPLAIN 时不读写结果缓存，走真实的查询路径
+        profile: 同时用 cProfile 剖析这次查询 (隐含 explain)；为文件路径时另外把原始数据写入该文件
         
     Returns:
-        list: 格式化后的搜索结果列表
+        QueryResults: 格式化后的搜索结果列表，带 partial、elapsed 和 explain
     """
+    budget = QueryBudget(Config.QUERY_TIMEOUT if timeout is None else timeout)
     if not query_str or not query_str.strip():
-        print("[错误] 查询字符串不能为空")
-        return []
+        logger.error("[错误] 查询字符串不能为空")
+        return QueryResults()
+    
+    if profile:
+        return _profile_query(query_str, top_n, markup, timeout, profile)
+    if explain:
+        return _explain_query(query_str, top_n, markup, timeout)
     
+    _budget.current = budget
     try:
-        # 检测查询类型特征
-        has_phrase = '"' in query_str
-        words = query_str.replace('"', ' ').split()
-        hyphen_words = [w for w in words if '-' in w]
-        normal_words = [w for w in words if '-' not in w]
+        generation = index_generation() if use_cache else None
+        cache_key = (normalize_query(query_str), top_n, markup)
+        if generation is not None:
+            cached = result_cache.get(cache_key, generation)
+            if cached is not None:
+                log("[缓存命中] %s (索引代号 %s)", query_str, generation)
+                elapsed = budget.elapsed
+                QUERY_SECONDS.observe("cache", elapsed)
+                QUERIES.inc("cache_hit")
+                return QueryResults(cached, elapsed=elapsed)
         
-        # 根据特征选择查询策略
-        if has_phrase:
-            # 如果有短语，一律视为混合查询
-            return mixed_query(query_str, top_n)
-        elif hyphen_words:
-            # 仅当只有一个连字符词且没有其他词时才使用连字符查询
-            if len(hyphen_words) == 1 and len(normal_words) == 0:
-                return hyphen_query(query_str, top_n, use_or=False)
-            else:
-                # 有连字符词但还有其他词，视为混合查询
-                return mixed_query(query_str, top_n)
-        else:
-            # 纯自由文本查询
-            return free_query(query_str, top_n)
+        with stage("classify"):
+            query_type = query_type_of(query_str)
+        results = route_query(query_str, top_n, markup, query_type=query_type)
+        if budget.exhausted:
+            log("[提示] 查询超出 %gs 的时间预算，返回已就绪的结果", budget.deadline - budget.start)
+        
+        # 空结果可能来自查询过程中的错误，不完整的结果也不缓存
+        elif generation is not None and results:
+            result_cache.put(cache_key, generation, results)
+        elapsed = budget.elapsed
+        QUERY_SECONDS.observe(query_type, elapsed)
+        QUERIES.inc("partial" if budget.exhausted else "ok")
+        return QueryResults(results, partial=budget.exhausted, elapsed=elapsed)
     except Exception as e:
-        print(f"[错误] 执行查询失败: {type(e).__name__} - {str(e)}")
-        return []
+        logger.error("[错误] 执行查询失败: %s - %s", type(e).__name__, e)
+        QUERIES.inc("error")
+        return QueryResults(partial=budget.exhausted, elapsed=budget.elapsed)
+    finally:
+        _budget.current = None
+
+def _explain_query(query_str, top_n, markup, timeout):
+    """EXPLAIN 模式下执行查询 (不经过结果缓存)，把执行记录附在结果上"""
+    explain = QueryExplain(query_str, query_type_of(query_str))
+    _budget.explain = explain
+    try:
+        with trace_stages() as stages:
+            results = execute_query(query_str, top_n, use_cache=False, markup=markup, timeout=timeout)
+    finally:
+        _budget.explain = None
+    explain.stages = stages
+    results.explain = explain.to_dict(results.elapsed)
+    return results
+
+def _profile_query(query_str, top_n, markup, timeout, profile):
+    """用 cProfile 剖析单个查询，前 30 个函数 (按累计耗时) 的统计附在 EXPLAIN 记录中"""
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        results = _explain_query(query_str, top_n, markup, timeout)
+    finally:
+        profiler.disable()
+    if isinstance(profile, str):
+        profiler.dump_stats(profile)
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(30)
+    results.explain["profile"] = stream.getvalue()
+    return results
+
+def index_generation():
+    """当前索引代号 (分片索引为各分片代号的元组)，索引不存在时返回 None"""
+    try:
+        if is_sharded(Config.INDEX_DIR):
+            return shard_set().generation
+        return get_index_manager(Config.INDEX_DIR).generation
+    except (FileNotFoundError, EmptyIndexError):
+        return None
+
+def shard_set():
+    """当前分片索引的 ShardSet (进程级单例)"""
+    workers = Config.SHARD_WORKERS or (os.cpu_count() or 1)
+    return get_shard_set(Config.INDEX_DIR, workers=workers)
+
+@contextmanager
+def open_searcher():
+    """
+    借出当前索引的搜索器：分片索引返回 ShardedSearcher (查询扇出到各分片后合并)，
+    否则从索引管理器借出 Whoosh 搜索器。批量查询期间直接使用批量共享的搜索器
+    """
+    shared = getattr(_batch, "searcher", None)
+    if shared is not None:
+        yield shared
+    elif is_sharded(Config.INDEX_DIR):
+        with shard_set().searcher() as searcher:
+            yield searcher
+    else:
+        with get_index_manager(Config.INDEX_DIR).searcher() as searcher:
+            yield searcher
+
+def open_docstore():
+    """当前索引的外部正文存储 (见 docstore.py)；正文作为存储字段写入索引时为 None"""
+    if is_sharded(Config.INDEX_DIR):
+        return shard_set().docstore()
+    return get_docstore(Config.INDEX_DIR)
+
+@contextmanager
+def content_source():
+    """
+    按 docno 读取正文的函数 (文档不存在时返回 None)：索引带有外部正文存储时直接从中读取，
+    否则借出搜索器按 docno 查找存储字段
+    """
+    docstore = open_docstore()
+    if docstore is not None:
+        yield docstore.get
+        return
+    with open_searcher() as searcher:
+        def fetch(docno):
+            fields = searcher.document(docno=docno)
+            return None if fields is None else fields.get("content") or ""
+        yield fetch
+
+def suggest_query(query_str: str, limit: int = None) -> list:
+    """
+    补全查询中最后一个正在输入的词，按文档频率从高到低返回 [{"term", "df", "query"}] (见 suggest.py)。
+    索引没有补全词表 (在此功能之前构建) 时返回空列表
+    """
+    limit = Config.SUGGEST_LIMIT if limit is None else limit
+    with stage("suggest"):
+        return suggest(get_suggester(Config.INDEX_DIR), query_str, limit)
+
+def content_parser(schema, phrase=False):
+    """
+    content 字段的查询解析器，phrase=True 时加入短语插件。
+    短语 (包括连字符查询和混合查询中由连字符词转成的短语) 解析为 ShinglePhrase，
+    索引带有二元词组字段时用它筛选文档 (见 shingles.py)。
+    批量查询期间每种解析器只创建一次，供同一批的全部查询复用
+    """
+    parsers = getattr(_batch, "parsers", None)
+    if parsers is not None and phrase in parsers:
+        return parsers[phrase]
+    parser = QueryParser("content", schema=schema, phraseclass=ShinglePhrase)
+    if phrase:
+        parser.add_plugin(PhrasePlugin())
+    if parsers is not None:
+        parsers[phrase] = parser
+    return parser
+
+def setup_logging(level=None):
+    """
+    为 tdt3 日志器 (包括 search_engine 等子模块) 配置输出到标准错误的处理器，
+    level 缺省为 Config.LOG_LEVEL；重复调用只调整级别
+    """
+    level = level or Config.LOG_LEVEL
+    Config.LOG_LEVEL = level
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+def log(message, *args):
+    """
+    查询过程的调试信息 (DEBUG 级别)，批量查询期间不输出。
+    参数按 logging 的 % 格式延迟格式化，日志关闭时不产生格式化开销
+    """
+    if logger.isEnabledFor(logging.DEBUG) and getattr(_batch, "searcher", None) is None:
+        logger.debug(message, *args)
+
+def execute_queries(queries, top_n: int = 10, workers: int = 1, markup: str = "ansi"):
+    """
+    批量执行查询，按输入顺序逐个产出 (查询字符串, 结果列表)
+
+    同一批查询共享一个搜索器和查询解析器，不输出逐条查询的提示信息，
+    也不读写结果缓存 (批量查询多为一次性的主题查询，避免挤掉交互查询的缓存)。
+    批量查询不设时间预算，保证评测用的运行结果完整。
+    workers > 1 时把查询分发到进程池，每个进程各自打开索引并共享一个搜索器。
+    全部产出后以 INFO 级别记录整批的吞吐量。
+
+    Args:
+        queries: 查询字符串序列
+        top_n: 每个查询返回的结果数量
+        workers: 查询进程数
+        markup: 摘要高亮形式，"ansi" 或 "html"
+
+    Yields:
+        tuple: (查询字符串, 格式化后的搜索结果列表)
+    """
+    queries = list(queries)
+    start = time.time()
+    if workers > 1 and len(queries) > 1:
+        chunksize = max(1, len(queries) // (workers * 4))
+        with multiprocessing.Pool(workers, initializer=_init_batch_worker,
+                                  initargs=(Config.INDEX_DIR,)) as pool:
+            task = functools.partial(_batch_query, top_n=top_n, markup=markup)
+            for item in pool.imap(task, queries, chunksize):
+                yield item
+    else:
+        with open_searcher() as searcher:
+            parsers = {}
+            for query_str in queries:
+                _batch.searcher, _batch.parsers = searcher, parsers
+                try:
+                    results = execute_query(query_str, top_n, use_cache=False, markup=markup, timeout=0)
+                finally:
+                    _batch.searcher = _batch.parsers = None
+                yield query_str, results
+    elapsed = max(time.time() - start, 1e-9)
+    logger.info("[批量查询] %d 个查询, 耗时 %.2fs, %.1f 查询/秒 (workers=%d)",
+                len(queries), elapsed, len(queries) / elapsed, max(1, workers))
+
+def _init_batch_worker(index_dir):
+    """批量查询进程的初始化：重新打开索引并借出一个在进程生命周期内共享的搜索器"""
+    forget_managers()
+    forget_shard_sets()
+    Config.INDEX_DIR = index_dir
+    Config.SHARD_WORKERS = 1    # 进程池中的进程不能再创建分片查询进程
+    global _worker_searcher
+    _worker_searcher = open_searcher()
+    _batch.searcher = _worker_searcher.__enter__()
+    _batch.parsers = {}
+
+def _batch_query(query_str, top_n, markup):
+    return query_str, execute_query(query_str, top_n, use_cache=False, markup=markup, timeout=0)
+
+def route_query(query_str: str, top_n: int = 10, markup: str = "ansi", query_type: str = None) -> list:
+    """
+    检测查询类型特征并分派到对应的查询函数
+    
+    Args:
+        query_str: 用户输入的查询字符串
+        top_n: 需要返回的结果数量
+        markup: 摘要高亮形式，"ansi" 或 "html"
+        query_type: 已由调用方判定的查询类型 (query_type_of 的结果)，None 时在这里判定
+        
+    Returns:
+        list: 格式化后的搜索结果列表
+    """
+    if query_type is None:
+        query_type = query_type_of(query_str)
+    if query_type == "mixed":
+        return mixed_query(query_str, top_n, markup)
+    elif query_type == "hyphen":
+        return hyphen_query(query_str, top_n, use_or=False, markup=markup)
+    else:
+        return free_query(query_str, top_n, markup)
 
-def free_query(query_str: str, top_n: int = 10) -> list:
+def query_type_of(query_str: str) -> str:
+    """route_query 为查询选择的策略：mixed、hyphen 或 free"""
+    has_phrase = '"' in query_str
+    words = query_str.replace('"', ' ').split()
+    hyphen_words = [w for w in words if '-' in w]
+    normal_words = [w for w in words if '-' not in w]
+    
+    # 根据特征选择查询策略
+    if has_phrase:
+        # 如果有短语，一律视为混合查询
+        return "mixed"
+    elif hyphen_words:
+        # 仅当只有一个连字符词且没有其他词时才使用连字符查询
+        if len(hyphen_words) == 1 and len(normal_words) == 0:
+            return "hyphen"
+        else:
+            # 有连字符词但还有其他词，视为混合查询
+            return "mixed"
+    else:
+        # 纯自由文本查询
+        return "free"
+
+def free_query(query_str: str, top_n: int = 10, markup: str = "ansi") -> list:
     """
     执行自由文本查询
     
     Args:
         query_str: 查询字符串
         top_n: 返回结果数量
+        markup: 摘要高亮形式，"ansi" 或 "html"
         
     Returns:
         list: 格式化后的搜索结果列表
     """
     try:
-        ix = open_dir("indexdir")
-        with ix.searcher(weighting=CustomScorer()) as searcher:
-            parser = QueryParser("content", schema=ix.schema)
-            query = parser.parse(query_str)
+        with open_searcher() as searcher:
+            with stage("parse"):
+                query = content_parser(searcher.schema).parse(query_str)
+            
+            log("[查询模式] 自由查询: %s", query)
             
-            print(f"[查询模式] 自由查询: {query}")
+            if Config.VECTOR_ENGINE and not isinstance(searcher, ShardedSearcher):
+                from vector_engine import vector_search     # 依赖 NumPy，只在开启时导入
+                start = time.perf_counter()
+                with stage("search"):
+                    top = vector_search(Config.INDEX_DIR, searcher, query, limit=top_n)
+                explain = current_explain()
+                if explain is not None and top is not None:
+                    explain.add_search(searcher, query, "vector", hits=len(top),
+                                       total=time.perf_counter() - start)
+                # 短语等不受支持的查询形式返回 None，继续走 Whoosh
+                if top is not None:
+                    log("[结果数量] 向量化评分返回 %d 个结果", len(top))
+                    hits = [ScoredHit(searcher, docnum, score, None) for docnum, score in top]
+                    return format_results(hits, query_str, query_type="free", markup=markup)
             
-            results = searcher.search(query, limit=top_n)
-            print(f"[结果数量] 找到 {len(results)} 个结果")
+            results = search_within_budget(searcher, query, top_n)
+            log("[结果数量] 找到 %s 个结果", result_count(results))
             
-            return format_results(results, query_str, query_type="free")
+            return format_results(results, query_str, query_type="free", markup=markup)
     except FileNotFoundError:
-        print("[错误] 索引目录不存在，请先构建索引")
+        logger.error("[错误] 索引目录不存在，请先构建索引")
         return []
     except Exception as e:
-        print(f"[错误] 自由查询失败: {type(e).__name__} - {str(e)}")
+        logger.error("[错误] 自由查询失败: %s - %s", type(e).__name__, e)
         return []
 
-def phrase_query(query_str: str, top_n: int = 10) -> list:
+def phrase_query(query_str: str, top_n: int = 10, markup: str = "ansi") -> list:
     """
     执行短语查询
     
     Args:
         query_str: 查询字符串
         top_n: 返回结果数量
+        markup: 摘要高亮形式，"ansi" 或 "html"
         
     Returns:
         list: 格式化后的搜索结果列表
     """
     try:
-        ix = open_dir("indexdir")
-        with ix.searcher(weighting=CustomScorer()) as searcher:
-            parser = QueryParser("content", schema=ix.schema)
-            parser.add_plugin(PhrasePlugin())
-            query = parser.parse(query_str)
+        with open_searcher() as searcher:
+            with stage("parse"):
+                query = content_parser(searcher.schema, phrase=True).parse(query_str)
             
-            print(f"[查询模式] 短语查询: {query}")
+            log("[查询模式] 短语查询: %s", query)
             
-            results = searcher.search(query, limit=top_n)
-            print(f"[结果数量] 找到 {len(results)} 个结果")
+            results = search_within_budget(searcher, query, top_n)
+            log("[结果数量] 找到 %s 个结果", result_count(results))
             
-            return format_results(results, query_str, query_type="phrase")
+            return format_results(results, query_str, query_type="phrase", markup=markup)
     except FileNotFoundError:
-        print("[错误] 索引目录不存在，请先构建索引")
+        logger.error("[错误] 索引目录不存在，请先构建索引")
         return []
     except Exception as e:
-        print(f"[错误] 短语查询失败: {type(e).__name__} - {str(e)}")
+        logger.error("[错误] 短语查询失败: %s - %s", type(e).__name__, e)
         return []
 
-def mixed_query(query_str: str, top_n: int = 10) -> list:
+def mixed_query(query_str: str, top_n: int = 10, markup: str = "ansi") -> list:
     """
-    执行混合查询（短语+自由文本+连字符），同时使用AND和OR策略
+    执行混合查询（短语+自由文本+连字符），完全匹配的结果优先，部分匹配的结果补足
     
     Args:
         query_str: 查询字符串
         top_n: 返回结果数量
+        markup: 摘要高亮形式，"ansi" 或 "html"
         
     Returns:
         list: 格式化后的搜索结果列表
     """
     try:
-        ix = open_dir("indexdir")
-        with ix.searcher(weighting=CustomScorer()) as searcher:
+        with open_searcher() as searcher:
             # 解析查询组件
             query_parts = build_mixed_query_parts(query_str)
             if not query_parts:
-                print("[提示] 提取的查询组件为空，无法执行查询")
+                log("[提示] 提取的查询组件为空，无法执行查询")
                 return []
                 
-            # 执行AND查询（严格匹配）
-            and_results = execute_boolean_query(
-                searcher, query_parts, "AND", top_n, 
-                "[查询模式] 混合查询(AND)", "[结果数量] 严格匹配找到"
-            )
-            
-            # 执行OR查询（宽松匹配）
-            or_results = execute_boolean_query(
-                searcher, query_parts, "OR", top_n,
-                "[查询模式] 混合查询(OR)", "[结果数量] 宽松匹配找到"
-            )
-            
-            # 合并结果，优先使用AND结果
-            final_results = merge_search_results(and_results, or_results, top_n)
+            # 单遍执行需要直接遍历段匹配器，分片索引走两次查询再合并
+            if Config.MIXED_SINGLE_PASS and not isinstance(searcher, ShardedSearcher):
+                # 单遍遍历OR匹配器，完全匹配的文档排在部分匹配之前
+                final_results = execute_mixed_query(searcher, query_parts, top_n)
+            else:
+                # 执行AND查询（严格匹配）
+                and_results = execute_boolean_query(
+                    searcher, query_parts, "AND", top_n, 
+                    "[查询模式] 混合查询(AND)", "[结果数量] 严格匹配找到"
+                )
+                
+                # 执行OR查询（宽松匹配）
+                or_results = execute_boolean_query(
+                    searcher, query_parts, "OR", top_n,
+                    "[查询模式] 混合查询(OR)", "[结果数量] 宽松匹配找到"
+                )
+                
+                # 合并结果，优先使用AND结果
+                final_results = merge_search_results(and_results, or_results, top_n)
             
             # 返回格式化后的结果
-            return format_results(final_results, query_str, query_type="mixed")
+            return format_results(final_results, query_str, query_type="mixed", markup=markup)
     except FileNotFoundError:
-        print("[错误] 索引目录不存在，请先构建索引")
+        logger.error("[错误] 索引目录不存在，请先构建索引")
         return []
     except Exception as e:
-        print(f"[错误] 混合查询失败: {type(e).__name__} - {str(e)}")
-        traceback.print_exc()  # 对于复杂的混合查询，打印详细错误信息
+        logger.error("[错误] 混合查询失败: %s - %s", type(e).__name__, e)
+        logger.debug("混合查询异常详情", exc_info=True)  # 对于复杂的混合查询，调试级别下输出详细错误信息
         return []
 
 def build_mixed_query_parts(query_str: str) -> list:
@@ -335,22 +956,229 @@ def execute_boolean_query(searcher, query_parts, connector, limit, mode_msg, res
     Returns:
         搜索结果
     """
-    parser = QueryParser("content", schema=searcher.ixreader.schema)
-    parser.add_plugin(PhrasePlugin())
+    with stage("parse"):
+        parser = content_parser(searcher.schema, phrase=True)
+        query = parser.parse(f" {connector} ".join(query_parts))
     
-    query_str = f" {connector} ".join(query_parts)
-    query = parser.parse(query_str)
+    log("%s: %s", mode_msg, query)
     
-    print(f"{mode_msg}: {query}")
+    results = search_within_budget(searcher, query, limit)
+    log("%s %s 个结果", result_msg, result_count(results))
     
-    results = searcher.search(query, limit=limit)
-    print(f"{result_msg} {len(results)} 个结果")
+    return results
+
+def search_within_budget(searcher, query, limit):
+    """
+    searcher.search 加上本线程查询的时间预算：用 TimeLimitCollector 包装 top-k 收集器，
+    超时时返回已收集到的前 limit 个命中并把预算记为已截断。
+    TimeLimitCollector 不使用 SIGALRM (只能在主线程注册)，在每收集一个命中后检查是否超时。
+    EXPLAIN 时另外用 ExplainCollector 统计评分的文档数和匹配/评分耗时
+    """
+    with stage("search"):
+        return _search_within_budget(searcher, query, limit)
+
+def _search_within_budget(searcher, query, limit):
+    budget = current_budget()
+    remaining = budget.remaining() if budget is not None else None
+    explain = current_explain()
+    if remaining is None and explain is None:
+        return searcher.search(query, limit=limit, optimize=Config.PRUNING)
+    start = time.perf_counter()
+    if isinstance(searcher, ShardedSearcher):
+        results = searcher.search(query, limit=limit, optimize=Config.PRUNING, timelimit=remaining)
+        if results.timed_out:
+            budget.exhausted = True
+        if explain is not None:
+            explain.add_search(searcher, query, "sharded", hits=results.scored_length(),
+                               total=time.perf_counter() - start)
+        return results
     
+    collector = explain_collector = searcher.collector(limit=limit, optimize=Config.PRUNING)
+    if explain is not None:
+        collector = explain_collector = ExplainCollector(collector)
+    if remaining is not None:
+        collector = TimeLimitCollector(collector, timelimit=remaining, use_alarm=False)
+    try:
+        searcher.search_with_collector(query, collector)
+    except TimeLimit:
+        collector.finish()
+        budget.exhausted = True
+    results = collector.results()
+    if explain is not None:
+        explain.add_search(searcher, query, "whoosh", docs_scored=explain_collector.docs,
+                           matching=explain_collector.matching, scoring=explain_collector.scoring,
+                           hits=results.scored_length(), total=time.perf_counter() - start)
     return results
 
+class ExplainCollector(WrappingCollector):
+    """
+    EXPLAIN 用的收集器包装：统计评分的文档数，并把收集时间分为匹配 (推进匹配器、
+    跳过低分块，直到产出下一个候选文档) 和评分 (计算得分并放入 top-k) 两部分
+    """
+
+    def __init__(self, child):
+        super().__init__(child)
+        self.docs = 0
+        self.matching = 0.0
+        self.scoring = 0.0
+
+    def matches(self):
+        clock = time.perf_counter
+        last = clock()
+        for sub_docnum in self.child.matches():
+            self.matching += clock() - last
+            yield sub_docnum
+            last = clock()
+        self.matching += clock() - last
+
+    def collect(self, sub_docnum):
+        start = time.perf_counter()
+        try:
+            return self.child.collect(sub_docnum)
+        finally:
+            self.scoring += time.perf_counter() - start
+            self.docs += 1
+
+class ScoredHit:
+    """
+    单遍混合查询和向量化评分产生的命中，提供与 whoosh Hit 相同的常用接口 (score / [] / get)
+
+    存储字段在首次访问时才加载；只需要 docno 时用 hit_docno，不加载存储字段。
+    """
+    __slots__ = ("searcher", "docnum", "score", "matched", "_fields")
+
+    def __init__(self, searcher, docnum, score, matched):
+        self.searcher = searcher
+        self.docnum = docnum
+        self.score = score
+        self.matched = matched
+        self._fields = None
+
+    def fields(self):
+        if self._fields is None:
+            self._fields = self.searcher.stored_fields(self.docnum)
+        return self._fields
+
+    def __getitem__(self, name):
+        return self.fields()[name]
+
+    def get(self, name, default=None):
+        return self.fields().get(name, default)
+
+def hit_docno(hit):
+    """
+    命中的 docno：分片命中随结果带回，其余按文档号读 docno 列 (见 index_builder.docno_lookup)，
+    不加载包括正文在内的整个存储字段
+    """
+    docno = getattr(hit, "docno", None)
+    if docno is None:
+        docno = docno_lookup(hit.searcher.reader())(hit.docnum)
+    return docno
+
+def hit_key(hit):
+    """命中在本次查询中的唯一标识 (分片号, 文档号)，用于去重"""
+    return getattr(hit, "shard", 0), hit.docnum
+
+def parse_query_clauses(searcher, query_parts):
+    """
+    逐个解析查询组件，去掉被分析器清空的组件 (如停用词) 和重复组件，
+    与整体解析 "A AND B" 时 Whoosh 的规范化结果一致
+    """
+    with stage("parse"):
+        parser = content_parser(searcher.schema, phrase=True)
+        clauses = []
+        for part in query_parts:
+            clause = parser.parse(part).normalize()
+            if clause is NullQuery or clause in clauses:
+                continue
+            clauses.append(clause)
+    return clauses
+
+def execute_mixed_query(searcher, query_parts, limit):
+    """
+    单遍执行混合查询：同时推进各组件的匹配器 (即 OR 匹配器的遍历)，
+    记录每个文档命中的组件数。命中全部组件的文档排在前面，
+    其余按得分排序，与 "先取 AND 结果、再用 OR 结果补足" 的合并顺序一致。
+    
+    Args:
+        searcher: Whoosh搜索器对象
+        query_parts: 查询组件列表
+        limit: 结果数限制
+        
+    Returns:
+        list: ScoredHit 列表
+    """
+    clauses = parse_query_clauses(searcher, query_parts)
+    log("[查询模式] 混合查询(单遍AND/OR): %s", Or(clauses))
+    if not clauses:
+        return []
+    
+    total = len(clauses)
+    start = time.perf_counter()
+    context = searcher.context()
+    budget = current_budget()
+    # EXPLAIN 时单独计时子句的评分，其余为推进匹配器的时间
+    explain = current_explain()
+    score_time = 0.0
+    top = []    # 小顶堆: (是否完全匹配, 得分, -文档号, 命中组件数)
+    full_count = partial_count = 0
+    for subsearcher, offset in searcher.leaf_searchers():
+        matchers = [clause.matcher(subsearcher, context) for clause in clauses]
+        matchers = [m for m in matchers if m.is_active()]
+        while matchers:
+            # 每遍历 256 个文档检查一次时间预算，超时时以已收集的结果为准
+            if budget is not None and (full_count + partial_count) % 256 == 255 and budget.expired():
+                break
+            docid = min(m.id() for m in matchers)
+            score = 0.0
+            matched = 0
+            for m in matchers:
+                if m.id() == docid:
+                    if explain is None:
+                        score += m.score()
+                    else:
+                        t = time.perf_counter()
+                        score += m.score()
+                        score_time += time.perf_counter() - t
+                    matched += 1
+                    m.next()
+            matchers = [m for m in matchers if m.is_active()]
+            
+            is_full = matched == total
+            if is_full:
+                full_count += 1
+            else:
+                partial_count += 1
+            item = (is_full, score, -(offset + docid), matched)
+            if len(top) < limit:
+                heapq.heappush(top, item)
+            elif item > top[0]:
+                heapq.heapreplace(top, item)
+        if budget is not None and budget.exhausted:
+            break
+    elapsed = time.perf_counter() - start
+    observe_stage("search", elapsed)
+    if explain is not None:
+        explain.add_search(searcher, Or(clauses), "single_pass", docs_scored=full_count + partial_count,
+                           matching=elapsed - score_time, scoring=score_time,
+                           hits=min(limit, len(top)), total=elapsed)
+    
+    log("[结果数量] 严格匹配找到 %d 个结果，宽松匹配另找到 %d 个结果", full_count, partial_count)
+    top.sort(reverse=True)
+    return [ScoredHit(searcher, -negdoc, score, matched) for _, score, negdoc, matched in top]
+
+def result_count(results):
+    """
+    命中数的显示文本。开启剪枝时收集器会跳过低分块而不统计总数，
+    调用 len() 会再完整匹配一遍，因此只报告估计值。
+    """
+    if results.has_exact_length():
+        return str(len(results))
+    return f"约 {results.estimated_length()}"
+
 def merge_search_results(and_results, or_results, top_n):
     """
-    合并两种搜索结果，去除重复
+    合并两种搜索结果，按文档号去除重复 (不读取存储字段)
     
     Args:
         and_results: 严格匹配结果
@@ -361,24 +1189,24 @@ def merge_search_results(and_results, or_results, top_n):
         list: 合并后的结果列表
     """
     final_results = []
-    seen_docnos = set()
+    seen = set()
     
     # 先添加严格匹配结果
     for hit in and_results:
         final_results.append(hit)
-        seen_docnos.add(hit["docno"])
+        seen.add(hit_key(hit))
     
     # 补充宽松匹配结果（去重）
     remaining_slots = top_n - len(final_results)
     if remaining_slots > 0:
         for hit in or_results:
-            if hit["docno"] not in seen_docnos and len(final_results) < top_n:
+            if hit_key(hit) not in seen and len(final_results) < top_n:
                 final_results.append(hit)
-                seen_docnos.add(hit["docno"])
+                seen.add(hit_key(hit))
     
     return final_results
 
-def hyphen_query(query_str: str, top_n: int = 10, use_or: bool = False) -> list:
+def hyphen_query(query_str: str, top_n: int = 10, use_or: bool = False, markup: str = "ansi") -> list:
     """
     执行连字符查询
     
@@ -386,13 +1214,13 @@ def hyphen_query(query_str: str, top_n: int = 10, use_or: bool = False) -> list:
         query_str: 查询字符串
         top_n: 返回结果数量
         use_or: 是否使用OR连接符（默认False，使用AND）
+        markup: 摘要高亮形式，"ansi" 或 "html"
         
     Returns:
         list: 格式化后的搜索结果列表
     """
     try:
-        ix = open_dir("indexdir")
-        with ix.searcher(weighting=CustomScorer()) as searcher:
+        with open_searcher() as searcher:
             # 分解查询
             words = query_str.split()
             query_parts = []
@@ -413,282 +1241,144 @@ def hyphen_query(query_str: str, top_n: int = 10, use_or: bool = False) -> list:
             connector = " OR " if use_or else " AND "
             final_query_str = connector.join(query_parts)
             
-            parser = QueryParser("content", schema=ix.schema)
-            parser.add_plugin(PhrasePlugin())
-            query = parser.parse(final_query_str)
+            with stage("parse"):
+                query = content_parser(searcher.schema, phrase=True).parse(final_query_str)
             
-            print(f"[查询模式] 连字符查询 ({connector.strip()}): {query}")
+            log("[查询模式] 连字符查询 (%s): %s", connector.strip(), query)
             
-            results = searcher.search(query, limit=top_n)
-            print(f"[结果数量] 找到 {len(results)} 个结果")
+            results = search_within_budget(searcher, query, top_n)
+            log("[结果数量] 找到 %s 个结果", result_count(results))
             
             # 将连字符词传递给format_results，确保高亮
-            return format_results(results, query_str, query_type="hyphen", 
+            return format_results(results, query_str, query_type="hyphen", markup=markup,
                                 hyphen_terms=hyphen_terms)
     except FileNotFoundError:
-        print("[错误] 索引目录不存在，请先构建索引")
+        logger.error("[错误] 索引目录不存在，请先构建索引")
         return []
     except Exception as e:
-        print(f"[错误] 连字符查询失败: {type(e).__name__} - {str(e)}")
+        logger.error("[错误] 连字符查询失败: %s - %s", type(e).__name__, e)
         return []
 
-def format_results(results, query_str=None, query_type="free", **kwargs):
+def format_results(results, query_str=None, query_type="free", markup="ansi", **kwargs):
     """
-    使用ANSI颜色代码高亮关键词，优先级：短语 > 连字符词 > 短语中单词 > 自由词
+    提取摘要并高亮关键词，优先级：短语 > 连字符词 > 短语中单词 > 自由词
     
     Args:
         results: Whoosh搜索结果
         query_str: 原始查询字符串
         query_type: 查询类型（free, phrase, mixed, hyphen）
+        markup: 高亮形式，"ansi" 为终端颜色代码，"html" 为 <span> 标签；
+                None 时不读取正文、不生成摘要 (摘要之后通过 fetch_snippets 按需获取)。
+                docno 从 docno 列读取，正文只为生成摘要的结果加载
+                (索引带有外部正文存储时从中读取，见 docstore.py)
         **kwargs: 额外参数
         
     Returns:
-        list: 格式化后的搜索结果列表
+        list: 格式化后的搜索结果列表；查询的时间预算用完后其余结果的摘要为 None
     """
     if not results:
         return []
+    if markup is None:
+        with stage("stored_fields"):
+            return [{"rank": i + 1, "score": round(hit.score, 4), "docno": hit_docno(hit)}
+                    for i, hit in enumerate(results)]
         
     search_results = []
-    
-    # 定义ANSI颜色代码
-    colors = {
-        'red': '\033[31m',      # 短语用红色
-        'green': '\033[32m',    # 短语中的单词用绿色
-        'blue': '\033[34m',     # 连字符词用蓝色
-        'yellow': '\033[33m',   # 自由词用黄色
-        'bold': '\033[1m',      # 加粗
-        'reset': '\033[0m'      # 重置所有样式
-    }
+    # 每个查询只构造一次高亮器，所有命中共用
+    highlighter = QueryHighlighter(query_str, query_type)
+    budget = current_budget()
+    docstore = open_docstore()
+    # 存储字段、摘要截取和高亮三个阶段的耗时按查询累计，最后各记录一次
+    fields_time = snippet_time = highlight_time = 0.0
     
     for i, hit in enumerate(results):
+        if budget is not None and budget.expired():
+            search_results.append({"rank": i + 1, "score": round(hit.score, 4), "docno": hit_docno(hit),
+                                   "snippet": None})
+            continue
+        # 出错时的结果沿用已经取得的 docno 和正文，不再加载整个存储字段
+        content = ""
+        docno = None
         try:
             # 获取文本及摘要
-            content = hit.get("content", "")
-            if not content:
-                content = ""
-                
-            # 提取摘要相关信息
-            snippet_data = extract_snippet(content, query_str)
-            snippet = snippet_data["snippet"]
-            
-            # 按优先级应用高亮
-            colored_snippet = apply_highlighting(snippet, query_str, query_type, colors)
+            t0 = time.perf_counter()
+            docno = hit_docno(hit)
+            if docstore is not None:
+                content = docstore.get(docno) or ""
+            else:
+                content = hit.get("content", "") or ""
+            t1 = time.perf_counter()
+            text = highlighter.snippet(content)
+            t2 = time.perf_counter()
+            snippet = highlighter.render(text, markup)
+            t3 = time.perf_counter()
+            fields_time += t1 - t0
+            snippet_time += t2 - t1
+            highlight_time += t3 - t2
             
             # 添加到结果
             search_results.append({
                 "rank": i + 1,
                 "score": round(hit.score, 4),
-                "docno": hit["docno"],
-                "snippet": colored_snippet
+                "docno": docno,
+                "snippet": snippet
             })
         except Exception as e:
-            print(f"[警告] 结果格式化错误: {str(e)}")
+            logger.warning("[警告] 结果格式化错误: %s", e)
             search_results.append({
                 "rank": i + 1,
                 "score": round(hit.score, 4) if hasattr(hit, 'score') else 0.0,
-                "docno": hit.get("docno", "unknown"),
+                "docno": docno or "unknown",
                 "snippet": content[:300] + "..." if content else "无法获取摘要"
             })
     
+    observe_stage("stored_fields", fields_time)
+    observe_stage("snippet", snippet_time)
+    observe_stage("highlight", highlight_time)
     return search_results
 
-def extract_snippet(content, query_str, length=700):
+def fetch_snippets(query_str: str, docnos: list, markup: str = "html") -> dict:
     """
-    从文档内容中提取包含查询词的摘要
-    
-    Args:
-        content: 文档内容
-        query_str: 查询字符串
-        length: 摘要长度
-        
-    Returns:
-        dict: 包含摘要和其他信息的字典
-    """
-    # 提取查询组件
-    phrases = re.findall(r'"([^"]*)"', query_str)
-    free_text = re.sub(r'"[^"]*"', '', query_str).strip()
-    
-    # 所有位置列表
-    positions = []
-    
-    # 查找短语位置
-    for phrase in phrases:
-        pos = content.lower().find(phrase.lower())
-        if pos != -1:
-            positions.append(pos)
-    
-    # 查找连字符词和普通词位置
-    for word in free_text.split():
-        if '-' in word:
-            hyphen_word = word.replace('-', ' ')
-            pos = content.lower().find(hyphen_word.lower())
-            if pos != -1:
-                positions.append(pos)
-        elif len(word) > 2:
-            pos = content.lower().find(word.lower())
-            if pos != -1:
-                positions.append(pos)
-    
-    # 选择摘要位置
-    if positions:
-        center = sum(positions) // max(len(positions), 1)  # 避免除零错误
-        start = max(0, center - length // 2)
-        end = min(len(content), start + length)
-        snippet = content[start:end]
-    else:
-        snippet = content[:length]
-    
-    return {
-        "snippet": snippet,
-        "positions": positions
-    }
+    为指定的文档生成高亮摘要，高亮方式与 execute_query 对该查询的处理一致
 
-def apply_highlighting(snippet, query_str, query_type, colors):
-    """
-    按优先级应用高亮
-    
     Args:
-        snippet: 文本摘要
-        query_str: 查询字符串
-        query_type: 查询类型
-        colors: 颜色代码字典
-        
-    Returns:
-        str: 应用高亮后的摘要
-    """
-    # 使用标记跟踪已高亮的位置
-    marked_positions = []
-    snippet_processed = snippet
-    
-    try:
-        # 1. 首先高亮完整短语 (红色，最高优先级)
-        phrases = re.findall(r'"([^"]*)"', query_str)
-        for phrase in phrases:
-            snippet_processed = highlight_terms(
-                snippet_processed, [phrase], colors['red'], colors['bold'], 
-                colors['reset'], marked_positions
-            )
-        
-        # 2. 高亮连字符词 (蓝色)
-        free_text = re.sub(r'"[^"]*"', '', query_str).strip()
-        hyphen_words = []
-        for word in free_text.split():
-            if '-' in word and len(word) > 2:
-                hyphen_words.append(word.replace('-', ' '))
-        
-        if hyphen_words:
-            snippet_processed = highlight_terms(
-                snippet_processed, hyphen_words, colors['blue'], colors['bold'], 
-                colors['reset'], marked_positions
-            )
-        
-        # 3. 高亮短语中的单词(绿色)，只有在混合查询或短语查询时
-        if query_type in ["mixed", "phrase"]:
-            phrase_words = []
-            for phrase in phrases:
-                phrase_words.extend([w for w in phrase.split() if len(w) > 2])
-            
-            if phrase_words:
-                snippet_processed = highlight_terms(
-                    snippet_processed, phrase_words, colors['green'], colors['bold'], 
-                    colors['reset'], marked_positions
-                )
-        
-        # 4. 最后高亮自由文本词 (黄色)
-        free_words = [w for w in free_text.split() if '-' not in w and len(w) > 2]
-        if free_words:
-            snippet_processed = highlight_terms(
-                snippet_processed, free_words, colors['yellow'], colors['bold'], 
-                colors['reset'], marked_positions
-            )
-        
-        return snippet_processed
-    except Exception as e:
-        print(f"[警告] 高亮处理错误: {str(e)}")
-        return snippet  # 出错时返回原始摘要
+        query_str: 用户输入的查询字符串
+        docnos: 文档编号列表
+        markup: 摘要高亮形式，"ansi" 或 "html"
 
-def highlight_terms(text, terms, color, bold, reset, marked_positions):
-    """
-    在文本中高亮指定词语
-    
-    Args:
-        text: 要处理的文本
-        terms: 要高亮的词语列表
-        color: 颜色代码
-        bold: 加粗代码
-        reset: 重置代码
-        marked_positions: 已标记位置列表
-        
     Returns:
-        str: 高亮后的文本
+        dict: {文档编号: 摘要}，索引中不存在的文档编号不出现在结果中
     """
-    result = text
-    
-    for term in terms:
-        if not term or len(term) <= 2:
-            continue
-            
-        term_lower = term.lower()
-        result_lower = result.lower()
-        
-        start_pos = 0
-        while True:
-            pos = result_lower.find(term_lower, start_pos)
-            if pos == -1:
-                break
-            
-            # 检查是否是单词边界且未被高亮
-            if is_valid_highlight_position(result_lower, pos, len(term_lower), marked_positions):
-                # 标记这个位置
-                new_pos_end = pos + len(term_lower)
-                marked_positions.append((pos, new_pos_end))
-                
-                # 提取原始大小写的文本
-                original = result[pos:new_pos_end]
-                # 添加颜色高亮
-                colored = f"{bold}{color}{original}{reset}"
-                
-                # 更新文本
-                result = result[:pos] + colored + result[new_pos_end:]
-                
-                # 更新所有标记位置（考虑添加的颜色代码长度）
-                offset = len(colored) - len(original)
-                marked_positions = [
-                    (s + offset if s > pos else s, e + offset if e > pos else e) 
-                    for s, e in marked_positions
-                ]
-                
-                # 更新搜索起点和结果小写版本
-                result_lower = result.lower()
-                start_pos = pos + len(colored)
-            else:
-                start_pos = pos + 1
-    
-    return result
+    return {docno: snippet for docno, snippet in iter_snippets(query_str, docnos, markup)
+            if snippet is not None}
 
-def is_valid_highlight_position(text, pos, length, marked_positions):
+def iter_snippets(query_str: str, docnos, markup: str = "html"):
     """
-    检查给定位置是否适合高亮（是单词边界且未被高亮）
-    
-    Args:
-        text: 文本
-        pos: 开始位置
-        length: 词语长度
-        marked_positions: 已标记位置列表
-        
-    Returns:
-        bool: 是否适合高亮
+    逐个生成摘要，产出 (文档编号, 摘要)；索引中不存在的文档摘要为 None。
+    流式响应用它在排名确定后一边生成摘要一边输出结果
     """
-    # 检查单词边界
-    is_boundary = (
-        (pos == 0 or not text[pos-1].isalnum()) and
-        (pos + length >= len(text) or not text[pos + length].isalnum())
-    )
-    
-    # 检查是否与已高亮区域重叠
-    not_overlapping = not any(s <= pos < e for s, e in marked_positions)
-    
-    return is_boundary and not_overlapping
+    highlighter = QueryHighlighter(query_str, query_type_of(query_str))
+    fields_time = snippet_time = highlight_time = 0.0
+    with content_source() as fetch:
+        try:
+            for docno in docnos:
+                t0 = time.perf_counter()
+                content = fetch(docno)
+                t1 = time.perf_counter()
+                fields_time += t1 - t0
+                if content is None:
+                    yield docno, None
+                    continue
+                text = highlighter.snippet(content)
+                t2 = time.perf_counter()
+                snippet = highlighter.render(text, markup)
+                snippet_time += t2 - t1
+                highlight_time += time.perf_counter() - t2
+                yield docno, snippet
+        finally:
+            observe_stage("stored_fields", fields_time)
+            observe_stage("snippet", snippet_time)
+            observe_stage("highlight", highlight_time)
 
 def display_search_results(results, top_n):
     """
@@ -729,6 +1419,20 @@ def parse_arguments():
                             help='数据集路径 (默认: ./tdt3)')
     index_parser.add_argument('--index-dir', default='indexdir',
                             help='索引存储路径 (默认: indexdir)')
+    index_parser.add_argument('--procs', type=int, default=Config.DEFAULT_PROCS,
+                            help='并行解析/写入进程数 (默认: 1)')
+    index_parser.add_argument('--limitmb', type=int, default=Config.DEFAULT_LIMITMB,
+                            help=f'每个写入进程的内存缓冲 MB (默认: {Config.DEFAULT_LIMITMB})')
+    index_parser.add_argument('--incremental', action='store_true',
+                            help='增量更新，只处理新增、修改或删除的文件')
+    index_parser.add_argument('--docstore', action='store_true',
+                            help='正文写入外部压缩存储，不作为存储字段写入索引')
+    index_parser.add_argument('--shingles', action='store_true',
+                            help='建立二元词组字段，加速短语查询和连字符查询')
+    index_parser.add_argument('--shards', type=int, default=1,
+                            help='分片数，大于 1 时构建分片索引 (默认: 1)')
+    index_parser.add_argument('--shard-by', choices=SHARD_STRATEGIES, default='hash',
+                            help='分片方式: hash 按文件相对路径的 CRC32 把整个文件分给一个分片，source 按 TDT3 来源子目录 (默认: hash)')
 
     # 搜索子命令
     search_parser = subparsers.add_parser('search', help='执行搜索')
@@ -744,7 +1448,10 @@ def handle_index_command(args):
     """处理索引构建命令"""
     print(f"正在从 {args.data_dir} 构建索引...")
     try:
-        build_index(args.data_dir, args.index_dir)
+        run_index_build(args.data_dir, args.index_dir,
+                        procs=args.procs, limitmb=args.limitmb,
+                        incremental=args.incremental, docstore=args.docstore, shingles=args.shingles,
+                        shards=args.shards, shard_by=args.shard_by)
         print(f"索引构建完成，存储于 {args.index_dir}")
     except Exception as e:
         print(f"索引构建失败: {str(e)}")
@@ -773,12 +1480,5 @@ def process_query_args(raw_query, phrase_length=None):
     # ... 原有处理逻辑 ...
     return processed_query
 
-def build_index(data_dir, index_dir):
-    docs = parse_tdt3_dataset(data_dir)
-    with tqdm(total=len(docs), desc="索引构建进度") as pbar:
-        for doc in docs:
-            # 处理文档...
-            pbar.update(1)
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
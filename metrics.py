@@ -0,0 +1,265 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 直方图的桶上界 (秒)，覆盖从亚毫秒的单个阶段到秒级的慢查询
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+    """
+    按一个标签分组的延迟直方图，导出为 Prometheus histogram (_bucket / _sum / _count)
+
+    每个标签值一组计数，observe() 只做一次二分查找和加锁计数，
+    可以放在查询的热路径上；累积分布在导出时才计算
+    """
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}       # 标签值 → [各桶计数 (最后一个为 +Inf), 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def time(self, value):
+        """with histogram.time("search"): ... 记录代码块的耗时"""
+        return _Timer(self.observe, value)
+
+    def snapshot(self):
+        """{标签值: [各桶计数, 总和, 次数]} 的副本"""
+        with self._lock:
+            return {value: [list(counts), total, count]
+                    for value, (counts, total, count) in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def merge(self, snapshot, other):
+        """把另一个进程的 snapshot() 结果 other 累加到 snapshot 中"""
+        for value, (counts, total, count) in other.items():
+            series = snapshot.get(value)
+            if series is None:
+                series = snapshot[value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+            series[2] += count
+
+    def render(self, snapshot=None):
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, (counts, total, count) in sorted(snapshot.items()):
+            labels = f'{self.label}="{_escape(value)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total!r}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+class Counter:
+    """按一个标签分组的计数器，导出为 Prometheus counter"""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value, amount=1):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def merge(self, snapshot, other):
+        for value, count in other.items():
+            snapshot[value] = snapshot.get(value, 0) + count
+
+    def render(self, snapshot=None):
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for value, count in sorted(snapshot.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(value)}"}} {count}')
+        return lines
+
+class _Timer:
+    __slots__ = ("observe", "value", "start")
+
+    def __init__(self, observe, value):
+        self.observe = observe
+        self.value = value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.observe(self.value, time.perf_counter() - self.start)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# 查询各阶段的耗时：classify (查询分类)、parse (查询解析)、search (收集命中)、
+# stored_fields (读取存储字段)、snippet (截取摘要)、highlight (高亮)、json (响应编码)，
+# 以及查询词补全 (suggest，每个 /suggest 请求一次)。
+# 按命中重复的阶段 (存储字段、摘要、高亮) 每个查询累计后记录一次
+STAGE_SECONDS = Histogram("tdt3_stage_seconds", "Time spent in each query stage.", "stage")
+QUERY_SECONDS = Histogram("tdt3_query_seconds", "End-to-end execute_query latency by query type.", "type")
+QUERIES = Counter("tdt3_queries_total", "Queries by outcome (ok, cache_hit, partial, error).", "outcome")
+REQUEST_SECONDS = Histogram("tdt3_http_request_seconds", "HTTP request latency by endpoint.", "endpoint")
+
+METRICS = [STAGE_SECONDS, QUERY_SECONDS, QUERIES, REQUEST_SECONDS]
+
+# 本线程正在跟踪的单个查询的阶段耗时 (见 trace_stages)
+_trace = threading.local()
+
+def observe_stage(name, seconds):
+    """记录一个查询阶段的耗时；本线程在 trace_stages() 中时同时累计到跟踪结果"""
+    STAGE_SECONDS.observe(name, seconds)
+    stages = getattr(_trace, "stages", None)
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+def stage(name):
+    """with stage("parse"): ... 记录一个查询阶段的耗时"""
+    return _Timer(observe_stage, name)
+
+@contextmanager
+def trace_stages():
+    """
+    with trace_stages() as stages: ... 期间本线程记录的阶段耗时另外累计到 stages ({阶段: 秒})，
+    用于单个查询的 EXPLAIN；直方图照常记录
+    """
+    previous = getattr(_trace, "stages", None)
+    _trace.stages = stages = {}
+    try:
+        yield stages
+    finally:
+        _trace.stages = previous
+
+# 随指标导出的额外数值的来源，每个返回 [(名称, 类型, 说明, 数值)] (见 register_gauges)
+_gauge_sources = []
+
+def register_gauges(source):
+    """source() 返回 [(名称, 类型 counter|gauge, 说明, 数值)]，导出指标时调用，例如结果缓存的计数"""
+    _gauge_sources.append(source)
+
+def _gauges():
+    return [list(gauge) for source in _gauge_sources for gauge in source()]
+
+# 多进程部署 (serve.py) 时各工作进程的指标文件所在目录，见 enable_worker_files
+_worker_dir = None
+_last_flush = {"time": 0.0, "data": None}
+
+# 工作进程写指标文件的最短间隔 (秒)，也是其他工作进程的计数在导出结果中的最大延迟
+FLUSH_INTERVAL = 1.0
+
+def enable_worker_files(directory):
+    """
+    多进程部署：之后 fork 出的工作进程把各自的指标写入 directory/<pid>.json (flush_worker_file)，
+    render_metrics 汇总目录中全部进程的文件，抓取落到任何一个工作进程上得到的都是整个服务的计数。
+    已退出的工作进程的文件保留，计数器在重启和切换索引时不会回退；gauge 只汇总仍在运行的进程
+    """
+    global _worker_dir
+    _worker_dir = directory
+
+def reset_metrics():
+    """清空本进程的计数 (fork 出的工作进程不继承主进程的计数)"""
+    for metric in METRICS:
+        metric.reset()
+    _last_flush.update(time=0.0, data=None)
+
+def flush_worker_file(force=False):
+    """把本进程的指标写入指标文件；距上次写入不足 FLUSH_INTERVAL 或没有变化时跳过"""
+    if _worker_dir is None:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush["time"] < FLUSH_INTERVAL:
+        return
+    data = {"metrics": {metric.name: metric.snapshot() for metric in METRICS}, "gauges": _gauges()}
+    _last_flush["time"] = now
+    if data == _last_flush["data"]:
+        return
+    _last_flush["data"] = data
+    path = os.path.join(_worker_dir, f"{os.getpid()}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _worker_files():
+    """其他工作进程最近写入的指标 [(pid, 数据)]；本进程的计数直接取内存中的"""
+    if _worker_dir is None:
+        return []
+    try:
+        names = os.listdir(_worker_dir)
+    except FileNotFoundError:
+        return []
+    files = []
+    for name in names:
+        pid = name[:-len(".json")]
+        if not name.endswith(".json") or not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            with open(os.path.join(_worker_dir, name), "r", encoding="utf-8") as f:
+                files.append((int(pid), json.load(f)))
+        except (OSError, ValueError):
+            continue    # 恰好被替换或删除
+    return files
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def render_metrics():
+    """
+    全部指标以及 register_gauges 登记的数值的 Prometheus 文本格式。
+    多进程部署时为全部工作进程之和 (见 enable_worker_files)
+    """
+    others = _worker_files()
+    lines = []
+    for metric in METRICS:
+        snapshot = metric.snapshot()
+        for _, data in others:
+            metric.merge(snapshot, data["metrics"].get(metric.name, {}))
+        lines.extend(metric.render(snapshot))
+
+    live = [data for pid, data in others if _is_running(pid)]
+    others = [data for _, data in others]
+    for name, kind, help_text, value in _gauges():
+        # 计数器包括已退出进程的计数，gauge 只取仍在运行的进程
+        for data in (others if kind == "counter" else live):
+            value += sum(g[3] for g in data.get("gauges", []) if g[0] == name)
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,12 @@
 import os
 import re
-from nltk.stem import PorterStemmer
+import hashlib
+import itertools
+import mmap
+import multiprocessing
+
+HYPHEN_PATTERN = re.compile(r'(\w)-(\w)')
+PUNCT_PATTERN = re.compile(r'[^\w\s]')
 
 def preprocess(text):
     # 基本预处理，保留文本结构
@@ -8,14 +14,15 @@ def preprocess(text):
     
     # 将连字符替换为空格，但保留其作为单词的一部分
     # 例如将 "closed-door" 变为 "closed door"
-    text = re.sub(r'(\w)-(\w)', r'\1 \2', text)
+    text = HYPHEN_PATTERN.sub(r'\1 \2', text)
     
     # 移除其他标点符号
-    text = re.sub(r'[^\w\s]', '', text)
+    text = PUNCT_PATTERN.sub('', text)
     
     return text
 
 def parse_tdt3_sgml(content):
+    """解析字符串中的第一个文档 (单文档接口，多文档文件请使用 iter_sgml_docs)"""
     docno_match = re.search(r'<DOCNO>\s*(.*?)\s*</DOCNO>', content, re.DOTALL)
     text_match = re.search(r'<TEXT>(.*?)</TEXT>', content, re.DOTALL)
     if docno_match and text_match:
@@ -24,24 +31,149 @@ def parse_tdt3_sgml(content):
         return {"docno": docno, "text": preprocess(text)}
     return None
 
-def parse_tdt3_dataset(root_dir):
-    parsed_docs = []
-    for subdir in os.listdir(root_dir):
+# 多文档解析使用的预编译模式，直接作用于 bytes / mmap
+DOC_START = b'<DOC>'
+DOC_END = b'</DOC>'
+DOCNO_PATTERN = re.compile(rb'<DOCNO>\s*(.*?)\s*</DOCNO>', re.DOTALL)
+TEXT_START = b'<TEXT>'
+TEXT_END = b'</TEXT>'
+FIELD_PATTERNS = {
+    "source": re.compile(rb'<SOURCE>\s*(.*?)\s*</SOURCE>', re.DOTALL),
+    "date": re.compile(rb'<DATE(?:_TIME)?>\s*(.*?)\s*</DATE(?:_TIME)?>', re.DOTALL),
+    "headline": re.compile(rb'<HEADLINE>\s*(.*?)\s*</HEADLINE>', re.DOTALL),
+}
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def _decode(data):
+    # 与文本模式读取一致，统一换行符
+    return data.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+def parse_sgml_block(block):
+    """
+    解析一个 <DOC> 块 (bytes)，返回未经预处理的字段字典
+
+    缺少 DOCNO 或 TEXT 时返回 None；source/date/headline 仅在存在时给出。
+    正文用 find 定位，正则只作用于 <TEXT> 之前的头部，避免逐字符扫描正文。
+    """
+    text_start = block.find(TEXT_START)
+    if text_start == -1:
+        return None
+    text_end = block.find(TEXT_END, text_start)
+    if text_end == -1:
+        return None
+    header = block[:text_start]
+    docno_match = DOCNO_PATTERN.search(header)
+    if not docno_match:
+        return None
+    doc = {
+        "docno": _decode(docno_match.group(1)).strip(),
+        "text": _decode(block[text_start + len(TEXT_START):text_end]).strip(),
+    }
+    for name, pattern in FIELD_PATTERNS.items():
+        match = pattern.search(header)
+        if match:
+            value = WHITESPACE_PATTERN.sub(' ', _decode(match.group(1))).strip()
+            if value:
+                doc[name] = value
+    return doc
+
+def iter_sgml_docs(buf):
+    """
+    逐个产出缓冲区 (bytes 或 mmap) 中的全部 <DOC> 文档
+
+    用 find 定位 <DOC>...</DOC> 边界，只对单个文档块运行正则，
+    不需要把整个文件解码成字符串。没有 <DOC> 标记时把整个缓冲区当作一个文档。
+    """
+    pos = buf.find(DOC_START)
+    if pos == -1:
+        doc = parse_sgml_block(bytes(buf))
+        if doc:
+            yield doc
+        return
+    while pos != -1:
+        start = pos + len(DOC_START)
+        end = buf.find(DOC_END, start)
+        if end == -1:
+            end = len(buf)
+        doc = parse_sgml_block(buf[start:end])
+        if doc:
+            yield doc
+        pos = buf.find(DOC_START, end)
+
+def iter_tdt3_files(root_dir):
+    """按子目录顺序逐个产出数据集中的 .txt 文件路径，不预先收集整个列表"""
+    for subdir in sorted(os.listdir(root_dir)):
         subdir_path = os.path.join(root_dir, subdir)
         if not os.path.isdir(subdir_path):
             continue
-        for file_name in os.listdir(subdir_path):
+        for file_name in sorted(os.listdir(subdir_path)):
             if not file_name.endswith('.txt'):
                 continue
-            file_path = os.path.join(subdir_path, file_name)
+            yield os.path.join(subdir_path, file_name)
+
+def parse_tdt3_file(file_path):
+    """
+    通过 mmap 读取并解析单个 TDT3 文件中的全部文档，供进程池调用
+
+    返回 (文件路径, 文档列表, 文件指纹)，指纹包含 mtime_ns/size/sha1，
+    用于增量索引判断文件是否变化。文档缺少 <SOURCE> 时以所在子目录名作为来源。
+    """
+    try:
+        stat = os.stat(file_path)
+        source = os.path.basename(os.path.dirname(file_path))
+        docs = []
+        with open(file_path, 'rb') as f:
+            if stat.st_size == 0:
+                # 空文件无法 mmap
+                buf = b''
+            else:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                doc = parse_tdt3_sgml(content)
-                if doc:
-                    parsed_docs.append(doc)
-            except Exception as e:
-                print(f"Error parsing {file_path}: {e}")
+                sha1 = hashlib.sha1(buf).hexdigest()
+                for doc in iter_sgml_docs(buf):
+                    doc["text"] = preprocess(doc["text"])
+                    doc.setdefault("source", source)
+                    docs.append(doc)
+            finally:
+                if isinstance(buf, mmap.mmap):
+                    buf.close()
+        fingerprint = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha1": sha1,
+        }
+        return file_path, docs, fingerprint
+    except Exception as e:
+        print(f"Error parsing {file_path}: {e}")
+        return file_path, [], None
+
+def iter_tdt3_dataset(root_dir, procs=1, files=None, batch_size=1024, chunksize=16):
+    """
+    流式解析 TDT3 数据集，逐个产出 parse_tdt3_file 的结果
+
+    procs > 1 时解析和预处理分发到进程池；文件按 batch_size 分批提交，
+    使在途的解析结果有上界，避免写入端较慢时结果在内存中堆积。
+    files 为 None 时遍历 root_dir 下的全部文件。
+    """
+    if files is None:
+        files = iter_tdt3_files(root_dir)
+    if procs <= 1:
+        for file_path in files:
+            yield parse_tdt3_file(file_path)
+        return
+
+    files = iter(files)
+    with multiprocessing.Pool(procs) as pool:
+        while True:
+            batch = list(itertools.islice(files, batch_size))
+            if not batch:
+                break
+            yield from pool.imap(parse_tdt3_file, batch, chunksize)
+
+def parse_tdt3_dataset(root_dir, procs=1):
+    parsed_docs = []
+    for _, docs, _ in iter_tdt3_dataset(root_dir, procs=procs):
+        parsed_docs.extend(docs)
     return parsed_docs
 
 def process_query(query_str):
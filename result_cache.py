@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+def normalize_query(query_str):
+    """
+    缓存键使用的查询规范化：只合并空白。
+    不转小写：查询运算符 (AND/OR/NOT) 区分大小写，"a OR b" 与 "a or b" 是不同的查询
+    """
+    return ' '.join(query_str.split())
+
+class ResultCache:
+    """
+    带 TTL 的 LRU 查询结果缓存
+
+    条目与索引代号绑定：一旦以更新的代号访问缓存，旧一代的条目全部丢弃，
+    因此 build_index 提交新一代后缓存自动失效。
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_generation(self, generation):
+        # 调用方需持有锁
+        if generation != self._generation:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._generation = generation
+
+    def get(self, key, generation):
+        """命中时返回结果列表的副本，否则返回 None"""
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if self.ttl and expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return list(value)
+
+    def put(self, key, generation, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._check_generation(generation)
+            self._data[key] = (time.monotonic() + self.ttl, list(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
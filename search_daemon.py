@@ -0,0 +1,294 @@
+"""
+常驻查询服务：在本机 Unix 套接字上保持索引打开，为命令行和脚本执行查询 (仅支持 POSIX 系统)
+
+用法示例:
+    python search_daemon.py start [--index-dir indexdir] [--socket .tdt3-search.sock]
+    python search_daemon.py status
+    python search_daemon.py stop
+
+服务运行时，python main.py search ... 把查询转发给它 (见 forward_search)，
+省去每次启动时导入 Whoosh、打开索引和预热的开销，结果缓存也在多次调用之间保留。
+
+协议为每行一个 JSON 请求、每行一个 JSON 响应，同一连接上可以连续发送多个请求:
+    {"op": "search", "query": "...", "top_n": 10, "markup": "html", "timeout": null, "explain": false}
+        → {"results": [...], "partial": false, "elapsed": 0.012, "explain": null}
+    {"op": "cli", "args": ["hurricane", "--hits=5"]}   → {"output": "..."} (与 main.py search 的输出相同)
+    {"op": "status"}                                    → {"pid", "index_dir", "generation", "uptime", "requests", "cache"}
+    {"op": "stop"}                                      → {"stopping": true}
+出错时响应 {"error": "..."}。
+
+本模块顶层只导入标准库：main.py 在导入 Whoosh 之前调用 forward_search，
+服务端需要的查询模块在 run_daemon 中才导入。
+"""
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+# 默认套接字路径，与默认索引目录 indexdir 一样相对于当前目录；环境变量 TDT3_SEARCH_SOCKET 可覆盖
+DEFAULT_SOCKET = ".tdt3-search.sock"
+
+# 客户端等待一个响应的最长时间 (秒)
+CLIENT_TIMEOUT = 30.0
+
+logger = logging.getLogger("tdt3.daemon")
+
+def socket_path(path=None):
+    """实际使用的套接字路径：参数、TDT3_SEARCH_SOCKET 环境变量、DEFAULT_SOCKET 依次优先"""
+    return path or os.environ.get("TDT3_SEARCH_SOCKET") or DEFAULT_SOCKET
+
+class DaemonError(Exception):
+    """常驻服务返回的错误响应"""
+
+class DaemonClient:
+    """
+    常驻查询服务的客户端，一个实例对应一个连接，可以连续发送多个请求
+
+    用法:
+        with DaemonClient() as client:
+            response = client.search("hurricane mitch", top_n=5)
+
+    服务未运行时 connect() 抛出 FileNotFoundError 或 ConnectionRefusedError (均为 OSError)
+    """
+
+    def __init__(self, path=None, timeout=CLIENT_TIMEOUT):
+        self.path = socket_path(path)
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        try:
+            self.sock.connect(self.path)
+        except OSError:
+            self.close()
+            raise
+        self.reader = self.sock.makefile("rb")
+        return self
+
+    def request(self, message):
+        """发送一个请求并返回响应字典；错误响应抛出 DaemonError"""
+        if self.sock is None:
+            self.connect()
+        self.sock.sendall(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("常驻服务关闭了连接")
+        response = json.loads(line)
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response
+
+    def search(self, query, top_n=10, markup="html", timeout=None, explain=False):
+        return self.request({"op": "search", "query": query, "top_n": top_n, "markup": markup,
+                             "timeout": timeout, "explain": explain})
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def forward_search(args):
+    """
+    main.py search 的客户端模式：常驻服务在运行时把命令行参数交给它执行并输出结果。
+
+    批量查询 (输出文件由本进程写)、--verbose (日志在本进程输出)、--profile=文件 和
+    --no-daemon 仍在本地执行；连接不上服务 (未运行) 或服务拒绝请求时返回 None，由调用方在本地执行。
+    请求发出之后的超时和连接中断报告为错误，不在本地重新执行：服务可能仍在执行这个查询
+
+    Returns:
+        int: 已由常驻服务处理时为进程退出码；None 表示应在本地执行
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    if any(arg.startswith(("--batch", "--profile=")) or arg in ("--verbose", "--no-daemon") for arg in args):
+        return None
+    client = DaemonClient()
+    try:
+        client.connect()
+    except OSError:
+        return None     # 服务未运行 (套接字不存在或无人监听)，请求尚未发出
+    try:
+        response = client.request({"op": "cli", "args": args})
+    except DaemonError:
+        return None     # 服务拒绝了请求 (例如版本不同的服务)，查询没有执行
+    except socket.timeout:
+        print(f"[常驻服务] {client.timeout:g}s 内没有收到响应，查询可能仍在服务中执行；"
+              f"可以加 --no-daemon 在本地执行", file=sys.stderr)
+        return 1
+    except (OSError, ValueError) as e:
+        print(f"[常驻服务] 与服务的连接中断: {type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        client.close()
+    sys.stdout.write(response["output"])
+    sys.stdout.flush()
+    return 0
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """逐行读取请求并写回响应，直到客户端关闭连接"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.dispatch(json.loads(line))
+            except (KeyError, ValueError) as e:
+                response = {"error": f"无效的请求: {type(e).__name__}: {e}"}
+            except Exception as e:
+                logger.exception("[错误] 处理请求失败")
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+
+class SearchDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """每个连接一个线程的 Unix 套接字服务器，查询经由 main.execute_query 执行"""
+
+    daemon_threads = True
+
+    def __init__(self, path, index_dir):
+        self.index_dir = index_dir
+        self.started = time.time()
+        self.requests = 0
+        self._lock = threading.Lock()
+        super().__init__(path, RequestHandler)
+
+    def dispatch(self, message):
+        import main
+
+        with self._lock:
+            self.requests += 1
+        op = message.get("op")
+        if op == "search":
+            results = main.execute_query(message["query"], int(message.get("top_n", 10)),
+                                         markup=message.get("markup", "html"),
+                                         timeout=message.get("timeout"),
+                                         explain=bool(message.get("explain")))
+            return {"results": list(results), "partial": results.partial,
+                    "elapsed": round(results.elapsed, 4), "explain": results.explain}
+        if op == "cli":
+            out = io.StringIO()
+            main.run_search_command(list(message.get("args", [])), out=out)
+            return {"output": out.getvalue()}
+        if op == "status":
+            return {"pid": os.getpid(), "index_dir": os.path.abspath(self.index_dir),
+                    "generation": main.index_generation(), "uptime": round(time.time() - self.started, 1),
+                    "requests": self.requests, "cache": main.result_cache.stats()}
+        if op == "stop":
+            # shutdown() 等待 serve_forever 退出，不能在处理请求的线程中同步调用
+            threading.Thread(target=self.shutdown).start()
+            return {"stopping": True}
+        raise ValueError(f"未知的请求类型: {op!r}")
+
+def warm_up(index_dir):
+    """打开索引并加载各字段的长度信息，使第一个查询不必承担打开索引的开销"""
+    from main import Config, open_searcher, index_generation
+    from shards import ShardedSearcher
+
+    with open_searcher() as searcher:
+        searchers = searcher.searchers if isinstance(searcher, ShardedSearcher) else [searcher]
+        for s in searchers:
+            reader = s.reader()
+            for fieldname in reader.indexed_field_names():
+                reader.field_length(fieldname)
+        if Config.VECTOR_ENGINE and not isinstance(searcher, ShardedSearcher):
+            from vector_engine import get_vector_index
+            get_vector_index(index_dir, searcher)
+    return index_generation()
+
+def is_running(path):
+    """path 上是否有正在运行的服务在接受连接"""
+    try:
+        with DaemonClient(path, timeout=2.0) as client:
+            client.request({"op": "status"})
+        return True
+    except (OSError, ValueError, DaemonError):
+        return False
+
+def run_daemon(path, index_dir, timeout=0.0):
+    from main import Config
+
+    if is_running(path):
+        print(f"[常驻服务] {path} 上已有服务在运行")
+        sys.exit(1)
+    if os.path.exists(path):
+        os.unlink(path)     # 上次异常退出留下的套接字文件
+
+    Config.INDEX_DIR = index_dir
+    Config.QUERY_TIMEOUT = timeout
+    start = time.time()
+    generation = warm_up(index_dir)
+    # 套接字文件在 bind 时按 umask 创建：先收紧 umask，文件一出现就只允许当前用户连接
+    umask = os.umask(0o077)
+    try:
+        server = SearchDaemon(path, index_dir)
+    finally:
+        os.umask(umask)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"[常驻服务] 监听 {path}，索引 {index_dir} (代号 {generation}，加载耗时 {time.time() - start:.2f}s)",
+          flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+        print("[常驻服务] 已停止")
+
+def parse_arguments():
+    import argparse
+    parser = argparse.ArgumentParser(description='信息检索系统常驻查询服务')
+    parser.add_argument('command', choices=('start', 'status', 'stop'))
+    parser.add_argument('--socket', help=f'套接字路径 (默认: $TDT3_SEARCH_SOCKET 或 {DEFAULT_SOCKET})')
+    parser.add_argument('--index-dir', default='indexdir', help='索引路径 (默认: indexdir)')
+    parser.add_argument('--timeout', type=float, default=0.0,
+                        help='每个查询的时间预算秒数，0 表示不限时 (默认: 0)')
+    parser.add_argument('--log-level', default='WARNING', help='日志级别 (默认: WARNING)')
+    return parser.parse_args()
+
+def main_entry():
+    if not hasattr(socket, 'AF_UNIX'):
+        print("search_daemon.py 依赖 Unix 套接字，当前平台请直接使用 python main.py search")
+        sys.exit(1)
+    args = parse_arguments()
+    path = socket_path(args.socket)
+    if args.command == 'start':
+        from main import setup_logging
+        setup_logging(args.log_level.upper())
+        run_daemon(path, args.index_dir, timeout=args.timeout)
+        return
+    try:
+        with DaemonClient(path, timeout=10.0) as client:
+            if args.command == 'status':
+                print(json.dumps(client.request({"op": "status"}), ensure_ascii=False, indent=1))
+            else:
+                client.request({"op": "stop"})
+                print(f"[常驻服务] 已通知 {path} 上的服务退出")
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"[常驻服务] {path} 上没有正在运行的服务")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main_entry()
@@ -1,13 +1,14 @@
-from whoosh.index import open_dir
+from index_manager import get_index_manager
 from whoosh.qparser import QueryParser, PhrasePlugin
 from whoosh.highlight import HtmlFormatter, ContextFragmenter, Highlighter
-from custom_scorer import CustomScorer
+import logging
 import re
 
+logger = logging.getLogger("tdt3.search_engine")
+
 def search_query(query_str, top_n=10):
     try:
-        ix = open_dir("indexdir")
-        with ix.searcher(weighting=CustomScorer()) as searcher:
+        with get_index_manager("indexdir").searcher() as searcher:
             # 使用完全自定义的查询构建方式
             query_builder = []
             
@@ -50,17 +51,17 @@ def search_query(query_str, top_n=10):
             # 构建最终查询
             final_query = " AND ".join(query_builder)
             
-            print(f"[DEBUG] Final Query: {final_query}")
+            logger.debug("Final Query: %s", final_query)
             
             # 解析查询
-            parser = QueryParser("content", schema=ix.schema)
+            parser = QueryParser("content", schema=searcher.schema)
             parser.add_plugin(PhrasePlugin())
             query = parser.parse(final_query)
             
-            print(f"[DEBUG] Parsed Query: {query}")
+            logger.debug("Parsed Query: %s", query)
             
             results = searcher.search(query, limit=top_n)
-            print(f"[DEBUG] Found {len(results)} results")
+            logger.debug("Found ~%d results", results.estimated_length())
             
             formatter = HtmlFormatter(tagname='b', classname='match', between='...')
             fragmenter = ContextFragmenter(surround=50)
@@ -75,7 +76,7 @@ def search_query(query_str, top_n=10):
                     if not highlighted:
                         highlighted = hit["content"][:150] + "..."
                 except Exception as e:
-                    print(f"Highlighting error: {e}")
+                    logger.warning("Highlighting error: %s", e)
                     highlighted = hit["content"][:150] + "..."
                 
                 search_results.append({
@@ -86,5 +87,5 @@ def search_query(query_str, top_n=10):
                 })
             return search_results
     except Exception as e:
-        print(f"Search error: {str(e)}")
+        logger.error("Search error: %s", e)
         return []
\ No newline at end of file
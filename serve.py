@@ -0,0 +1,263 @@
+"""
+生产环境的 Web 服务入口 (预先派生的多进程服务器，仅支持 POSIX 系统)
+
+用法示例:
+    python serve.py --workers 4 --port 8000 --index-dir indexdir
+
+主进程打开索引、借出并预热搜索器 (开启 VECTOR_ENGINE 时还会导出向量索引)，
+然后 fork 出 workers 个工作进程。工作进程共享主进程已加载的索引结构：
+Whoosh 的复合段文件通过 mmap 读取，fork 后各进程按写时复制共享同一份页面，
+不需要各自重新打开和预热。
+
+主进程每隔 check_interval 秒检查一次索引代号，出现新一代 (或收到 SIGHUP) 时
+先在主进程中加载新一代，再 fork 一组新的工作进程，随后向旧的工作进程发送 SIGTERM；
+旧进程处理完手头的请求后退出，期间监听端口一直有进程在接受连接。
+SIGTERM / SIGINT 使主进程通知全部工作进程处理完当前请求后退出，再自行退出。
+
+各工作进程的指标写在主进程创建的临时目录中，/metrics 落到任何一个工作进程上
+都返回全部工作进程的汇总 (见 metrics.enable_worker_files)。
+"""
+import argparse
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from werkzeug.serving import BaseWSGIServer
+from index_manager import get_index_manager, forget_managers
+from shards import load_shard_config, is_sharded, forget_shard_sets
+from vector_engine import get_vector_index
+import metrics
+import main
+from main import Config, setup_logging
+
+# 工作进程在两次检查退出标志之间最多等待连接的时间 (秒)
+ACCEPT_TIMEOUT = 1.0
+
+class WorkerServer(BaseWSGIServer):
+    """
+    工作进程中的单线程 WSGI 服务器，在继承自主进程的监听套接字上接受连接
+
+    监听套接字为非阻塞模式：多个工作进程同时被唤醒时，没抢到连接的进程
+    立即返回继续等待，而不是阻塞在 accept() 上错过退出信号
+    """
+
+    def get_request(self):
+        conn, addr = self.socket.accept()
+        conn.setblocking(True)
+        return conn, addr
+
+class PreforkServer:
+    """
+    预先派生工作进程的服务器：主进程加载索引后 fork，负责监控索引代号、
+    平滑重载以及重启意外退出的工作进程
+    """
+
+    def __init__(self, app, host="127.0.0.1", port=8000, workers=2, check_interval=2.0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.check_interval = check_interval
+        self.workers = {}       # pid → 所属的加载批次
+        self.epoch = 0
+        self.generation = None
+        self.fork_safe = True
+        self.stopping = False
+        self.reload_requested = False
+        self.listener = None
+        self.metrics_dir = None
+
+    def index_dirs(self):
+        """需要预加载的 Whoosh 索引目录 (分片索引为各分片目录)"""
+        if is_sharded(Config.INDEX_DIR):
+            config = load_shard_config(Config.INDEX_DIR)
+            return [os.path.join(Config.INDEX_DIR, name) for name in config["shards"]]
+        return [Config.INDEX_DIR]
+
+    def preload(self):
+        """
+        在主进程中打开索引并预热搜索器，返回加载的索引代号。
+
+        只有复合段 (.seg，整体 mmap) 可以在进程间直接共享；存在非复合段时，
+        其文件对象的读写位置会在 fork 出的进程间互相干扰，工作进程改为自行打开索引
+        """
+        self.fork_safe = True
+        for index_dir in self.index_dirs():
+            manager = get_index_manager(index_dir)
+            manager.invalidate()
+            with manager.searcher() as searcher:
+                reader = searcher.reader()
+                for fieldname in reader.indexed_field_names():
+                    reader.field_length(fieldname)
+                if Config.VECTOR_ENGINE and index_dir == Config.INDEX_DIR:
+                    get_vector_index(index_dir, searcher)
+            segments = manager.index()._segments()
+            self.fork_safe = self.fork_safe and all(segment.is_compound() for segment in segments)
+        if not self.fork_safe:
+            print("[服务] 索引包含非复合段，工作进程将各自打开索引 (不共享已加载的索引结构)")
+        return main.index_generation()
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = self.epoch
+            return
+        # 子进程
+        code = 0
+        try:
+            self.run_worker()
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+
+    def run_worker(self):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)    # 终端的 Ctrl-C 由主进程统一处理
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        if not self.fork_safe:
+            forget_managers()
+            forget_shard_sets()
+        metrics.reset_metrics()
+
+        server = WorkerServer(self.host, self.port, self.app, fd=self.listener.fileno())
+        server.timeout = ACCEPT_TIMEOUT
+        try:
+            while not stopping:
+                server.handle_request()
+                metrics.flush_worker_file()
+        finally:
+            server.server_close()
+            metrics.flush_worker_file(force=True)
+
+    def reload(self):
+        """加载新一代索引并换上一组新的工作进程，旧进程处理完当前请求后退出"""
+        self.reload_requested = False
+        old = [pid for pid, epoch in self.workers.items() if epoch == self.epoch]
+        self.epoch += 1
+        self.generation = self.preload()
+        for _ in range(self.num_workers):
+            self.spawn_worker()
+        for pid in old:
+            self._signal(pid, signal.SIGTERM)
+        print(f"[服务] 已切换到索引代号 {self.generation}，{len(old)} 个旧工作进程正在退出")
+
+    def reap(self):
+        """回收已退出的工作进程；当前批次的进程意外退出时补上新的进程"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            epoch = self.workers.pop(pid, None)
+            if epoch == self.epoch and not self.stopping:
+                print(f"[服务] 工作进程 {pid} 意外退出 (状态 {status})，重新启动")
+                self.spawn_worker()
+
+    def run(self):
+        self.listener = socket.create_server((self.host, self.port), backlog=128)
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+        self.metrics_dir = tempfile.mkdtemp(prefix="tdt3-metrics-")
+        metrics.enable_worker_files(self.metrics_dir)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)   # 让 sleep 及时被打断
+
+        start = time.time()
+        self.generation = self.preload()
+        for _ in range(self.num_workers):
+            self.spawn_worker()
+        print(f"[服务] 监听 http://{self.host}:{self.port}，{self.num_workers} 个工作进程，"
+              f"索引代号 {self.generation} (加载耗时 {time.time() - start:.2f}s)", flush=True)
+
+        try:
+            while not self.stopping:
+                time.sleep(self.check_interval)
+                self.reap()
+                if self.stopping:
+                    break
+                if self.reload_requested or main.index_generation() != self.generation:
+                    self.reload()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """通知全部工作进程处理完当前请求后退出，并等待它们结束"""
+        self.stopping = True
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.time() + 30
+        while self.workers and time.time() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            self.workers.pop(pid, None)
+        for pid in self.workers:
+            self._signal(pid, signal.SIGKILL)
+        self.listener.close()
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        print("[服务] 已停止")
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+    @staticmethod
+    def _signal(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='信息检索系统 Web 服务 (多进程)')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000, help='监听端口 (默认: 8000)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='工作进程数 (默认: CPU 核数)')
+    parser.add_argument('--index-dir', default=Config.INDEX_DIR,
+                        help=f'索引路径 (默认: {Config.INDEX_DIR})')
+    parser.add_argument('--check-interval', type=float, default=2.0,
+                        help='检查索引新一代的间隔秒数 (默认: 2)')
+    parser.add_argument('--timeout', type=float, default=2.0,
+                        help='每个查询的时间预算秒数，超出后返回已就绪的结果，0 表示不限时 (默认: 2)')
+    parser.add_argument('--log-level', default='WARNING',
+                        help='日志级别，DEBUG 输出每个查询的提示信息，INFO 同时记录每个请求 (默认: WARNING)')
+    return parser.parse_args()
+
+def main_entry():
+    if not hasattr(os, 'fork'):
+        print("serve.py 依赖 os.fork，当前平台请使用 python app.py")
+        sys.exit(1)
+    args = parse_arguments()
+    Config.INDEX_DIR = args.index_dir
+    setup_logging(args.log_level.upper())
+    # 逐请求的访问日志只在 INFO 及以下级别输出
+    logging.getLogger('werkzeug').setLevel(args.log_level.upper())
+    Config.QUERY_TIMEOUT = args.timeout
+    # 并行由工作进程提供，分片查询在各工作进程内依次执行，不再另建查询进程池
+    Config.SHARD_WORKERS = 1
+
+    from app import app
+    server = PreforkServer(app, host=args.host, port=args.port, workers=max(1, args.workers),
+                           check_interval=args.check_interval)
+    server.run()
+
+if __name__ == '__main__':
+    main_entry()
@@ -0,0 +1,395 @@
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from index_builder import build_index, docno_lookup, DEFAULT_LIMITMB, SHARDS_FILE, _relpath
+from index_manager import get_index_manager, invalidate_index, forget_managers
+from preprocessor import iter_tdt3_files
+from custom_scorer import CustomScorer, CollectionStats
+from docstore import DocStoreSet, get_docstore
+from suggest import SUGGEST_FILE, build_suggestions
+from whoosh.collectors import TimeLimitCollector, TimeLimit
+
+SHARD_STRATEGIES = ("hash", "source")
+
+SHARDS_VERSION = 1
+
+def shard_name(shard):
+    return f"shard-{shard:02d}"
+
+def is_sharded(index_dir):
+    """index_dir 是否为分片索引 (包含分片布局文件)"""
+    return os.path.exists(os.path.join(index_dir, SHARDS_FILE))
+
+def load_shard_config(index_dir):
+    try:
+        with open(os.path.join(index_dir, SHARDS_FILE), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if config.get("version") != SHARDS_VERSION:
+        return None
+    return config
+
+def save_shard_config(index_dir, config):
+    """先写临时文件再替换，分片全部发布后才让新的布局可见"""
+    path = os.path.join(index_dir, SHARDS_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, path)
+
+def file_shard(rel_path, num_shards):
+    """
+    hash 方式下文件所属的分片：相对路径的 CRC32 取模。按文件而不是按 docno 分配，
+    每个文件只由一个分片读取和解析，构建开销不随分片数增长
+    """
+    return zlib.crc32(rel_path.encode('utf-8')) % num_shards
+
+def file_source(rel_path):
+    """文件所属的来源子目录 (根目录下的文件为空字符串)"""
+    return rel_path.split('/', 1)[0] if '/' in rel_path else ''
+
+def assign_sources(file_paths, root_dir, num_shards, previous=None):
+    """
+    把来源子目录分配到分片：已有的分配保持不变 (增量更新时文档不会换分片)，
+    新来源按总字节数从大到小依次分给当前最小的分片
+    """
+    sizes = {}
+    for path in file_paths:
+        source = file_source(_relpath(path, root_dir))
+        sizes[source] = sizes.get(source, 0) + os.path.getsize(path)
+
+    assignment = {source: shard for source, shard in (previous or {}).items() if shard < num_shards}
+    loads = [0] * num_shards
+    for source, shard in assignment.items():
+        loads[shard] += sizes.get(source, 0)
+    for source in sorted(sizes, key=lambda s: (-sizes[s], s)):
+        if source not in assignment:
+            shard = loads.index(min(loads))
+            assignment[source] = shard
+            loads[shard] += sizes[source]
+    return assignment
+
+def _build_shard(root_dir, shard_dir, files, limitmb, incremental, docstore, shingles):
+    # 在构建进程池中运行；每个分片单进程写入，并行度来自分片之间
+    return build_index(root_dir, shard_dir, procs=1, limitmb=limitmb, incremental=incremental,
+                       files=files, docstore=docstore, shingles=shingles)
+
+def build_shards(root_dir, index_dir, num_shards=2, shard_by="hash", procs=1,
+                 limitmb=DEFAULT_LIMITMB, incremental=False, docstore=False, shingles=False):
+    """
+    把数据集构建为 num_shards 个分片，最多 procs 个分片并行构建
+
+    shard_by="hash" 按文件相对路径的哈希分配文件 (文件数多时各分片大小接近)；
+    shard_by="source" 按 TDT3 来源子目录分配 (同一来源的文档在同一分片)。
+    两种方式都在构建前一次性把文件分到各分片，每个文件只被解析一次。
+    每个分片是 index_dir/shard-NN 下的普通 Whoosh 索引，各自经过临时目录原子发布；
+    查询词补全的词表汇总全部分片的词典写在 index_dir 中，分片布局文件最后写入。
+    incremental=True 且布局未变时各分片按文件指纹增量更新。
+    docstore=True 时每个分片各自带有外部正文存储，shingles=True 时各自带有二元词组字段。
+    返回本次写入的文档总数。
+    """
+    if shard_by not in SHARD_STRATEGIES:
+        raise ValueError(f"Unknown shard strategy {shard_by!r}, expected one of {SHARD_STRATEGIES}")
+    num_shards = max(1, int(num_shards))
+
+    config = {
+        "version": SHARDS_VERSION,
+        "num_shards": num_shards,
+        "shard_by": shard_by,
+        "shards": [shard_name(i) for i in range(num_shards)],
+    }
+    if shard_by == "hash":
+        # 早期的 hash 分片按 docno 分配 (没有这一项)，各分片的清单中都有全部文件，不能增量更新
+        config["hash_by"] = "file"
+
+    previous = load_shard_config(index_dir)
+    if incremental and (previous is None or previous["num_shards"] != num_shards
+                        or previous["shard_by"] != shard_by
+                        or previous.get("hash_by") != config.get("hash_by")):
+        print("Shard layout changed or missing, falling back to a full build")
+        incremental = False
+
+    os.makedirs(index_dir, exist_ok=True)
+    file_paths = list(iter_tdt3_files(root_dir))
+    shard_files = [[] for _ in range(num_shards)]
+    if shard_by == "source":
+        previous_sources = previous.get("sources") if incremental else None
+        assignment = assign_sources(file_paths, root_dir, num_shards, previous_sources)
+        config["sources"] = assignment
+        for path in file_paths:
+            shard_files[assignment[file_source(_relpath(path, root_dir))]].append(path)
+    else:
+        for path in file_paths:
+            shard_files[file_shard(_relpath(path, root_dir), num_shards)].append(path)
+    tasks = [(root_dir, os.path.join(index_dir, shard_name(i)), shard_files[i],
+              limitmb, incremental, docstore, shingles) for i in range(num_shards)]
+
+    start = time.time()
+    workers = max(1, min(procs, num_shards))
+    if workers == 1:
+        counts = [_build_shard(*task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            counts = pool.starmap(_build_shard, tasks)
+
+    build_suggestions([os.path.join(index_dir, name) for name in config["shards"]],
+                      os.path.join(index_dir, SUGGEST_FILE))
+    save_shard_config(index_dir, config)
+    # 分片数减少时删除多余的旧分片
+    if previous:
+        for name in previous["shards"][num_shards:]:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+    for name in config["shards"]:
+        invalidate_index(os.path.join(index_dir, name))
+
+    total = sum(counts)
+    elapsed = max(time.time() - start, 1e-9)
+    action = "updated" if incremental else "built"
+    print(f"Sharded index {action}: {num_shards} shards by {shard_by}, {total} docs "
+          f"({', '.join(str(c) for c in counts)})")
+    print(f"  {elapsed:.2f}s, {total / elapsed:.1f} docs/sec ({workers} parallel builders)")
+    return total
+
+class ShardHit:
+    """
+    分片查询的命中，提供与 whoosh Hit 相同的常用接口 (score / [] / get)
+
+    分片只返回 docno；其余存储字段 (正文) 在首次访问时才从本进程借出的该分片搜索器中
+    按 docno 读取，合并后落选的命中不加载。按 docno 而不是文档号查找，
+    因为执行查询的搜索器与这里的搜索器可能看到不同代的分片
+    """
+    __slots__ = ("shard", "docnum", "score", "docno", "searcher", "_fields")
+
+    def __init__(self, shard, docnum, score, docno, searcher):
+        self.shard = shard
+        self.docnum = docnum
+        self.score = score
+        self.docno = docno
+        self.searcher = searcher
+        self._fields = None
+
+    def fields(self):
+        if self._fields is None:
+            self._fields = self.searcher.document(docno=self.docno) or {"docno": self.docno}
+        return self._fields
+
+    def __getitem__(self, name):
+        return self.fields()[name]
+
+    def get(self, name, default=None):
+        return self.fields().get(name, default)
+
+class ShardedResults:
+    """
+    合并后的分片结果，接口与 whoosh Results 的常用部分一致：
+    len() 为各分片命中数之和，迭代得到按得分合并后的前 N 个命中。
+    timed_out 表示有分片因超出时间限制只返回了部分命中
+    """
+
+    def __init__(self, hits, total, exact, timed_out=False):
+        self.hits = hits
+        self.total = total
+        self.exact = exact
+        self.timed_out = timed_out
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __getitem__(self, index):
+        return self.hits[index]
+
+    def scored_length(self):
+        return len(self.hits)
+
+    def has_exact_length(self):
+        return self.exact
+
+    def estimated_length(self):
+        return self.total
+
+def _search_shard(shard_dir, query, limit, optimize, stats, deadline=None):
+    """
+    在单个分片上执行查询 (在查询进程池或本进程中运行)；
+    给出 deadline (time.time() 时间戳) 时超时后返回已收集到的命中
+    """
+    manager = get_index_manager(shard_dir)
+    timed_out = False
+    with manager.searcher(weighting=CustomScorer(stats=stats)) as searcher:
+        if deadline is None:
+            results = searcher.search(query, limit=limit, optimize=optimize)
+        else:
+            collector = TimeLimitCollector(searcher.collector(limit=limit, optimize=optimize),
+                                           timelimit=max(0.0, deadline - time.time()), use_alarm=False)
+            try:
+                searcher.search_with_collector(query, collector)
+            except TimeLimit:
+                collector.finish()
+                timed_out = True
+            results = collector.results()
+        exact = results.has_exact_length()
+        total = len(results) if exact else results.estimated_length()
+        docno = docno_lookup(searcher.reader())
+        hits = [(hit.score, hit.docnum, docno(hit.docnum)) for hit in results]
+    return hits, total, exact, timed_out
+
+class ShardedSearcher:
+    """
+    对分片索引的查询入口，search() 的用法与 whoosh Searcher.search 相同
+
+    先在本进程中汇总查询词在各分片的文档频率等统计量，再把查询和统计量
+    扇出到各分片并行执行，最后按 (得分降序, 分片号, 文档号) 合并 top-k。
+    """
+
+    def __init__(self, shard_set, searchers):
+        self.shard_set = shard_set
+        self.searchers = searchers
+        self.schema = searchers[0].schema
+
+    def collection_stats(self, query):
+        """查询涉及的词 (含通配符展开) 在整个集合上的统计量"""
+        terms = set()
+        for searcher in self.searchers:
+            terms |= query.existing_terms(searcher.reader(), expand=True)
+        doc_count = sum(searcher.doc_count_all() for searcher in self.searchers)
+        field_lengths = {}
+        for fieldname in {fieldname for fieldname, _ in terms}:
+            field_lengths[fieldname] = sum(searcher.field_length(fieldname) for searcher in self.searchers)
+        doc_frequencies = {}
+        for fieldname, text in terms:
+            if isinstance(text, str):
+                text = text.encode('utf-8')
+            doc_frequencies[(fieldname, text)] = sum(searcher.doc_frequency(fieldname, text)
+                                                     for searcher in self.searchers)
+        return CollectionStats(doc_count, field_lengths, doc_frequencies)
+
+    def document(self, **kw):
+        """按唯一字段查找文档的存储字段，与 whoosh Searcher.document 相同"""
+        for searcher in self.searchers:
+            fields = searcher.document(**kw)
+            if fields is not None:
+                return fields
+        return None
+
+    def search(self, query, limit=10, optimize=True, timelimit=None):
+        """
+        timelimit (秒) 为整个查询收集命中的时间限制，各分片 (无论并行还是依次执行)
+        在同一时刻截止，超时的分片只贡献已收集到的命中
+        """
+        deadline = time.time() + timelimit if timelimit is not None else None
+        stats = self.collection_stats(query)
+        tasks = [(shard_dir, query, limit, optimize, stats, deadline)
+                 for shard_dir in self.shard_set.shard_dirs]
+        parts = self.shard_set.map(_search_shard, tasks)
+
+        hits = []
+        total = 0
+        exact = True
+        timed_out = False
+        for shard, (shard_hits, shard_total, shard_exact, shard_timed_out) in enumerate(parts):
+            hits.extend(ShardHit(shard, docnum, score, docno, self.searchers[shard])
+                        for score, docnum, docno in shard_hits)
+            total += shard_total
+            exact = exact and shard_exact
+            timed_out = timed_out or shard_timed_out
+        hits.sort(key=lambda hit: (-hit.score, hit.shard, hit.docnum))
+        return ShardedResults(hits[:limit], total, exact, timed_out)
+
+class ShardSet:
+    """
+    一个分片索引目录：读取分片布局，提供搜索器和查询进程池
+
+    workers > 1 时各分片的查询在进程池中并行执行 (每个进程各自打开分片)，
+    否则在本进程中依次执行。布局文件变化 (重新分片) 后自动重新加载。
+    """
+
+    def __init__(self, index_dir, workers=1):
+        self.index_dir = index_dir
+        self.workers = workers
+        self.shard_dirs = []
+        self._mtime = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        mtime = os.stat(os.path.join(self.index_dir, SHARDS_FILE)).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        config = load_shard_config(self.index_dir)
+        if config is None:
+            raise FileNotFoundError(f"No usable shard layout in {self.index_dir}")
+        self.shard_dirs = [os.path.join(self.index_dir, name) for name in config["shards"]]
+        self._mtime = mtime
+
+    @property
+    def generation(self):
+        """各分片索引代号组成的元组，任一分片提交新一代后随之变化"""
+        with self._lock:
+            self._reload()
+            shard_dirs = self.shard_dirs
+        return tuple(get_index_manager(shard_dir).generation for shard_dir in shard_dirs)
+
+    @contextmanager
+    def searcher(self):
+        """从各分片的索引管理器各借出一个搜索器，组合为 ShardedSearcher"""
+        with self._lock:
+            self._reload()
+            shard_dirs = self.shard_dirs
+        with ExitStack() as stack:
+            searchers = [stack.enter_context(get_index_manager(shard_dir).searcher())
+                         for shard_dir in shard_dirs]
+            yield ShardedSearcher(self, searchers)
+
+    def docstore(self):
+        """各分片正文存储的组合 (见 docstore.py)；分片的正文作为存储字段写入索引时为 None"""
+        with self._lock:
+            self._reload()
+            shard_dirs = self.shard_dirs
+        stores = [get_docstore(shard_dir) for shard_dir in shard_dirs]
+        if not stores or None in stores:
+            return None
+        return DocStoreSet(stores)
+
+    def map(self, func, tasks):
+        if self.workers <= 1 or len(tasks) <= 1:
+            return [func(*task) for task in tasks]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     initializer=forget_managers)
+            executor = self._executor
+        futures = [executor.submit(func, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+_shard_sets = {}
+_shard_sets_lock = threading.Lock()
+
+def get_shard_set(index_dir, workers=1):
+    """返回 index_dir 对应的进程级单例 ShardSet"""
+    key = os.path.abspath(index_dir)
+    with _shard_sets_lock:
+        shard_set = _shard_sets.get(key)
+        if shard_set is None:
+            shard_set = _shard_sets[key] = ShardSet(index_dir, workers)
+        return shard_set
+
+def forget_shard_sets():
+    """在 fork 出的子进程中调用：丢弃从父进程继承的 ShardSet (及其查询进程池)"""
+    global _shard_sets, _shard_sets_lock
+    _shard_sets = {}
+    _shard_sets_lock = threading.Lock()
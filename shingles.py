@@ -0,0 +1,162 @@
+"""
+二元词组 (shingle) 字段：加速短语查询和连字符查询
+
+使用 python main.py index --shingles 构建的索引多一个 shingles 字段，
+其中每个词项是正文中相邻的两个词 (经过与 content 相同的分析器，停用词去掉后相邻)，
+例如 "hurricane mitch hit honduras" 得到 "hurricane mitch"、"mitch hit"、"hit honduras"。
+
+查询解析器把短语解析为 ShinglePhrase (见 main.content_parser)，它在索引带有该字段时:
+    两个词的短语 (包括 closed-door 这样的连字符词)   二元词项的倒排表就是短语出现的文档，不再比较位置
+    三个及以上词的短语                               先取全部二元词项都出现的文档，只对这些候选文档比较位置
+得分仍由各个词的 content 词项计算 (与 Whoosh 的 Phrase 相同，短语得分是各词得分之和)，
+二元词项只用于筛选文档，因此结果和排序与不带该字段的索引一致。
+索引没有该字段时 ShinglePhrase 与 Phrase 完全相同。
+"""
+from whoosh import formats
+from whoosh.analysis import StandardAnalyzer, ShingleFilter
+from whoosh.fields import FieldType
+from whoosh.matching import IntersectionMatcher, NullMatcher, WrappingMatcher
+from whoosh.query import Phrase, SpanNear2, Term
+from whoosh.query.spans import SpanWrappingMatcher
+from whoosh.util import make_binary_tree
+
+# 二元词组字段名，以及它所对应的正文字段
+SHINGLE_FIELD = "shingles"
+SHINGLE_SOURCE = "content"
+
+# 连接两个词的分隔符：分词器产生的词中不会出现空格
+SHINGLE_SEP = " "
+
+def shingle_field():
+    """
+    二元词组的字段类型：分析器为 content 的标准分析器加上 ShingleFilter，
+    只记录文档是否包含该词项 (不记录词频和位置、不参与评分、不存储)
+    """
+    analyzer = StandardAnalyzer() | ShingleFilter(size=2, sep=SHINGLE_SEP)
+    return FieldType(formats.Existence(), analyzer, scorable=False, stored=False)
+
+def has_shingles(schema):
+    return SHINGLE_FIELD in schema
+
+def shingle_text(first, second):
+    return f"{first}{SHINGLE_SEP}{second}"
+
+class _CandidateMatcher(WrappingMatcher):
+    """
+    只保留 candidates (二元词项倒排表的交集) 中也出现的文档，得分、得分上界等全部来自 child。
+    Whoosh 的 RequireMatcher 在 skip_to_quality 之后两个子匹配器可能停在同一文档上，
+    其中的交集匹配器随即断言失败，因此这里自行对齐
+    """
+
+    def __init__(self, child, candidates):
+        super().__init__(child)
+        self.candidates = candidates
+        self._find_next()
+
+    def _find_next(self):
+        child, candidates = self.child, self.candidates
+        while child.is_active() and candidates.is_active():
+            if candidates.id() < child.id():
+                candidates.skip_to(child.id())
+            elif child.id() < candidates.id():
+                child.skip_to(candidates.id())
+            else:
+                return
+
+    def copy(self):
+        return self.__class__(self.child.copy(), self.candidates.copy())
+
+    def is_active(self):
+        return self.child.is_active() and self.candidates.is_active()
+
+    def all_ids(self):
+        while self.is_active():
+            yield self.id()
+            self.next()
+
+    def replace(self, minquality=0):
+        if not self.is_active():
+            return NullMatcher()
+        child = self.child.replace(minquality)
+        if not child.is_active():
+            return NullMatcher()
+        if child is not self.child:
+            return self.__class__(child, self.candidates)
+        return self
+
+    def next(self):
+        self.child.next()
+        self._find_next()
+
+    def skip_to(self, id):
+        self.child.skip_to(id)
+        self._find_next()
+
+    def skip_to_quality(self, minquality):
+        skipped = self.child.skip_to_quality(minquality)
+        self._find_next()
+        return skipped
+
+class _VerifiedPhraseMatcher(SpanNear2.SpanNear2Matcher):
+    """三个及以上词的短语：各词的交集先按二元词项筛选，只在剩下的候选文档上比较位置"""
+
+    def __init__(self, ms, candidates):
+        self.ms = ms
+        self.slop = 1
+        self.ordered = True
+        self.mindist = 1
+        self.candidates = candidates
+        isect = make_binary_tree(IntersectionMatcher, ms)
+        SpanWrappingMatcher.__init__(self, _CandidateMatcher(isect, candidates))
+
+    def copy(self):
+        return self.__class__([m.copy() for m in self.ms], self.candidates.copy())
+
+class ShinglePhrase(Phrase):
+    """
+    短语查询：索引带有二元词组字段时用它筛选文档，见模块说明。
+    只处理默认的相邻短语 (slop=1)；带 ~N 的短语、单个词以及索引没有该字段时交给 Phrase
+    """
+
+    def matcher(self, searcher, context=None):
+        schema = searcher.schema
+        if (self.fieldname != SHINGLE_SOURCE or not has_shingles(schema)
+                or self.slop != 1 or len(self.words) < 2):
+            return super().matcher(searcher, context)
+
+        field = schema[self.fieldname]
+        reader = searcher.reader()
+        terms = []
+        for word in self.words:
+            try:
+                word = field.to_bytes(word)
+            except ValueError:
+                return NullMatcher()
+            if (self.fieldname, word) not in reader:
+                return NullMatcher()
+            terms.append(Term(self.fieldname, word))
+
+        # 任何一个二元词项不存在时短语不可能出现；重复的二元词项只取一次
+        bigrams = []
+        for first, second in zip(self.words, self.words[1:]):
+            bigram = shingle_text(first, second)
+            if bigram in bigrams:
+                continue
+            if (SHINGLE_FIELD, bigram) not in reader:
+                return NullMatcher()
+            bigrams.append(bigram)
+        # 二元词项只用于筛选，不需要评分器；按文档数从少到多求交
+        bigrams.sort(key=lambda bigram: reader.doc_frequency(SHINGLE_FIELD, bigram))
+        candidates = make_binary_tree(IntersectionMatcher,
+                                      [reader.postings(SHINGLE_FIELD, bigram) for bigram in bigrams])
+
+        # 得分只来自各个词的词项 (与 Phrase 的 SpanNear2 匹配器相同)
+        ms = [term.matcher(searcher, context) for term in terms]
+        if len(ms) == 2:
+            m = _CandidateMatcher(IntersectionMatcher(ms[0], ms[1]), candidates)
+        else:
+            m = _VerifiedPhraseMatcher(ms, candidates)
+
+        if self.boost != 1.0:
+            m = WrappingMatcher(m, boost=self.boost)
+        return m
@@ -8,10 +8,26 @@ $(document).ready(function() {
     // 绑定回车键触发搜索
     $('#search-input').keypress(function(event) {
         if (event.which === 13) { // 回车键的键码
+            suggestBox.hide();
             performSearch();
         }
     });
     
+    // 输入时补全最后一个词，上下键在候选中移动，Esc 或离开输入框时收起
+    $('#search-input').on('input', function() {
+        suggestBox.schedule($(this).val());
+    }).keydown(function(event) {
+        if (event.key === 'ArrowDown' || event.key === 'ArrowUp') {
+            if (suggestBox.move(event.key === 'ArrowDown' ? 1 : -1)) {
+                event.preventDefault();
+            }
+        } else if (event.key === 'Escape') {
+            suggestBox.hide();
+        }
+    }).blur(function() {
+        suggestBox.hide();
+    });
+    
     // 绑定构建索引按钮点击事件
     $('#build-index-button').click(function() {
         buildIndex();
@@ -38,32 +54,175 @@ function performSearch() {
     $('#search-status').html('<div class="loader"></div><p>正在搜索...</p>');
     $('#search-results').empty();
     
-    // 发送搜索请求
+    // 支持读取流式响应时逐条渲染，否则先取排名再按需加载摘要
+    if (window.fetch && window.ReadableStream && window.TextDecoder) {
+        streamSearch(query, topN);
+    } else {
+        fastSearch(query, topN);
+    }
+}
+
+/**
+ * 流式搜索：/search 以 NDJSON 逐行返回，第一行为命中数，
+ * 之后每行一个带摘要的结果，收到后立即追加到页面
+ * @param {string} query 查询内容
+ * @param {string} topN 结果数量
+ */
+function streamSearch(query, topN) {
+    const generation = ++searchGeneration;
+    const body = new URLSearchParams({ query: query, top_n: topN, stream: 1 });
+    fetch('/search', { method: 'POST', body: body }).then(response => {
+        if (!response.ok) {
+            return response.json().then(data => { throw new Error(data.error || '搜索请求失败'); });
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        const handleLine = line => {
+            if (!line.trim() || generation !== searchGeneration) {
+                return;
+            }
+            const item = JSON.parse(line);
+            if (item.error) {
+                throw new Error(item.error);
+            }
+            if (item.total !== undefined) {
+                showSearchSummary(query, item.total);
+                snippetLoader.reset(query);
+            } else if (item.rank !== undefined) {
+                $('#search-results').append(createResultCard(item));
+            } else if (item.done && item.partial) {
+                showPartialNotice(item.elapsed);
+            }
+        };
+        const read = () => reader.read().then(({ done, value }) => {
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.forEach(handleLine);
+            if (done) {
+                handleLine(buffer);
+                return;
+            }
+            return read();
+        });
+        return read();
+    }).catch(error => {
+        if (generation === searchGeneration) {
+            $('#search-status').html(`<p class="text-danger">${error.message || '搜索请求失败'}</p>`);
+        }
+    });
+}
+
+// 每次搜索递增，用于丢弃已被新搜索取代的响应
+let searchGeneration = 0;
+
+/**
+ * 查询词补全：停止输入 SUGGEST_DELAY 毫秒后请求 /suggest，
+ * 只显示最近一次请求的结果，点击或用上下键选中候选后以补全后的查询替换输入框内容
+ */
+const SUGGEST_DELAY = 150;
+const suggestBox = {
+    generation: 0,
+    timer: null,
+    items: [],
+    active: -1,
+    
+    schedule: function(query) {
+        clearTimeout(this.timer);
+        this.generation += 1;
+        if (!/\w$/.test(query)) {
+            this.hide();
+            return;
+        }
+        this.timer = setTimeout(() => this.fetch(query), SUGGEST_DELAY);
+    },
+    
+    fetch: function(query) {
+        const generation = this.generation;
+        $.getJSON('/suggest', { q: query }).done(response => {
+            if (generation === this.generation) {
+                this.show(response.suggestions || []);
+            }
+        });
+    },
+    
+    show: function(items) {
+        const $list = $('#suggestions').empty();
+        this.items = items;
+        this.active = -1;
+        items.forEach((item, i) => {
+            const $item = $('<button type="button" class="list-group-item list-group-item-action"></button>');
+            $item.append($('<span></span>').text(item.term));
+            $item.append($('<span class="suggestion-df"></span>').text(item.df));
+            // mousedown 先于输入框的 blur 触发，候选列表此时还未收起
+            $item.on('mousedown', event => {
+                event.preventDefault();
+                this.select(i);
+            });
+            $list.append($item);
+        });
+        $list.toggle(items.length > 0);
+    },
+    
+    move: function(step) {
+        if (!this.items.length || !$('#suggestions').is(':visible')) {
+            return false;
+        }
+        this.active = (this.active + step + this.items.length + 1) % (this.items.length + 1);
+        if (this.active === this.items.length) {
+            this.active = -1;
+        }
+        $('#suggestions').children().removeClass('active').eq(this.active).toggleClass('active', this.active >= 0);
+        if (this.active >= 0) {
+            $('#search-input').val(this.items[this.active].query);
+        }
+        return true;
+    },
+    
+    select: function(i) {
+        $('#search-input').val(this.items[i].query);
+        this.hide();
+        performSearch();
+    },
+    
+    hide: function() {
+        clearTimeout(this.timer);
+        this.generation += 1;
+        this.items = [];
+        this.active = -1;
+        $('#suggestions').hide().empty();
+    }
+};
+
+/**
+ * 快速搜索：/search 只返回排名，摘要在结果进入可视区域后再加载
+ * @param {string} query 查询内容
+ * @param {string} topN 结果数量
+ */
+function fastSearch(query, topN) {
+    const generation = ++searchGeneration;
     $.ajax({
         url: '/search',
         type: 'POST',
         data: {
             query: query,
-            top_n: topN
+            top_n: topN,
+            fast: 1
         },
         success: function(response) {
-            // 清空状态
-            $('#search-status').empty();
-            
-            // 显示搜索统计信息
-            const resultCount = response.total;
-            $('#search-status').html(
-                `<p class="mb-3">查询: <strong>${query}</strong> | 共找到 <strong>${resultCount}</strong> 条结果</p>`
-            );
-            
-            // 如果没有结果
-            if (resultCount === 0) {
-                $('#search-results').html('<div class="alert alert-info">未找到匹配的文档</div>');
+            if (generation !== searchGeneration) {
                 return;
             }
+            // 显示搜索统计信息
+            showSearchSummary(query, response.total);
             
             // 显示搜索结果
-            displayResults(response.results);
+            displayResults(response.results, query);
+            if (response.partial) {
+                showPartialNotice(response.elapsed);
+            }
         },
         error: function(xhr) {
             const errorMessage = xhr.responseJSON?.error || '搜索请求失败';
@@ -72,39 +231,171 @@ function performSearch() {
     });
 }
 
+/**
+ * 显示搜索统计信息，没有结果时给出提示
+ * @param {string} query 查询内容
+ * @param {number} resultCount 结果数量
+ */
+function showSearchSummary(query, resultCount) {
+    $('#search-status').html(
+        `<p class="mb-3">查询: <strong>${query}</strong> | 共找到 <strong>${resultCount}</strong> 条结果</p>`
+    );
+    
+    // 如果没有结果
+    if (resultCount === 0) {
+        $('#search-results').html('<div class="alert alert-info">未找到匹配的文档</div>');
+    }
+}
+
+/**
+ * 查询超出服务端时间预算时提示结果可能不完整
+ * @param {number} elapsed 查询耗时 (秒)
+ */
+function showPartialNotice(elapsed) {
+    $('#search-status').append(
+        `<p class="text-warning small">查询超出时间预算 (耗时 ${elapsed} 秒)，结果可能不完整</p>`
+    );
+}
+
 /**
  * 显示搜索结果
  * @param {Array} results 搜索结果数组
+ * @param {string} query 查询内容，用于按需加载摘要
  */
-function displayResults(results) {
+function displayResults(results, query) {
     const $resultsContainer = $('#search-results');
     $resultsContainer.empty();
+    snippetLoader.reset(query);
     
     results.forEach(result => {
-        // 创建结果卡片
-        const $resultCard = $('<div class="result-card"></div>');
-        
-        // 创建结果头部
-        const $header = $('<div class="result-header"></div>');
-        $header.append(`<h5>【${result.rank}】 ${result.docno}</h5>`);
-        $header.append(`<span class="badge bg-secondary">相关度: ${result.score}</span>`);
-        $resultCard.append($header);
-        
-        // 创建摘要部分
-        const $snippet = $('<div class="result-snippet"></div>');
-        $snippet.html(result.snippet); // 直接插入包含高亮标记的HTML
-        $resultCard.append($snippet);
-        
-        $resultsContainer.append($resultCard);
+        $resultsContainer.append(createResultCard(result));
     });
 }
 
+/**
+ * 创建一条结果卡片；结果不带摘要时交给 snippetLoader 按需加载
+ * @param {Object} result 单条搜索结果
+ */
+function createResultCard(result) {
+    // 创建结果卡片
+    const $resultCard = $('<div class="result-card"></div>');
+    
+    // 创建结果头部
+    const $header = $('<div class="result-header"></div>');
+    $header.append(`<h5>【${result.rank}】 ${result.docno}</h5>`);
+    $header.append(`<span class="badge bg-secondary">相关度: ${result.score}</span>`);
+    $resultCard.append($header);
+    
+    // 创建摘要部分
+    const $snippet = $('<div class="result-snippet"></div>');
+    // 超出时间预算时服务端不生成摘要 (snippet 为 null)，同样改为按需加载
+    if (result.snippet !== undefined && result.snippet !== null) {
+        $snippet.html(result.snippet); // 直接插入包含高亮标记的HTML
+    } else {
+        $snippet.html('<span class="text-muted">正在加载摘要...</span>');
+        $snippet.attr('data-docno', result.docno);
+        snippetLoader.observe($snippet[0]);
+    }
+    $resultCard.append($snippet);
+    return $resultCard;
+}
+
+/**
+ * 摘要的按需加载：结果卡片进入可视区域后收集其 docno，
+ * 按 SNIPPET_BATCH 个一组并行请求 /snippets
+ */
+const SNIPPET_BATCH = 5;
+const snippetLoader = {
+    query: null,
+    generation: 0,
+    pending: [],
+    timer: null,
+    observer: null,
+    
+    reset: function(query) {
+        this.query = query;
+        this.generation += 1;
+        this.pending = [];
+        if (this.observer) {
+            this.observer.disconnect();
+        }
+        if ('IntersectionObserver' in window) {
+            this.observer = new IntersectionObserver(entries => {
+                entries.forEach(entry => {
+                    if (entry.isIntersecting) {
+                        this.observer.unobserve(entry.target);
+                        this.enqueue(entry.target);
+                    }
+                });
+            }, { rootMargin: '200px' });
+        }
+    },
+    
+    observe: function(element) {
+        if (this.observer) {
+            this.observer.observe(element);
+        } else {
+            this.enqueue(element);  // 不支持 IntersectionObserver 时直接加载
+        }
+    },
+    
+    enqueue: function(element) {
+        this.pending.push(element);
+        if (!this.timer) {
+            // 同一轮进入可视区域的卡片合并后再分组请求
+            this.timer = setTimeout(() => this.flush(), 0);
+        }
+    },
+    
+    flush: function() {
+        this.timer = null;
+        const query = this.query;
+        const generation = this.generation;
+        const elements = this.pending;
+        this.pending = [];
+        for (let i = 0; i < elements.length; i += SNIPPET_BATCH) {
+            const group = elements.slice(i, i + SNIPPET_BATCH);
+            $.ajax({
+                url: '/snippets',
+                type: 'POST',
+                contentType: 'application/json',
+                data: JSON.stringify({
+                    query: query,
+                    docnos: group.map(element => element.dataset.docno)
+                }),
+                success: function(response) {
+                    // 请求返回前已经开始了新的搜索时丢弃结果
+                    if (generation !== snippetLoader.generation) {
+                        return;
+                    }
+                    group.forEach(element => {
+                        const snippet = response.snippets[element.dataset.docno];
+                        $(element).html(snippet !== undefined ? snippet : '<span class="text-muted">无法获取摘要</span>');
+                    });
+                },
+                error: function() {
+                    group.forEach(element => {
+                        $(element).html('<span class="text-danger">摘要加载失败</span>');
+                    });
+                }
+            });
+        }
+    }
+};
+
 /**
  * 构建索引
  */
 function buildIndex() {
     const dataDir = $('#data-dir').val().trim();
     const indexDir = $('#index-dir').val().trim();
+    const procs = $('#index-procs').val();
+    const limitmb = $('#index-limitmb').val();
+    const incremental = $('#index-incremental').is(':checked');
+    const docstore = $('#index-docstore').is(':checked');
+    const shingles = $('#index-shingles').is(':checked');
+    const shards = $('#index-shards').val();
+    const shardBy = $('#index-shard-by').val();
     
     // 验证目录不为空
     if (!dataDir || !indexDir) {
@@ -113,26 +404,68 @@ function buildIndex() {
     }
     
     // 显示加载状态
-    $('#index-status').html('<div class="loader"></div><p>正在构建索引，这可能需要几分钟时间...</p>');
+    $('#index-status').html('<div class="loader"></div><p>正在提交索引构建任务...</p>');
     $('#build-index-button').prop('disabled', true);
     
-    // 发送构建索引请求
+    // 提交后台构建任务，随后轮询任务进度
     $.ajax({
         url: '/build_index',
         type: 'POST',
         data: {
             data_dir: dataDir,
-            index_dir: indexDir
+            index_dir: indexDir,
+            procs: procs,
+            limitmb: limitmb,
+            incremental: incremental,
+            docstore: docstore,
+            shingles: shingles,
+            shards: shards,
+            shard_by: shardBy
         },
         success: function(response) {
-            $('#index-status').html(`<p class="text-success">${response.message}</p>`);
+            pollBuildStatus(response.status_url);
         },
         error: function(xhr) {
+            // 409: 该目录已有任务在运行，继续跟踪该任务
+            if (xhr.status === 409 && xhr.responseJSON?.status_url) {
+                pollBuildStatus(xhr.responseJSON.status_url);
+                return;
+            }
             const errorMessage = xhr.responseJSON?.error || '索引构建失败';
             $('#index-status').html(`<p class="text-danger">${errorMessage}</p>`);
-        },
-        complete: function() {
             $('#build-index-button').prop('disabled', false);
         }
     });
+}
+
+/**
+ * 轮询后台构建任务状态并显示进度
+ * @param {string} statusUrl 任务状态接口地址
+ */
+function pollBuildStatus(statusUrl) {
+    $.getJSON(statusUrl, function(job) {
+        if (job.status === 'done') {
+            $('#index-status').html(`<p class="text-success">${job.message} (耗时 ${job.elapsed}s)</p>`);
+            $('#build-index-button').prop('disabled', false);
+            return;
+        }
+        if (job.status === 'failed') {
+            $('#index-status').html(`<p class="text-danger">索引构建失败: ${job.error}</p>`);
+            $('#build-index-button').prop('disabled', false);
+            return;
+        }
+        
+        const percent = job.files_total ? Math.floor(job.files_done * 100 / job.files_total) : 0;
+        const eta = job.eta !== null ? `，预计剩余 ${job.eta}s` : '';
+        $('#index-status').html(
+            `<div class="loader"></div>` +
+            `<p>正在构建索引 (${job.phase || '准备中'}): 文件 ${job.files_done}/${job.files_total} (${percent}%)，` +
+            `已解析 ${job.docs_parsed} 篇，已索引 ${job.docs_indexed} 篇，${job.throughput} 篇/秒${eta}</p>`
+        );
+        setTimeout(function() { pollBuildStatus(statusUrl); }, 1000);
+    }).fail(function(xhr) {
+        const errorMessage = xhr.responseJSON?.error || '无法获取构建进度';
+        $('#index-status').html(`<p class="text-danger">${errorMessage}</p>`);
+        $('#build-index-button').prop('disabled', false);
+    });
 } 
\ No newline at end of file
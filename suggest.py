@@ -0,0 +1,209 @@
+"""
+查询词自动补全：按前缀从 content 字段的词表中取文档频率最高的若干个词
+
+    suggest.idx   按字典序排列的全部词、各词的文档频率，以及在文档频率上建好的线段树
+
+构建索引时从 content 字段的词典生成 (见 index_builder.build_index，分片索引由 shards.build_shards
+汇总各分片的词典写在索引根目录)，与索引一起发布，增量更新后重新生成。
+
+查询时先二分查找出以前缀开头的词所在的区间，再用线段树 (每个节点记录其区间内文档频率
+最大的词的序号) 依次取出区间内文档频率最高的词：取出一个词后把区间在它两侧拆开继续查找，
+取 limit 个词只需 O(limit · log n) 次比较，与区间大小无关。
+"""
+import bisect
+import heapq
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+
+SUGGEST_FILE = "suggest.idx"
+
+# 只收录至少出现在这么多篇文档中的词，只出现过一次的词 (拼写错误、编号等) 不作为补全候选
+MIN_DOC_FREQUENCY = 2
+
+# 查询中最后一个正在输入的词 (前面是空白、引号或连字符)；只在查询末尾这么多个字符中查找
+LAST_WORD = re.compile(r'(\w+)$')
+MAX_PREFIX_LENGTH = 64
+
+_MAGIC = b"TDT3SUGG"
+_VERSION = 1
+# 标识, 版本, 词数
+_HEADER = struct.Struct("<8sII")
+
+def _to_disk(values):
+    # 与正文存储的偏移表一样统一使用小端字节序
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_disk(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def _build_tree(frequencies):
+    """
+    自底向上的线段树：tree[n + i] = i，tree[j] 为两个子节点中文档频率较大者 (相同时取字典序靠前的词)。
+    区间 [lo, hi) 的最大值由 _range_max 在 O(log n) 个节点中求得
+    """
+    n = len(frequencies)
+    tree = array("I", bytes(4 * 2 * n))
+    for i in range(n):
+        tree[n + i] = i
+    for j in range(n - 1, 0, -1):
+        left, right = tree[2 * j], tree[2 * j + 1]
+        tree[j] = left if frequencies[left] >= frequencies[right] else right
+    return tree
+
+def write_suggestions(path, frequencies):
+    """
+    frequencies 为 {词: 文档频率}；先写临时文件再替换，查询方不会读到半截的文件
+
+    Returns:
+        int: 收录的词数
+    """
+    terms = sorted(term for term, df in frequencies.items() if df >= MIN_DOC_FREQUENCY)
+    dfs = array("I", (frequencies[term] for term in terms))
+    tree = _build_tree(dfs)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(terms)))
+        f.write(_to_disk(dfs))
+        f.write(_to_disk(tree))
+        f.write("\n".join(terms).encode("utf-8"))
+    os.replace(tmp_path, path)
+    return len(terms)
+
+def index_frequencies(reader, fieldname="content", frequencies=None):
+    """把读取器中 fieldname 字段各词的文档频率累加到 frequencies (分片索引时依次累加各分片)"""
+    frequencies = {} if frequencies is None else frequencies
+    for text, info in reader.iter_field(fieldname):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+        frequencies[text] = frequencies.get(text, 0) + info.doc_frequency()
+    return frequencies
+
+def build_suggestions(index_dirs, path):
+    """从 index_dirs 中各个 Whoosh 索引的 content 词典生成补全文件 path"""
+    from whoosh.index import open_dir
+
+    frequencies = {}
+    for index_dir in index_dirs:
+        with open_dir(index_dir).reader() as reader:
+            index_frequencies(reader, frequencies=frequencies)
+    return write_suggestions(path, frequencies)
+
+class Suggester:
+    """只读的补全词表，complete() 可以在多个线程间共享"""
+
+    def __init__(self, path):
+        stat = os.stat(path)
+        # 文件被替换 (重建或增量更新) 后 version 随之变化，见 get_suggester
+        self.version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, n = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a suggestion file of version {_VERSION}")
+        pos = _HEADER.size
+        self.frequencies = _from_disk("I", data[pos:pos + 4 * n])
+        pos += 4 * n
+        self.tree = _from_disk("I", data[pos:pos + 8 * n])
+        pos += 8 * n
+        self.terms = data[pos:].decode("utf-8").split("\n") if n else []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _range_max(self, lo, hi):
+        """区间 [lo, hi) 中文档频率最大的词的序号"""
+        tree, dfs, n = self.tree, self.frequencies, len(self.terms)
+        best = -1
+        lo += n
+        hi += n
+        while lo < hi:
+            if lo & 1:
+                best = _better(dfs, best, tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = _better(dfs, best, tree[hi])
+            lo >>= 1
+            hi >>= 1
+        return best
+
+    def complete(self, prefix, limit=10):
+        """以 prefix 开头的词中文档频率最高的 limit 个，返回 [(词, 文档频率)]，按文档频率从高到低"""
+        if not prefix or limit <= 0 or not self.terms:
+            return []
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = bisect.bisect_left(self.terms, prefix + "\U0010ffff", lo)
+        if lo >= hi:
+            return []
+        dfs = self.frequencies
+        best = self._range_max(lo, hi)
+        heap = [(-dfs[best], best, lo, hi)]
+        results = []
+        while heap and len(results) < limit:
+            negdf, i, lo, hi = heapq.heappop(heap)
+            results.append((self.terms[i], -negdf))
+            for a, b in ((lo, i), (i + 1, hi)):
+                if a < b:
+                    j = self._range_max(a, b)
+                    heapq.heappush(heap, (-dfs[j], j, a, b))
+        return results
+
+def _better(dfs, a, b):
+    if a < 0:
+        return b
+    if dfs[b] > dfs[a] or (dfs[b] == dfs[a] and b < a):
+        return b
+    return a
+
+def suggest(suggester, query_str, limit=10):
+    """
+    补全查询中最后一个正在输入的词 (小写，与标准分析器一致)；查询以空白结尾时没有补全
+
+    Returns:
+        list: [{"term", "df", "query"}]，query 为用该词替换最后一个词后的完整查询
+    """
+    match = LAST_WORD.search(query_str[-MAX_PREFIX_LENGTH:])
+    if suggester is None or match is None:
+        return []
+    prefix = match.group(1)
+    head = query_str[:len(query_str) - len(prefix)]
+    return [{"term": term, "df": df, "query": head + term}
+            for term, df in suggester.complete(prefix.lower(), limit)]
+
+_suggesters = {}
+_suggesters_lock = threading.Lock()
+
+def get_suggester(index_dir):
+    """
+    index_dir 的补全词表 (进程内共享)，没有补全文件 (在此之前构建的索引) 时返回 None。
+    每次调用检查文件，被替换后重新读取
+    """
+    key = os.path.abspath(index_dir)
+    path = os.path.join(index_dir, SUGGEST_FILE)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _suggesters_lock:
+        suggester = _suggesters.get(key)
+    if suggester is not None and suggester.version == version:
+        return suggester
+    try:
+        suggester = Suggester(path)
+    except FileNotFoundError:
+        return None
+    with _suggesters_lock:
+        _suggesters[key] = suggester
+    return suggester
@@ -0,0 +1,241 @@
+import os
+import threading
+import numpy as np
+import whoosh
+from whoosh.codec.whoosh3 import W3LeafMatcher
+from whoosh.matching import FilterMatcher
+from whoosh.query import And, Or, Term
+from custom_scorer import CustomScorer
+
+class VectorIndex:
+    """
+    content 字段倒排表的内存 CSR 表示，用 NumPy 批量计算 CustomScorer 的 BM25 得分
+
+    offsets[i]:offsets[i+1] 是第 i 个词的倒排区间，docids 为全局文档号 (升序)，
+    impacts 为该词对文档的得分贡献 idf * tf * (K1 + 1) / (tf + norm[doc])。
+    IDF 和长度归一化项在导出时按 CustomBM25Scorer 相同的统计量和运算顺序算好，
+    因此查询时只剩数组的取片、求交和求和。
+    """
+
+    def __init__(self, vocab, offsets, docids, impacts, idf, norms, doc_count, generation):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docids = docids
+        self.impacts = impacts
+        self.idf = idf
+        self.norms = norms
+        self.doc_count = doc_count
+        self.generation = generation
+
+    @classmethod
+    def from_reader(cls, reader, fieldname="content", model=None):
+        """从 Whoosh 读取器导出 fieldname 字段的全部倒排表"""
+        model = model or CustomScorer()
+        M = reader.doc_count_all()
+        avgdl = (reader.field_length(fieldname) / M if M else 0) or 1
+        # 与评分器相同：长度取自 doc_field_length (有损编码后的长度)，缺省为 1
+        lengths = np.array([reader.doc_field_length(docnum, fieldname, 1) for docnum in range(M)],
+                           dtype=np.float64)
+        norms = model.K1 * (1 - model.B + model.B * lengths / avgdl)
+        alive = np.zeros(M, dtype=bool)
+        alive[np.fromiter(reader.all_doc_ids(), dtype=np.int64)] = True
+        leaves = reader.leaf_readers()
+
+        vocab = {}
+        offsets = [0]
+        idf = []
+        docid_chunks = []
+        tf_chunks = []
+        for text in reader.field_terms(fieldname):
+            id_parts = []
+            weight_parts = []
+            for leaf, base in leaves:
+                if (fieldname, text) in leaf:
+                    leaf_ids, leaf_weights = _read_postings(leaf.postings(fieldname, text))
+                    id_parts.append(np.array(leaf_ids, dtype=np.int32) + base)
+                    weight_parts.append(np.array(leaf_weights, dtype=np.float64))
+            if not id_parts:
+                continue
+            ids = np.concatenate(id_parts)
+            weights = np.concatenate(weight_parts)
+            live = alive[ids]
+            if not live.all():
+                ids, weights = ids[live], weights[live]
+            if not len(ids):
+                continue    # 只出现在已删除文档中的词
+            vocab[text] = len(idf)
+            idf.append(model.idf(M, reader.doc_frequency(fieldname, text)))
+            docid_chunks.append(ids)
+            tf_chunks.append(weights)
+            offsets.append(offsets[-1] + len(ids))
+
+        idf = np.array(idf, dtype=np.float64)
+        offsets = np.array(offsets, dtype=np.int64)
+        docids = np.concatenate(docid_chunks) if docid_chunks else np.zeros(0, dtype=np.int32)
+        tfs = np.concatenate(tf_chunks) if tf_chunks else np.zeros(0, dtype=np.float64)
+        term_idf = np.repeat(idf, np.diff(offsets))
+        impacts = term_idf * ((tfs * (model.K1 + 1)) / (tfs + norms[docids]))
+        return cls(vocab, offsets, docids, impacts, idf, norms, M, reader.generation())
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.offsets, self.docids, self.impacts, self.idf, self.norms))
+
+    def postings(self, text):
+        """返回 (文档号数组, 得分贡献数组)，词不存在时返回 None"""
+        row = self.vocab.get(text)
+        if row is None:
+            return None
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.docids[start:end], self.impacts[start:end]
+
+    def search(self, terms, limit=10, conjunctive=True):
+        """
+        对词列表打分并返回前 limit 个 (文档号, 得分)
+
+        Args:
+            terms: 查询词列表 (已经过分析器处理)
+            limit: 结果数限制
+            conjunctive: True 为 AND (文档须包含全部词)，False 为 OR
+
+        Returns:
+            list: 按得分降序、同分按文档号升序排列的 (文档号, 得分) 列表
+        """
+        lists = [self.postings(text) for text in terms]
+        if conjunctive:
+            if not lists or any(p is None for p in lists):
+                return []
+            # 从最短的倒排表开始逐个求交
+            lists.sort(key=lambda p: len(p[0]))
+            ids, scores = lists[0][0], lists[0][1].copy()
+            for other_ids, other_scores in lists[1:]:
+                ids, left, right = np.intersect1d(ids, other_ids, assume_unique=True,
+                                                  return_indices=True)
+                scores = scores[left] + other_scores[right]
+                if not len(ids):
+                    return []
+        else:
+            lists = [p for p in lists if p is not None]
+            if not lists:
+                return []
+            all_ids = np.concatenate([p[0] for p in lists])
+            totals = np.bincount(all_ids, weights=np.concatenate([p[1] for p in lists]),
+                                 minlength=self.doc_count)
+            ids = np.flatnonzero(np.bincount(all_ids, minlength=self.doc_count))
+            scores = totals[ids]
+        return top_k(ids, scores, limit)
+
+# 按块读取倒排表用到 W3LeafMatcher 的内部属性 (_ids、_weights、_next_block)，
+# 只在验证过的 Whoosh 2.7.x 上使用 (整体导出快约 1.5 倍)，其他版本走公开的 items_as("weight")
+_BLOCK_READS = whoosh.__version__[:2] == (2, 7) and all(
+    hasattr(W3LeafMatcher, name) for name in ("_next_block", "_read_ids", "_read_weights"))
+
+def _read_postings(matcher):
+    """
+    读取一个段内某个词的倒排表，返回 (段内文档号列表, 权重列表)。
+    Whoosh 3 格式的倒排表按块整体解码，避免逐个 posting 调用 id() / weight()；
+    删除文档的过滤包装被去掉，由调用方用存活掩码统一过滤
+    """
+    if isinstance(matcher, FilterMatcher):
+        matcher = matcher.child
+    ids = []
+    weights = []
+    if not (_BLOCK_READS and isinstance(matcher, W3LeafMatcher)):
+        for docnum, weight in matcher.items_as("weight"):
+            ids.append(docnum)
+            weights.append(weight)
+        return ids, weights
+    while matcher.is_active():
+        matcher.id()        # 触发当前块的文档号和权重解码
+        matcher.weight()
+        ids.extend(matcher._ids)
+        weights.extend(matcher._weights)
+        matcher._next_block()
+    return ids, weights
+
+def top_k(ids, scores, limit):
+    """argpartition 选出前 limit 名；边界上的同分文档全部保留后再按 (得分降序, 文档号升序) 排序"""
+    if limit <= 0 or not len(ids):
+        return []
+    if len(ids) > limit:
+        part = np.argpartition(-scores, limit - 1)
+        threshold = scores[part[limit - 1]]
+        keep = np.flatnonzero(scores >= threshold)
+        ids, scores = ids[keep], scores[keep]
+    order = np.lexsort((ids, -scores))[:limit]
+    return [(int(ids[i]), float(scores[i])) for i in order]
+
+def query_terms(query, fieldname="content"):
+    """
+    把解析后的查询转换为 (词列表, 是否为 AND)。
+    只支持单个词项或由词项组成的 AND / OR，其余查询 (短语、带权重、跨字段等) 返回 None
+    """
+    if type(query) is Term:
+        clauses, conjunctive = [query], True
+    elif type(query) in (And, Or) and query.boost == 1:
+        clauses, conjunctive = query.subqueries, type(query) is And
+    else:
+        return None
+    if not conjunctive and (query.scale or query.minmatch):
+        return None     # 带协调因子或最少匹配数的 OR 组不是简单求和
+    terms = []
+    for clause in clauses:
+        if type(clause) is not Term or clause.fieldname != fieldname or clause.boost != 1:
+            return None
+        terms.append(clause.text)
+    return terms, conjunctive
+
+# 每个 (索引目录, 字段) 保留最新的几代：切换期间仍在使用上一代搜索器的查询不必重新导出
+KEEP_GENERATIONS = 2
+
+_vectors = {}       # (索引目录, 字段) → {代号: VectorIndex}
+_exporting = {}     # (索引目录, 字段, 代号) → threading.Event，正在导出的代
+_vectors_lock = threading.Lock()
+
+def get_vector_index(index_dir, searcher, fieldname="content"):
+    """
+    返回与 searcher 所见索引代号一致的 VectorIndex；
+    同一索引目录的同一代只导出一次，新一代出现后在首次查询时重新导出。
+    导出在锁外进行，期间其他代的查询不受影响，同一代的查询等待这一次导出完成
+    """
+    key = (os.path.abspath(index_dir), fieldname)
+    reader = searcher.reader()
+    generation = reader.generation()
+    while True:
+        with _vectors_lock:
+            vectors = _vectors.get(key, {}).get(generation)
+            if vectors is not None:
+                return vectors
+            done = _exporting.get(key + (generation,))
+            if done is None:
+                done = _exporting[key + (generation,)] = threading.Event()
+                break
+        # 导出失败时等待者重新检查，由其中一个接着导出
+        done.wait()
+
+    try:
+        vectors = VectorIndex.from_reader(reader, fieldname)
+        with _vectors_lock:
+            generations = _vectors.setdefault(key, {})
+            generations[generation] = vectors
+            for old in sorted(generations)[:-KEEP_GENERATIONS]:
+                del generations[old]
+        return vectors
+    finally:
+        with _vectors_lock:
+            del _exporting[key + (generation,)]
+        done.set()
+
+def vector_search(index_dir, searcher, query, limit=10, fieldname="content"):
+    """
+    用向量化引擎执行 query；查询形式不受支持时返回 None，由调用方退回 Whoosh
+
+    Returns:
+        list: (文档号, 得分) 列表，或 None
+    """
+    converted = query_terms(query, fieldname)
+    if converted is None:
+        return None
+    terms, conjunctive = converted
+    vectors = get_vector_index(index_dir, searcher, fieldname)
+    return vectors.search(terms, limit=limit, conjunctive=conjunctive)